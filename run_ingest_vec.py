@@ -8,25 +8,51 @@
 import argparse
 import numpy as np
 from scripts.match_tools import *
+from scripts.disk_index import disk_index
+from scripts.feat_store_array import feat_store_array
 from scripts.feat_store_dict import feat_store_dict
+from scripts.feat_store_mmap import feat_store_mmap
 from scripts.hash_store_dict import hash_store_dict
 from scripts.lsh_vec import lsh_vec
 import cPickle as pickle
 import gzip
+import json
+import sys
 
 # Main driver: command line interface
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Ingest vectors and produce a data store.")
-    parser.add_argument("--list", type=str, help="List of '<key> <filename>' pairs of vectors to ingest", required=True)
+    parser.add_argument("--list", type=str, help="List of '<key> <filename>' pairs of vectors to ingest", required=False, default=None)
+    parser.add_argument("--matrix", type=str, help="Single .npy or raw binary matrix of vectors to ingest, one per row (instead of --list)", required=False, default=None)
+    parser.add_argument("--keys", type=str, help="Keys for the rows of --matrix, one per line", required=False, default=None)
     parser.add_argument("--precision", type=str, help="precision -- float or double", required=False, default='float')
     parser.add_argument("--outfile", type=str, help="output file for the HashStore", required=True)
     parser.add_argument("--num_bits", type=int, help="number of bits for each hash function", required=True)
+    parser.add_argument("--dim", type=int, help="dimension of the vectors (optional)", required=False, default=None)
+    parser.add_argument("--vec_store", type=str, help="path of a new on-disk vector store to keep the normalized vectors in (optional)", required=False, default=None)
+    parser.add_argument("--storage", type=str, help="storage for the vectors in the feat store -- float32, float16 or int8 (optional)", required=False, default=None)
+    parser.add_argument("--threshold", type=float, help="cosine similarity threshold -- tune the index bands for it (optional)", required=False, default=None)
+    parser.add_argument("--recall", type=float, help="recall at --threshold for tuning the index bands", required=False, default=0.9)
+    parser.add_argument("--sorted_index", action='store_true', help="build sorted array indexes (create_sorted_indexes) instead of dictionaries")
+    parser.add_argument("--compress_index", action='store_true', help="with --sorted_index, delta + varint code the posting lists")
+    parser.add_argument("--disk_index", action='store_true', help="with --matrix, build the index out of core as files with prefix --outfile (see disk_index) instead of saving a pickled HashStore")
+    parser.add_argument("--memory_mb", type=float, help="memory budget in MB of the --disk_index build", required=False, default=256)
+    parser.add_argument("--proj_file", type=str, help="projection matrix .npy file shared across runs; requires --dim to create (optional)", required=False, default=None)
 
     args = parser.parse_args()
     list_fn = args.list
+    matrix_fn = args.matrix
+    keys_fn = args.keys
     precision_str = args.precision
     out_fn = args.outfile
     num_bits = args.num_bits
+    dim = args.dim
+    proj_fn = args.proj_file
+    vec_store_fn = args.vec_store
+    storage = args.storage
+    threshold = args.threshold
+    recall = args.recall
+    sorted_index = args.sorted_index
 
     if precision_str=='float':
         precision = np.float32
@@ -34,22 +60,82 @@ if __name__ == '__main__':
         precision = np.float64
     else:
         raise ValueError('Unknown precision for vector: {}'.format(precision_str))
+    if (list_fn is None) == (matrix_fn is None):
+        parser.error('exactly one of --list or --matrix is required')
+    if (matrix_fn is not None) and (keys_fn is None):
+        parser.error('--keys is required with --matrix')
+    if args.disk_index and (matrix_fn is None):
+        parser.error('--disk_index requires --matrix')
 
     # Configuration for feature store 
     config_feat = '[{"type": "vec", "name": "vector"}]'
     fs_class = feat_store_dict
-    config = {'precision':precision, 'normalize':True}
+    config_store = config_feat
+    if (vec_store_fn is not None):
+        config_store = json.dumps([{"type": "vec", "name": "vector", "path": vec_store_fn}])
+        fs_class = feat_store_mmap
+    elif (storage=='int8'):
+        fs_class = feat_store_array
+    config = {'precision':precision, 'normalize':True, 'storage':storage}
     limit = None
 
-    # Create vec feature store
-    fs = read_vec_features_from_list (list_fn, config_feat, fs_class, config, limit)
-
     # Create hash stores
-    print 'Creating LSH tables ...'
     lsh_classes = {'vector':lsh_vec}
     lsh_configs = {'vector':{"method":"rp_acos", "seed":25, "num_functions":6, "num_bits":num_bits, "verbose":True}}
-    hs = create_hash_from_fs (fs, lsh_classes, lsh_configs, hash_store_dict, config_feat)
+    if dim is not None:
+        lsh_configs['vector']['dim'] = dim
+    if proj_fn is not None:
+        lsh_configs['vector']['matrix_file'] = proj_fn
     num_fns_per_band = 1
+    if args.disk_index:
+        # Out-of-core ingest -- hash the matrix in chunks straight into an on-disk index
+        X = open_vec_matrix(matrix_fn, precision, dim)
+        num_fns = lsh_configs['vector']['num_functions']
+        slices = [(i, i+num_fns_per_band) for i in xrange(0, num_fns-num_fns_per_band+1, num_fns_per_band)]
+        if (threshold is not None):
+            # Tune the bands on a seeded random sample of up to 10000 rows (not the first rows -- the input may be
+            # sorted or clustered); rows are drawn without a permutation of all rows, and keys are streamed
+            num_sample = min(X.shape[0], 10000)
+            prng = np.random.RandomState(lsh_configs['vector']['seed'])
+            rows = np.zeros(0, dtype=np.int64)
+            while (len(rows) < num_sample):
+                rows = np.unique(np.concatenate((rows, prng.randint(0, X.shape[0], size=num_sample-len(rows)))))
+            row_set = set(rows.tolist())
+            sample_keys = [ky for (i, ky) in enumerate(iter_keys(keys_fn)) if (i in row_set)]
+            hs = create_hash_from_vec_matrix (X[rows], sample_keys, lsh_vec, lsh_configs['vector'], hash_store_dict, config_feat)
+            slices = hs.tune_slices(threshold, recall, {'vector':lsh_vec(lsh_configs['vector']).collision_prob}, verbose=True)['vector']
+            del hs
+        print 'Creating LSH index on disk with prefix : {}'.format(out_fn)
+        create_disk_index_from_vec_matrix (X, iter_keys(keys_fn), lsh_vec, lsh_configs['vector'], out_fn, slices, args.memory_mb, compress=args.compress_index)
+        if (vec_store_fn is not None):
+            print 'Saving vectors to : {}'.format(vec_store_fn)
+            config['dim'] = X.shape[1]
+            fs = read_vec_features_from_matrix (matrix_fn, keys_fn, config_store, fs_class, config, limit)
+            fs.close()
+
+        # Try a retrieval
+        di = disk_index(out_fn)
+        hv = lsh_vec(lsh_configs['vector']).encode(X[0]/np.linalg.norm(X[0]))
+        print 'retrieving things close to hash for key: {}'.format(di.item_keys.key_at(0))
+        print 'result: {}'.format(di.retrieve('vector', hv))
+        sys.exit(0)
+    if (matrix_fn is not None):
+        # Bulk ingest -- normalize and hash the memory mapped matrix in chunks
+        X = open_vec_matrix(matrix_fn, precision, dim)
+        keys = read_keys(keys_fn)
+        print 'Creating LSH tables ...'
+        hs = create_hash_from_vec_matrix (X, keys, lsh_vec, lsh_configs['vector'], hash_store_dict, config_feat)
+        if (vec_store_fn is not None):
+            print 'Saving vectors to : {}'.format(vec_store_fn)
+            config['dim'] = X.shape[1]
+            fs = read_vec_features_from_matrix (matrix_fn, keys_fn, config_store, fs_class, config, limit)
+            fs.close()
+    else:
+        # Create vec feature store; vectors are hashed as they are read, before the storage cast
+        print 'Creating vec feature store and LSH tables ...'
+        hs = hash_store_dict(config_feat)
+        fs = read_vec_features_from_list (list_fn, config_store, fs_class, config, limit, hs, lsh_classes['vector'](lsh_configs['vector']))
+        fs.close()
 
     # Try out a hash
     key_list = hs.keys()
@@ -60,7 +146,13 @@ if __name__ == '__main__':
     # Create indices
     print 'Creating indexes for tables ...'
     num_fns = lsh_configs['vector']['num_functions']
-    hs.create_indexes(num_fns_per_band)
+    slices = None
+    if (threshold is not None):
+        slices = hs.tune_slices(threshold, recall, {'vector':lsh_vec(lsh_configs['vector']).collision_prob}, verbose=True)
+    if sorted_index:
+        hs.create_sorted_indexes(num_fns_per_band, slices, compress=args.compress_index)
+    else:
+        hs.create_indexes(num_fns_per_band, slices)
 
     # Try a retrieval
     item_num = 0
@@ -6,6 +6,9 @@ Perform clustering using canopies -- a list of sets that cover all keys in the d
 """
 
 import copy
+from key_dict import key_dict
+import numpy as np
+import pool_tools
 
 # BC, 6/2015
 
@@ -72,6 +75,193 @@ def canopy_gac (d, canopy, threshold, lc, verbose=False):
         clust_out.append(c)
     return clust_out
 
+class union_find(object):
+    """
+    Disjoint sets over the int ids 0, ..., n-1 with path compression and union by rank, kept in int32 arrays
+
+    Typical usage:
+    >>> uf = union_find(5)
+    >>> uf.union_many([0, 3], [1, 4])
+    >>> uf.components()    # [array([0, 1]), array([2]), array([3, 4])]
+    """
+
+    INIT_CAPACITY = 1024
+
+    def __init__ (self, n=0):
+        """n : number of ids; add() appends more"""
+        capacity = max(n, union_find.INIT_CAPACITY)
+        self.parent = np.arange(capacity, dtype=np.int32)
+        self.rank = np.zeros(capacity, dtype=np.int32)
+        self.num = n
+        self.num_sets = n
+
+    def add (self, num=1):
+        """uf.add(num=1) -> first of 'num' new ids, each in its own set"""
+        first = self.num
+        self.__grow(first+num)
+        self.num += num
+        self.num_sets += num
+        return first
+
+    def find (self, i):
+        """uf.find(i) -> representative id of the set of i"""
+        if (i < 0) or (i >= self.num):
+            raise IndexError('union_find: id {} out of range'.format(i))
+        parent = self.parent
+        root = i
+        while (parent[root]!=root):
+            root = parent[root]
+        while (parent[i]!=root):
+            (parent[i], i) = (root, parent[i])
+        return int(root)
+
+    def union (self, i, j):
+        """uf.union(i, j) -> True if the sets of i and j were merged, False if they were already the same set"""
+        ri = self.find(i)
+        rj = self.find(j)
+        if (ri==rj):
+            return False
+        rank = self.rank
+        if (rank[ri] < rank[rj]):
+            (ri, rj) = (rj, ri)
+        self.parent[rj] = ri
+        if (rank[ri]==rank[rj]):
+            rank[ri] += 1
+        self.num_sets -= 1
+        return True
+
+    def union_many (self, ids1, ids2):
+        """
+        uf.union_many(ids1, ids2) merges the sets of ids1[k] and ids2[k] for all k
+
+        Vectorized in rounds: the larger root of every pair not yet in one set is linked to the smallest
+        root it is paired with, and the paths of the linked roots are compressed by pointer jumping.
+        """
+        ids1 = np.asarray(ids1, dtype=np.int64)
+        ids2 = np.asarray(ids2, dtype=np.int64)
+        if (len(ids1)!=len(ids2)):
+            raise ValueError('union_find: ids1 and ids2 have different lengths')
+        if (len(ids1)==0):
+            return
+        if (min(ids1.min(), ids2.min()) < 0) or (max(ids1.max(), ids2.max()) >= self.num):
+            raise IndexError('union_find: id out of range')
+        parent = self.parent
+        rank = self.rank
+        r1 = self.__roots(ids1)
+        r2 = self.__roots(ids2)
+        while True:
+            keep = (r1!=r2)
+            if (not keep.any()):
+                break
+            r1 = r1[keep]
+            r2 = r2[keep]
+            lo = np.minimum(r1, r2)
+            hi = np.maximum(r1, r2)
+            linked = np.unique(hi)
+            np.minimum.at(parent, hi, lo)
+            while True:
+                p = parent[linked]
+                pp = parent[p]
+                if np.array_equal(p, pp):
+                    break
+                parent[linked] = pp
+            np.maximum.at(rank, parent[linked], rank[linked]+1)
+            self.num_sets -= len(linked)
+            r1 = parent[r1]
+            r2 = parent[r2]
+
+    def labels (self):
+        """uf.labels() -> int array with the representative id of the set of each id"""
+        return self.__roots(np.arange(self.num))
+
+    def components (self):
+        """uf.components() -> list of sorted id arrays, one per set, ordered by smallest id"""
+        lab = self.labels()
+        order = np.argsort(lab, kind='mergesort')
+        bounds = np.nonzero(np.diff(lab[order]))[0]+1
+        comps = np.split(order, bounds) if (len(order) > 0) else []
+        comps.sort(key=lambda c: c[0])
+        return comps
+
+    def __len__ (self):
+        return self.num
+
+    def __roots (self, ids):
+        # Roots of ids by pointer jumping; ids then point at their roots
+        parent = self.parent
+        r = parent[ids]
+        while True:
+            pr = parent[r]
+            if np.array_equal(pr, r):
+                break
+            r = pr
+        parent[ids] = r
+        return r
+
+    def __grow (self, num):
+        if (num <= len(self.parent)):
+            return
+        capacity = len(self.parent)
+        while (capacity < num):
+            capacity *= 2
+        parent = np.arange(capacity, dtype=np.int32)
+        parent[0:self.num] = self.parent[0:self.num]
+        rank = np.zeros(capacity, dtype=np.int32)
+        rank[0:self.num] = self.rank[0:self.num]
+        self.parent = parent
+        self.rank = rank
+
+def threshold_components (d, threshold):
+    """
+    Single-linkage clustering at a threshold as the connected components of the graph with an edge
+    for every distance below threshold.  Near-linear time with union-find instead of the repeated
+    dmin scans of canopy_gac.
+
+    clust = threshold_components(d, threshold)
+
+    d = Sparse distance function in dictionary of dictionaries, e.g., from match_tools.compute_sparse_distances
+    threshold = float; keys i and j are linked if d[i][j] < threshold
+
+    output:
+    clust = list of sets -- each set is a cluster; every key of d is in one cluster
+
+    canopy_gac with 'single' also requires merged clusters to share a canopy, so its clusters can be finer.
+    """
+    kd = key_dict(d.iterkeys())
+    ids1 = []
+    ids2 = []
+    for (ky, row) in d.iteritems():
+        near = [ky2 for (ky2, dval) in row.iteritems() if (dval < threshold)]
+        if (len(near) > 0):
+            ids1.extend([kd.lookup(ky)]*len(near))
+            ids2.extend(kd.intern_many(near).tolist())
+    uf = union_find(len(kd))
+    uf.union_many(ids1, ids2)
+    return [set(kd.to_keys(c)) for c in uf.components()]
+
+def pair_components (pairs, keys=None):
+    """
+    Connected components of a stream of pairs, e.g., the verified pairs of an LSH match step.
+
+    clust = pair_components(pairs, keys=None)
+
+    pairs = iterable of (key1, key2); filter by score before passing pairs in
+    keys = (optional) keys to include as singletons when they are in no pair
+
+    output:
+    clust = list of sets -- each set is a cluster
+
+    For int ids already (e.g., match_output.match_reader columns), use union_find directly:
+    uf = union_find(len(mr.key_dict)); uf.union_many(mr.key1, mr.key2)
+    """
+    kd = key_dict(keys)
+    uf = union_find(len(kd))
+    for block in pool_tools.chunk_iter(pairs, 2**16):
+        ids = kd.intern_many([ky for pr in block for ky in pr])
+        uf.add(len(kd)-len(uf))
+        uf.union_many(ids[0::2], ids[1::2])
+    return [set(kd.to_keys(c)) for c in uf.components()]
+
 def _compute_row(d_clust, d, ki, c_idx, c_inv_idx, clust, lc):
     # recompute row given key 'ki'
     d_clust[ki] = {}
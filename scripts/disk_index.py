@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+
+"""
+Out-of-core banded LSH index -- built with an external sort under a memory budget and read back with
+memory mapped arrays
+"""
+
+from bitarray import bitarray
+import json
+import numpy as np
+import os
+import postings
+import shutil
+import tempfile
+from hash_store_dict import _band_keys, _code_array, _query_band_key
+
+class disk_index_builder(object):
+    """
+    Builds the sorted array index of hash_store_dict.create_sorted_indexes on disk without holding all
+    codes or (band key, item id) pairs in memory.
+
+    Items are added in batches and get ids 0, 1, 2, ... in order.  For each band the (band key, item id)
+    pairs are collected in memory; when the buffered pairs of all bands reach the memory budget, each band
+    is sorted and spilled to a run file in a temporary directory.  close() merges the runs of each band
+    in blocks (a k-way merge) into the final files and removes the temporary files; after an error, call
+    abort() to remove them.
+
+    Files written for prefix <p>:
+    - <p>.json: features, bands and key types
+    - <p>.keys: item keys, utf-8, one per line; the line number is the item id
+    - <p>.keys.offsets: int64 byte offsets of the lines of <p>.keys, and the file size
+    - <p>.<feature>.<band>.keys, .offsets, .postings: sorted unique band keys, int64 offsets of each key's
+      postings, and the postings (int32 item ids, or delta + varint bytes with compress=True)
+
+    Typical usage:
+    >>> ib = disk_index_builder('index/vec', {'vector':[(0,1), (1,2)]}, memory_mb=512)
+    >>> ib.add_batch(keys, {'vector':lsh.encode_batch(X)})
+    >>> ib.close()
+    >>> di = disk_index('index/vec')
+    """
+
+    def __init__(self, prefix, slices, memory_mb=256, tmp_dir=None, compress=False):
+        """
+        prefix : prefix of the output files
+        slices : dictionary of feature name to a list of bands (start, stop), e.g., from tune_slices
+        memory_mb : memory budget in MB for the buffered pairs during the build and the blocks during the merge
+        tmp_dir : (optional) directory for the run files; default is next to the output files
+        compress : if True, delta + varint code the posting lists (see postings.py)
+        """
+        self.prefix = prefix
+        self.slices = dict([(nm, [tuple(sl) for sl in sls]) for (nm, sls) in slices.iteritems()])
+        self.memory = int(memory_mb*2**20)
+        self.compress = compress
+        if (tmp_dir is None):
+            tmp_dir = os.path.dirname(os.path.abspath(prefix))
+        self.tmp_dir = tempfile.mkdtemp(prefix='disk_index_', dir=tmp_dir)
+        self.bands = [(nm, b) for nm in sorted(self.slices) for b in xrange(0, len(self.slices[nm]))]
+        self.key_dtype = {}
+        self.buf = dict([(band, []) for band in self.bands])
+        self.num_buffered = 0
+        self.runs = dict([(band, []) for band in self.bands])
+        self.num_items = 0
+        self.key_file = open(prefix + '.keys', 'wb')
+        self.key_offset_file = open(prefix + '.keys.offsets', 'wb')
+        self.key_offset_file.write(np.zeros(1, dtype=np.int64).tobytes())
+        self.key_bytes = 0
+
+    def add_batch(self, keys, codes):
+        """ib.add_batch(keys, codes) adds items; codes is a dictionary of feature name to a list with the hash
+        codes of each key (e.g., from lsh_vec.encode_batch); None codes are not indexed"""
+        lines = []
+        for ky in keys:
+            if not isinstance(ky, basestring):
+                ky = unicode(ky)
+            if ('\n' in ky):
+                raise ValueError('disk_index_builder: keys cannot contain newlines')
+            if isinstance(ky, unicode):
+                ky = ky.encode('utf-8')
+            lines.append(ky + '\n')
+        self.key_file.write(''.join(lines))
+        ends = np.cumsum([len(ln) for ln in lines], dtype=np.int64)+self.key_bytes
+        self.key_offset_file.write(ends.tobytes())
+        if (len(lines) > 0):
+            self.key_bytes = int(ends[-1])
+        ids = np.arange(self.num_items, self.num_items+len(keys), dtype=np.int32)
+        self.num_items += len(keys)
+        for nm in self.slices:
+            rows = [i for (i, c) in enumerate(codes[nm]) if (c is not None)]
+            if (len(rows)==0):
+                continue
+            code_arr = _code_array([codes[nm][i] for i in rows])
+            for (b, sl) in enumerate(self.slices[nm]):
+                band_keys = _band_keys(code_arr, sl)
+                if ((nm, b) not in self.key_dtype):
+                    self.key_dtype[(nm, b)] = band_keys.dtype
+                elif (band_keys.dtype != self.key_dtype[(nm, b)]):
+                    raise ValueError('disk_index_builder: codes of feature {} changed size'.format(nm))
+                self.buf[(nm, b)].append((band_keys, ids[rows]))
+            self.num_buffered += len(rows)*sum([self.key_dtype[(nm, b)].itemsize+4 for b in xrange(0, len(self.slices[nm]))])
+        # Sorting needs about twice the buffered bytes
+        if (2*self.num_buffered >= self.memory):
+            self.__spill()
+
+    def close(self):
+        """ib.close() merges the runs into the final index files and removes the temporary files"""
+        try:
+            self.key_file.close()
+            self.key_offset_file.close()
+            if (self.num_buffered > 0):
+                self.__spill()
+            meta = {'num_items':self.num_items, 'compressed':self.compress, 'features':{}}
+            for nm in sorted(self.slices):
+                meta['features'][nm] = {'slices':[list(sl) for sl in self.slices[nm]], 'bands':[]}
+                for b in xrange(0, len(self.slices[nm])):
+                    dtype = self.key_dtype.get((nm, b), np.dtype(np.uint64))
+                    num_keys = self.__merge_band(nm, b, dtype)
+                    meta['features'][nm]['bands'].append({'key_dtype':dtype.str, 'num_keys':num_keys})
+            meta_file = open(self.prefix + '.json', 'w')
+            json.dump(meta, meta_file)
+            meta_file.close()
+        finally:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def abort(self):
+        """ib.abort() stops a build after an error -- closes the key files and removes the temporary files;
+        no index is written"""
+        self.key_file.close()
+        self.key_offset_file.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def __spill(self):
+        # Sort the buffered pairs of each band by (band key, item id) and write them as a run
+        for band in self.bands:
+            if (len(self.buf[band])==0):
+                continue
+            keys = np.concatenate([k for (k, i) in self.buf[band]])
+            ids = np.concatenate([i for (k, i) in self.buf[band]])
+            self.buf[band] = []
+            # ids are added in increasing order, so a stable sort by key keeps them sorted within a key
+            order = np.argsort(keys, kind='mergesort')
+            fn = os.path.join(self.tmp_dir, 'run{}.{}.{}'.format(len(self.runs[band]), band[0], band[1]))
+            np.save(fn + '.keys.npy', keys[order])
+            np.save(fn + '.ids.npy', ids[order])
+            self.runs[band].append(fn)
+        self.num_buffered = 0
+
+    def __merge_band(self, nm, b, dtype):
+        # k-way merge of the runs of one band into the final files; returns the number of unique keys
+        runs = [(np.load(fn + '.keys.npy', mmap_mode='r'), np.load(fn + '.ids.npy', mmap_mode='r')) for fn in self.runs[(nm, b)]]
+        block_size = max(1024, self.memory/(3*max(1, len(runs))*(dtype.itemsize+4)))
+        fn = '{}.{}.{}'.format(self.prefix, nm, b)
+        writer = _band_writer(fn, self.compress)
+        for (keys, ids) in _merge_runs(runs, block_size):
+            writer.write(keys, ids)
+        num_keys = writer.close()
+        del runs
+        for run_fn in self.runs[(nm, b)]:
+            os.remove(run_fn + '.keys.npy')
+            os.remove(run_fn + '.ids.npy')
+        return num_keys
+
+class disk_index(object):
+    """
+    Reads an index written by disk_index_builder.  The band keys, offsets and postings stay on disk as
+    memory mapped arrays; retrieve and retrieve_ids work as for hash_store_dict after create_sorted_indexes.
+    The item keys are read from disk as needed (see disk_keys).
+    """
+
+    def __init__(self, prefix):
+        """prefix : prefix given to disk_index_builder"""
+        meta_file = open(prefix + '.json', 'r')
+        meta = json.load(meta_file)
+        meta_file.close()
+        self.index_compressed = meta['compressed']
+        self.item_keys = disk_keys(prefix)
+        if (len(self.item_keys) != meta['num_items']):
+            raise ValueError('disk_index: {}.keys has {} keys for {} items'.format(prefix, len(self.item_keys), meta['num_items']))
+        self.slices = {}
+        self.sorted_index = {}
+        post_dtype = np.uint8 if self.index_compressed else np.int32
+        for (nm, x) in meta['features'].iteritems():
+            self.slices[nm] = [tuple(sl) for sl in x['slices']]
+            self.sorted_index[nm] = []
+            for (b, band) in enumerate(x['bands']):
+                fn = '{}.{}.{}'.format(prefix, nm, b)
+                self.sorted_index[nm].append((_open_array(fn + '.keys', np.dtype(str(band['key_dtype']))),
+                                              _open_array(fn + '.offsets', np.int64),
+                                              _open_array(fn + '.postings', post_dtype)))
+
+    def names(self):
+        """di.names() -> list of feature names"""
+        return self.slices.keys()
+
+    def retrieve_ids(self, feat_nm, ht_list):
+        """retrieve_ids(feat_nm, ht_list) -> list with a sorted array of item ids for each band with a match"""
+        if (ht_list is None):
+            return []
+        result = []
+        chunks = []
+        is_bitarray = isinstance(ht_list[0], bitarray)
+        for (sl, (band_keys, offsets, ids)) in zip(self.slices[feat_nm], self.sorted_index[feat_nm]):
+            if (len(band_keys)==0):
+                continue
+            ky = _query_band_key(ht_list, sl, is_bitarray, band_keys.dtype)
+            i = np.searchsorted(band_keys, ky)
+            if (i < len(band_keys)) and (band_keys[i]==ky):
+                if self.index_compressed:
+                    chunks.append(np.asarray(ids[offsets[i]:offsets[i+1]]))
+                else:
+                    result.append(np.asarray(ids[offsets[i]:offsets[i+1]]))
+        if self.index_compressed:
+            result = postings.decode_many(chunks)
+        return result
+
+    def retrieve(self, feat_nm, ht_list):
+        """retrieve(feat_nm, ht_list) -> list with a set of keys for each band with a match"""
+        return [set(self.item_keys.to_keys(ids)) for ids in self.retrieve_ids(feat_nm, ht_list)]
+
+class disk_keys(object):
+    """
+    Item keys of a disk index, read as needed from <p>.keys through the memory mapped line offsets in
+    <p>.keys.offsets, so the keys of a large index are not held in memory.  Keys are returned as unicode.
+    """
+
+    def __init__(self, prefix):
+        """prefix : prefix given to disk_index_builder"""
+        self.offsets = _open_array(prefix + '.keys.offsets', np.int64)
+        self.data = _open_array(prefix + '.keys', np.uint8)
+        if (len(self.offsets)==0) or (self.offsets[-1] != len(self.data)):
+            raise ValueError('disk_keys: {}.keys.offsets does not match {}.keys'.format(prefix, prefix))
+
+    def key_at(self, i):
+        """dk.key_at(i) -> key with id i"""
+        if (i < 0) or (i >= len(self)):
+            raise IndexError('disk_keys: id {} out of range'.format(i))
+        return self.data[self.offsets[i]:self.offsets[i+1]-1].tobytes().decode('utf-8')
+
+    def to_keys(self, ids):
+        """dk.to_keys(ids) -> list of the keys for an array of ids"""
+        return [self.key_at(i) for i in np.asarray(ids, dtype=np.int64).tolist()]
+
+    def __len__(self):
+        return len(self.offsets)-1
+
+class _band_writer(object):
+    # Writes the sorted (band key, item id) pairs of one band as unique keys, offsets and postings, a block
+    # at a time.  A posting list can span blocks: the offset of a key is written when the next key starts,
+    # and with compress the last id is carried over so the delta coding continues in the next block.
+
+    def __init__(self, fn, compress):
+        self.compress = compress
+        self.key_file = open(fn + '.keys', 'wb')
+        self.offset_file = open(fn + '.offsets', 'wb')
+        self.post_file = open(fn + '.postings', 'wb')
+        self.offset_file.write(np.zeros(1, dtype=np.int64).tobytes())
+        self.total = 0
+        self.num_keys = 0
+        self.last_key = None
+        self.last_id = None
+
+    def write(self, keys, ids):
+        if (len(keys)==0):
+            return
+        new = np.ones(len(keys), dtype=bool)
+        new[1:] = (keys[1:]!=keys[:-1])
+        cont = (self.num_keys > 0) and (keys[0]==self.last_key)
+        new[0] = not cont
+        starts = np.nonzero(new)[0]
+        if self.compress:
+            # The list continued from the last block is the group before the first start
+            bounds = np.concatenate(([0], starts[starts > 0], [len(keys)])).astype(np.int64)
+            (data, byte_bounds) = postings.encode_groups(ids, bounds, self.last_id if cont else None)
+            self.post_file.write(data.tobytes())
+            pos = byte_bounds[1:-1] if cont else byte_bounds[0:-1]
+            size = int(byte_bounds[-1])
+        else:
+            self.post_file.write(np.asarray(ids, dtype=np.int32).tobytes())
+            pos = starts
+            size = len(ids)
+        # A new key's start is the end offset of the key before it
+        pos = pos.astype(np.int64)+self.total
+        if (self.num_keys==0):
+            pos = pos[1:]
+        self.offset_file.write(pos.tobytes())
+        self.key_file.write(keys[starts].tobytes())
+        self.total += size
+        self.num_keys += len(starts)
+        self.last_key = keys[-1]
+        self.last_id = ids[-1]
+
+    def close(self):
+        if (self.num_keys > 0):
+            self.offset_file.write(np.array([self.total], dtype=np.int64).tobytes())
+        for f in [self.key_file, self.offset_file, self.post_file]:
+            f.close()
+        return self.num_keys
+
+def _merge_runs(runs, block_size):
+    # Merge runs sorted by (key, id) a block at a time.  Each round reads up to block_size pairs of every
+    # run and outputs the pairs up to the smallest last pair of the runs that are not finished; those are
+    # all smaller than any pair not read yet.
+    pos = [0]*len(runs)
+    while True:
+        live = [r for r in xrange(0, len(runs)) if (pos[r] < len(runs[r][0]))]
+        if (len(live)==0):
+            return
+        blocks = []
+        cut = None
+        for r in live:
+            end = min(pos[r]+block_size, len(runs[r][0]))
+            (k, i) = (np.asarray(runs[r][0][pos[r]:end]), np.asarray(runs[r][1][pos[r]:end]))
+            blocks.append((r, k, i))
+            if (end < len(runs[r][0])) and ((cut is None) or ((k[-1], i[-1]) < cut)):
+                cut = (k[-1], i[-1])
+        keys = []
+        ids = []
+        for (r, k, i) in blocks:
+            if (cut is None):
+                n = len(k)
+            else:
+                n = int(np.count_nonzero((k < cut[0]) | ((k==cut[0]) & (i <= cut[1]))))
+            keys.append(k[0:n])
+            ids.append(i[0:n])
+            pos[r] += n
+        keys = np.concatenate(keys)
+        ids = np.concatenate(ids)
+        order = np.argsort(ids, kind='mergesort')
+        order = order[np.argsort(keys[order], kind='mergesort')]
+        yield (keys[order], ids[order])
+
+def _open_array(fn, dtype):
+    if (os.path.getsize(fn)==0):
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(fn, dtype=dtype, mode='r')
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+
+"""
+Implementation of the interface feat_store using columnar NumPy arrays
+"""
+
+import json
+import numpy as np
+from key_dict import key_dict
+import vec_quant
+
+class feat_store_array(object):
+    """
+    Implementation of feature storage using columns
+
+    Same duck typed interface as feat_store_dict.  Each record is a row; the key_dict attribute maps keys
+    to rows, so row numbers can be used as ids in other stores (see hash_store_dict.create_sorted_indexes).
+    Each "vec" feature is a contiguous 2-D array (grown by doubling), each "int" feature is a 1-D int64
+    array, and each "str" feature is a list.  Rows are kept in insertion order.
+
+    The methods that should be implemented are:
+    - Constructor: feat_store(config_str)
+    - Iterator methods: __iter__, next
+    - add(key, value)
+    - names(), keys(), close()
+    - __getitem__(key)  -- for general data store not an efficient method -- use iterators whenever possible
+
+    Additional methods implemented for this version:
+    - add_batch(keys, values) -- add many records at once
+    - get_many(keys, name) -- values of a feature for a list of keys, in one call
+    - num_rows(), row(key), key_at(row)
+    - get_rows(name, start, stop) -- rows start:stop of a feature as a view (no copy) for "vec" and "int"
+    - get_quantized(name, start, stop) -- (int8 rows, scales) of an "int8" vec feature
+
+    The config file for open should be JSON and contain the following fields:
+    - "features": These are the features to be processed, their name, and type.
+      [{"type": "str", "name": "feat1"}, {"type": "int", "name": "feat2"}, {"type": "vec", "name": "feat3"}]
+    - types are "str", "int", and "vec"
+    - "vec" features may also give "dim" and "dtype" (e.g., "float32"); otherwise these are taken from the
+      first vector added
+    - dtype "int8" stores each vector as int8 values and a float32 scale (see vec_quant); reads dequantize
+      to float32 and get_rows returns a copy
+    - int and vec features missing from an added item are 0; str features are None
+    """
+
+    INIT_CAPACITY = 1024
+    VEC_DTYPES = vec_quant.STORAGE_TYPES
+
+    def __init__(self, config_str=None):
+        """x.__init__(config_str) initializes feature store with JSON string parameters"""
+        if config_str!=None:
+            self.config = json.loads(config_str)
+            self.feat_names = set([x['name'] for x in self.config])
+            self.feat_types = dict([(x['name'], x['type']) for x in self.config])
+            self.vec_dtypes = dict([(x['name'], str(x['dtype'])) for x in self.config if ('dtype' in x)])
+            self.key_dict = key_dict()
+            self.capacity = 0
+            self.cols = {}
+            self.scales = {}
+            for x in self.config:
+                if (x['type'] not in ['str', 'int', 'vec']):
+                    raise ValueError('feat_store_array: unknown feature type {}'.format(x['type']))
+                if (x['type']=='vec') and ('dtype' in x) and (x['dtype'] not in feat_store_array.VEC_DTYPES):
+                    raise ValueError('feat_store_array: unknown dtype {}'.format(x['dtype']))
+                if (x['type']=='vec') and (x.get('dtype')=='int8'):
+                    self.scales[x['name']] = np.empty(0, dtype=np.float32)
+                if (x['type']=='str'):
+                    self.cols[x['name']] = []
+                elif (x['type']=='vec') and ('dim' in x):
+                    if ('dtype' in x):
+                        dtype = np.dtype(str(x['dtype']))
+                    else:
+                        dtype = np.dtype(np.float64)
+                    self.cols[x['name']] = np.empty((0, x['dim']), dtype=dtype)
+                elif (x['type']=='int'):
+                    self.cols[x['name']] = np.empty(0, dtype=np.int64)
+                else:
+                    self.cols[x['name']] = None
+
+    def add(self, key, y):
+        """x.add(key, y) adds y to feature store with key 'key'"""
+        self.__check_add(y)
+        if (key in self.key_dict):
+            i = self.key_dict.lookup(key)
+        else:
+            i = len(self.key_dict)
+            self.__reserve(i+1, y)
+            self.key_dict.intern(key)
+            for nm in self.feat_names:
+                if (self.feat_types[nm]=='str'):
+                    self.cols[nm].append(None)
+        for (nm, val) in y.iteritems():
+            if (nm in self.scales):
+                (self.cols[nm][i], self.scales[nm][i]) = vec_quant.quantize_int8(val)
+            else:
+                self.cols[nm][i] = val
+
+    def add_batch(self, keys, values):
+        """x.add_batch(keys, values) adds records for a list of keys; values is a dictionary of feature name to
+        a sequence (a 2-D array for "vec" features) with one entry per key"""
+        self.__check_add(values)
+        num = len(keys)
+        if (num==0):
+            return
+
+        # Check every column before reserving, interning or writing anything
+        for (nm, val) in values.iteritems():
+            if (len(val) != num):
+                raise ValueError('feat_store_array: feature {} has {} entries for {} keys'.format(nm, len(val), num))
+            if (self.feat_types[nm]=='vec'):
+                v = np.asarray(val)
+                dim = self.cols[nm].shape[1] if (self.cols[nm] is not None) else v.shape[-1]
+                if (v.ndim != 2) or (v.shape[1] != dim):
+                    raise ValueError('feat_store_array: expected {} rows of dimension {} for feature {}'.format(num, dim, nm))
+            elif (self.feat_types[nm]=='int') and (np.ndim(val) != 1):
+                raise ValueError('feat_store_array: expected {} values for feature {}'.format(num, nm))
+        new_keys = set(keys)
+        if (len(new_keys) < num) or any([(ky in self.key_dict) for ky in keys]):
+            # Repeated keys -- add one at a time so later values overwrite earlier ones
+            for j in xrange(0, num):
+                self.add(keys[j], dict([(nm, values[nm][j]) for nm in values]))
+            return
+        i1 = len(self.key_dict)
+        first = dict([(nm, values[nm][0]) for nm in values])
+        self.__reserve(i1+num, first)
+        self.key_dict.intern_many(keys)
+        for nm in self.feat_names:
+            if (self.feat_types[nm]=='str'):
+                if (nm in values):
+                    self.cols[nm].extend(values[nm])
+                else:
+                    self.cols[nm].extend([None]*num)
+            elif (nm in self.scales) and (nm in values):
+                (self.cols[nm][i1:i1+num], self.scales[nm][i1:i1+num]) = vec_quant.quantize_int8(values[nm])
+            elif (nm in values):
+                self.cols[nm][i1:i1+num] = values[nm]
+
+    def close(self):
+        """x.close() closes the feature store -- in this case does nothing"""
+        return
+
+    def get_rows(self, name, start, stop):
+        """x.get_rows(name, start, stop) -> values of feature 'name' for rows start:stop; a view for "vec" and "int" """
+        stop = min(stop, len(self.key_dict))
+        if (name in self.scales):
+            return vec_quant.dequantize(self.cols[name][start:stop], self.scales[name][start:stop])
+        return self.cols[name][start:stop]
+
+    def get_quantized(self, name, start, stop):
+        """x.get_quantized(name, start, stop) -> (int8 rows, float32 scales) views for rows start:stop of an int8 vec feature"""
+        stop = min(stop, len(self.key_dict))
+        return (self.cols[name][start:stop], self.scales[name][start:stop])
+
+    def get_many(self, keys, name):
+        """x.get_many(keys, name) -> values of feature 'name' for a list of keys; a 2-D array for "vec" """
+        rows = [self.key_dict.lookup(ky) for ky in keys]
+        if (self.feat_types[name]=='str'):
+            return [self.cols[name][i] for i in rows]
+        rows = np.array(rows, dtype=np.int64)
+        if (name in self.scales):
+            return vec_quant.dequantize(self.cols[name][rows], self.scales[name][rows])
+        return self.cols[name][rows]
+
+    def key_at(self, i):
+        """x.key_at(i) -> key for row i"""
+        return self.key_dict.key_at(i)
+
+    def num_rows(self):
+        """x.num_rows() -> number of records"""
+        return len(self.key_dict)
+
+    def row(self, key):
+        """x.row(key) -> row number of key"""
+        return self.key_dict.lookup(key)
+
+    def __check_add(self, y):
+        if not hasattr(self, 'config'):
+            raise ValueError('feat_store_array: must provide configuration before using a feature store')
+        if (type(y) is not dict):
+            raise ValueError('feat_store_array: item added to feat store must be a dictionary')
+        for ky in y:
+            if (ky not in self.feat_names):
+                raise ValueError('feat_store_array: configuration specified feature names not used in add()')
+
+    def __reserve(self, num, y):
+        # Make sure the arrays can hold 'num' rows; the first vector added fixes dim and dtype if not configured
+        for nm in self.feat_names:
+            if (self.feat_types[nm]=='vec') and (self.cols[nm] is None):
+                if (nm not in y):
+                    raise ValueError('feat_store_array: first item added must include vec feature {}'.format(nm))
+                v = np.asarray(y[nm])
+                self.cols[nm] = np.empty((0, v.shape[-1]), dtype=self.vec_dtypes.get(nm, v.dtype))
+        if (num <= self.capacity):
+            return
+        capacity = max(self.capacity, feat_store_array.INIT_CAPACITY)
+        while (capacity < num):
+            capacity *= 2
+        for nm in self.feat_names:
+            if (self.feat_types[nm]=='str'):
+                continue
+            old = self.cols[nm]
+            new = np.zeros((capacity,)+old.shape[1:], dtype=old.dtype)
+            new[0:len(self.key_dict)] = old[0:len(self.key_dict)]
+            self.cols[nm] = new
+        for nm in self.scales:
+            new = np.zeros(capacity, dtype=np.float32)
+            new[0:len(self.key_dict)] = self.scales[nm][0:len(self.key_dict)]
+            self.scales[nm] = new
+        self.capacity = capacity
+
+    def __getitem__(self, i):
+        """x.__getitem__(i) <==> x[i]"""
+        if not hasattr(self, 'config'):
+            raise Exception('feat_store_array: must provide configuration before using a feature store')
+        return self.__record(self.key_dict.lookup(i))
+
+    def __record(self, i):
+        rec = {}
+        for nm in self.feat_names:
+            if (nm in self.scales):
+                rec[nm] = vec_quant.dequantize(self.cols[nm][i], self.scales[nm][i])
+            else:
+                rec[nm] = self.cols[nm][i]
+        return rec
+
+    def __iter__(self):
+        """x.__iter__() <==> iter(x)"""
+        self.iter = iter(xrange(0, len(self.key_dict)))
+        return self
+
+    def keys(self):
+        """x.keys() returns list of keys"""
+        return self.key_dict.keys()
+
+    def names(self):
+        """x.keys() returns list of feature names"""
+        return self.feat_names
+
+    def next(self):
+        """x.next() -> the next value, or raise StopIteration"""
+        if not hasattr(self, 'config'):
+            raise Exception('feat_store_array: must provide configuration before using a feature store')
+        try:
+            i = self.iter.next()
+            return (self.key_dict.key_at(i), self.__record(i))
+        except StopIteration:
+            raise StopIteration()
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+
+"""
+Implementation of the interface feat_store using memory mapped files on disk
+"""
+
+import json
+import numpy as np
+from key_dict import key_dict
+import os
+import vec_quant
+
+class feat_store_mmap(object):
+    """
+    Implementation of feature storage for raw vectors in append-only files
+
+    Each "vec" feature is a raw matrix file of float32, float16 or int8 rows that is read with np.memmap,
+    so vectors are not held in RAM and the store persists after ingest.  Keys are appended, one
+    per line, to a key file; the line number is the row and the key_dict attribute maps keys to rows.
+    Reopening a store with the same config continues where it left off.
+
+    The methods that should be implemented are:
+    - Constructor: feat_store(config_str)
+    - Iterator methods: __iter__, next
+    - add(key, value)
+    - names(), keys(), close()
+    - __getitem__(key)  -- for general data store not an efficient method -- use iterators whenever possible
+
+    Additional methods implemented for this version:
+    - add_batch(keys, values) -- add many records at once
+    - get_many(keys, name) -- matrix of the vectors for a list of keys, in one call
+    - num_rows(), row(key), key_at(row)
+    - get_rows(name, start, stop) -- rows start:stop of a feature as a memory mapped view
+    - get_quantized(name, start, stop) -- (int8 rows, scales) of an "int8" feature as memory mapped views
+
+    The config file for open should be JSON and contain the following fields:
+    - "features": These are the features to be processed, their name, and type.
+      [{"type": "vec", "name": "vector", "path": "datastore/vectors.f32", "dim": 300, "dtype": "float32"}]
+    - only "vec" features are supported; "path" is required
+    - "dim" is optional -- it is taken from the first vector added or from an existing store
+    - "dtype" is "float32" (default), "float16" or "int8".  int8 stores per-vector scaled values (see vec_quant)
+      with the float32 scales in <path>.scale; reads dequantize to float32, so get_rows returns a copy
+    - the key file is <path>.keys for the first feature; keys are stored as utf-8 text and read back as
+      strings.  The store is append-only, so adding an existing key is an error.
+    """
+
+    VEC_DTYPES = ('float32', 'float16', 'int8')
+
+    def __init__(self, config_str=None):
+        """x.__init__(config_str) initializes feature store with JSON string parameters"""
+        if config_str!=None:
+            self.config = json.loads(config_str)
+            self.feat_names = set([x['name'] for x in self.config])
+            self.feat_conf = {}
+            for x in self.config:
+                if (x['type']!='vec'):
+                    raise ValueError('feat_store_mmap: only vec features are supported')
+                if ('path' not in x):
+                    raise ValueError('feat_store_mmap: path is required for feature {}'.format(x['name']))
+                self.feat_conf[x['name']] = x
+            self.key_fn = self.config[0]['path'] + '.keys'
+
+            # Read existing keys and matrix layouts
+            self.key_dict = key_dict()
+            if os.path.exists(self.key_fn):
+                key_file = open(self.key_fn, 'r')
+                self.key_dict.intern_many([ln.rstrip('\n').decode('utf-8') for ln in key_file])
+                key_file.close()
+            self.dim = {}
+            self.dtype = {}
+            for nm in self.feat_names:
+                self.__open_layout(nm)
+
+            self.mats = {}
+            self.mat_rows = 0
+            self.mat_files = None
+            self.key_file = None
+
+    def __open_layout(self, nm):
+        # Layout (dim, dtype) comes from the meta file of an existing store, then the config
+        x = self.feat_conf[nm]
+        meta_fn = x['path'] + '.json'
+        meta = {}
+        if os.path.exists(meta_fn):
+            meta_file = open(meta_fn, 'r')
+            meta = json.load(meta_file)
+            meta_file.close()
+        for fld in ['dim', 'dtype']:
+            if (fld in x) and (fld in meta) and (x[fld]!=meta[fld]):
+                raise ValueError('feat_store_mmap: {} of {} is {}, config has {}'.format(fld, x['path'], meta[fld], x[fld]))
+        if ('dtype' in meta):
+            dtype = meta['dtype']
+        elif ('dtype' in x):
+            dtype = x['dtype']
+        else:
+            dtype = 'float32'
+        if (dtype not in feat_store_mmap.VEC_DTYPES):
+            raise ValueError('feat_store_mmap: unknown dtype {}'.format(dtype))
+        self.dtype[nm] = np.dtype(str(dtype))
+        if ('dim' in meta):
+            self.dim[nm] = meta['dim']
+        elif ('dim' in x):
+            self.dim[nm] = x['dim']
+        else:
+            self.dim[nm] = None
+        if (self.dim[nm] is not None):
+            self.__write_meta(nm)
+            # Drop a partially written last row, or rows without a key, after a crash
+            files = [(x['path'], self.dim[nm]*self.dtype[nm].itemsize)]
+            if (self.dtype[nm]==np.int8):
+                files.append((x['path'] + '.scale', 4))
+            for (fn, row_bytes) in files:
+                if os.path.exists(fn) and (os.path.getsize(fn) != len(self.key_dict)*row_bytes):
+                    if (os.path.getsize(fn) < len(self.key_dict)*row_bytes):
+                        raise ValueError('feat_store_mmap: {} has fewer rows than keys'.format(fn))
+                    mat_file = open(fn, 'r+b')
+                    mat_file.truncate(len(self.key_dict)*row_bytes)
+                    mat_file.close()
+
+    def __write_meta(self, nm):
+        meta_file = open(self.feat_conf[nm]['path'] + '.json', 'w')
+        json.dump({'dim':self.dim[nm], 'dtype':self.dtype[nm].name}, meta_file)
+        meta_file.close()
+
+    def add(self, key, y):
+        """x.add(key, y) adds y to feature store with key 'key'"""
+        if (type(y) is dict):
+            y = dict([(nm, np.asarray(val)[np.newaxis]) for (nm, val) in y.iteritems()])
+        self.add_batch([key], y)
+
+    def add_batch(self, keys, values):
+        """x.add_batch(keys, values) adds records for a list of keys; values is a dictionary of feature name to
+        a 2-D array with one row per key"""
+        if not hasattr(self, 'config'):
+            raise ValueError('feat_store_mmap: must provide configuration before using a feature store')
+        if (type(values) is not dict):
+            raise ValueError('feat_store_mmap: item added to feat store must be a dictionary')
+        for ky in values:
+            if (ky not in self.feat_names):
+                raise ValueError('feat_store_mmap: configuration specified feature names not used in add()')
+        for nm in self.feat_names:
+            if (nm not in values):
+                raise ValueError('feat_store_mmap: all features are required in add()')
+
+        # Check keys and rows before writing anything
+        keys = [_key_text(ky) for ky in keys]
+        for ky in keys:
+            if (ky in self.key_dict):
+                raise ValueError('feat_store_mmap: store is append-only; key {} already added'.format(ky.encode('utf-8')))
+            if ('\n' in ky):
+                raise ValueError('feat_store_mmap: keys cannot contain newlines')
+        if (len(set(keys)) < len(keys)):
+            raise ValueError('feat_store_mmap: store is append-only; repeated keys in add_batch()')
+        rows = {}
+        for nm in self.feat_names:
+            v = np.asarray(values[nm])
+            dim = self.dim[nm] if (self.dim[nm] is not None) else v.shape[-1]
+            if (v.ndim != 2) or (v.shape[0] != len(keys)) or (v.shape[1] != dim):
+                raise ValueError('feat_store_mmap: expected {} rows of dimension {} for feature {}'.format(len(keys), dim, nm))
+            rows[nm] = v
+
+        # Append rows, then keys -- a row only counts once its key is written
+        if (self.mat_files is None):
+            self.mat_files = {}
+        for nm in self.feat_names:
+            v = rows[nm]
+            if (self.dim[nm] is None):
+                self.dim[nm] = v.shape[1]
+                self.__write_meta(nm)
+            if (nm not in self.mat_files):
+                self.mat_files[nm] = open(self.feat_conf[nm]['path'], 'ab')
+            if (self.dtype[nm]==np.int8):
+                (v, scale) = vec_quant.quantize_int8(v)
+                if ((nm, 'scale') not in self.mat_files):
+                    self.mat_files[(nm, 'scale')] = open(self.feat_conf[nm]['path'] + '.scale', 'ab')
+                self.mat_files[(nm, 'scale')].write(scale.tobytes())
+            self.mat_files[nm].write(np.ascontiguousarray(v, dtype=self.dtype[nm]).tobytes())
+        if (self.key_file is None):
+            self.key_file = open(self.key_fn, 'a')
+        self.key_file.write(''.join([ky.encode('utf-8') + '\n' for ky in keys]))
+        self.key_dict.intern_many(keys)
+
+    def close(self):
+        """x.close() flushes and closes the files of the feature store"""
+        self.__flush()
+        if (self.mat_files is not None):
+            for f in self.mat_files.itervalues():
+                f.close()
+            self.mat_files = None
+        if (self.key_file is not None):
+            self.key_file.close()
+            self.key_file = None
+        self.mats = {}
+        self.mat_rows = 0
+
+    def __flush(self):
+        if (self.mat_files is not None):
+            for f in self.mat_files.itervalues():
+                f.flush()
+        if (self.key_file is not None):
+            self.key_file.flush()
+
+    def __matrix(self, nm, part=None):
+        # Memory map the matrix (or with part='scale' the int8 scales), remapping after appends
+        if (self.mat_rows != len(self.key_dict)):
+            self.__flush()
+            self.mats = {}
+            self.mat_rows = len(self.key_dict)
+        if (part=='scale'):
+            (fn, dtype, shape) = (self.feat_conf[nm]['path'] + '.scale', np.float32, (self.mat_rows,))
+        else:
+            (fn, dtype, shape) = (self.feat_conf[nm]['path'], self.dtype[nm], (self.mat_rows, self.dim[nm] or 0))
+        if ((nm, part) not in self.mats):
+            if (self.mat_rows==0):
+                self.mats[(nm, part)] = np.zeros((0,)+shape[1:], dtype=dtype)
+            else:
+                self.mats[(nm, part)] = np.memmap(fn, dtype=dtype, mode='r', shape=shape)
+        return self.mats[(nm, part)]
+
+    def __rows(self, nm, rows):
+        # Rows of a feature; int8 rows are dequantized
+        if (self.dtype[nm]==np.int8):
+            return vec_quant.dequantize(self.__matrix(nm)[rows], self.__matrix(nm, 'scale')[rows])
+        return self.__matrix(nm)[rows]
+
+    def get_many(self, keys, name):
+        """x.get_many(keys, name) -> 2-D array with the vectors of feature 'name' for a list of keys"""
+        rows = np.array([self.key_dict.lookup(_key_text(ky)) for ky in keys], dtype=np.int64)
+        return self.__rows(name, rows)
+
+    def get_rows(self, name, start, stop):
+        """x.get_rows(name, start, stop) -> memory mapped view of rows start:stop of feature 'name'"""
+        return self.__rows(name, slice(start, stop))
+
+    def get_quantized(self, name, start, stop):
+        """x.get_quantized(name, start, stop) -> (int8 rows, float32 scales) memory mapped views for rows start:stop"""
+        return (self.__matrix(name)[start:stop], self.__matrix(name, 'scale')[start:stop])
+
+    def key_at(self, i):
+        """x.key_at(i) -> key for row i"""
+        return self.key_dict.key_at(i)
+
+    def num_rows(self):
+        """x.num_rows() -> number of records"""
+        return len(self.key_dict)
+
+    def row(self, key):
+        """x.row(key) -> row number of key"""
+        return self.key_dict.lookup(_key_text(key))
+
+    def __getitem__(self, i):
+        """x.__getitem__(i) <==> x[i]"""
+        if not hasattr(self, 'config'):
+            raise Exception('feat_store_mmap: must provide configuration before using a feature store')
+        return self.__record(self.key_dict.lookup(_key_text(i)))
+
+    def __record(self, i):
+        rec = {}
+        for nm in self.feat_names:
+            rec[nm] = self.__rows(nm, i)
+        return rec
+
+    def __iter__(self):
+        """x.__iter__() <==> iter(x)"""
+        self.iter = iter(xrange(0, len(self.key_dict)))
+        return self
+
+    def keys(self):
+        """x.keys() returns list of keys"""
+        return self.key_dict.keys()
+
+    def names(self):
+        """x.keys() returns list of feature names"""
+        return self.feat_names
+
+    def next(self):
+        """x.next() -> the next value, or raise StopIteration"""
+        if not hasattr(self, 'config'):
+            raise Exception('feat_store_mmap: must provide configuration before using a feature store')
+        try:
+            i = self.iter.next()
+            return (self.key_dict.key_at(i), self.__record(i))
+        except StopIteration:
+            raise StopIteration()
+
+def _key_text(ky):
+    # Keys are stored as utf-8 text and read back as unicode; byte strings are taken to be utf-8
+    if isinstance(ky, str):
+        return ky.decode('utf-8')
+    if not isinstance(ky, unicode):
+        return unicode(ky)
+    return ky
@@ -7,6 +7,12 @@ Implementation of the interface hash_store using in-memory dictionaries in Pytho
 # BC, 6/17/2015
 from bitarray import bitarray
 import json
+import key_dict as kdict
+import math
+from multiprocessing.pool import ThreadPool
+import numpy as np
+import postings
+import random
 
 class hash_store_dict(object):
     """
@@ -23,7 +29,13 @@ class hash_store_dict(object):
     - __getitem__(key)  -- for general data store not an efficient method -- use iterators whenever possible
 
     Additional methods implemented for this version:
-    - (none)
+    - create_indexes(num_fns_per_band, slices=None), create_nested_indexes(slice_sizes) -- banded indexes
+    - tune_slices(threshold, recall, collision_fns) -- choose bands per feature for create_indexes
+    - create_sorted_indexes(num_fns_per_band, slices=None, compress=False) -- bulk built array indexes, optionally 
+      with compressed postings; retrieve_ids(feat_nm, ht_list) returns arrays of item ids
+    - retrieve_fused(ht, weights, rule) -- one weighted band-vote score per candidate over several features
+    - retrieve_adaptive(feat_nm, ht_list, budget) -- coarse to fine search over create_nested_indexes
+    - key_dict -- keys are interned to int ids by add(); the indexes hold ids and map back to keys on output
 
     The config file for open should be JSON and contain the following fields:
     - "features": These are the features to be processed:
@@ -37,6 +49,7 @@ class hash_store_dict(object):
             self.config = json.loads(config_str)
             self.feat = {}
             self.feat_names = set([x['name'] for x in self.config])
+            self.key_dict = kdict.key_dict()
             self.index_created = False
             self.nested_index_created = False
 
@@ -49,30 +62,19 @@ class hash_store_dict(object):
         for ky in y:
             if (ky not in self.feat_names):
                 raise ValueError('feat_store_list: configuration specified feature names not used in add()')
+        self.key_dict.intern(key)
         self.feat[key] = y
 
     def close(self):
         """x.close() closes the feature store -- in this case does nothing"""
         return
 
-    def create_indexes(self, num_fns_per_band):
-        """create_indexes(num_fns_per band) : create indexes for hash values grouped by 'num_fns_per_band'
+    def create_indexes(self, num_fns_per_band=None, slices=None):
+        """create_indexes(num_fns_per band, slices=None) : create indexes for hash values grouped by 'num_fns_per_band'
+        slices : (optional) dictionary of feature name to a list of bands (start, stop), e.g., from tune_slices; 
+                 num_fns_per_band is used for features not in slices
         """
-        # Loop over one item and pre-calculate bands
-        slices = {}
-        done = False
-        for (ky, hval) in self.feat.iteritems():
-            for nm in self.feat_names:
-                i1 = 0
-                slices[nm] = []
-                if (hval[nm] is None):
-                    continue
-                while (i1+num_fns_per_band)<=len(hval[nm]):
-                    slices[nm].append((i1, i1+num_fns_per_band))
-                    i1 += num_fns_per_band
-                done = True
-            if (done):
-                break
+        slices = self.__band_slices(num_fns_per_band, slices)
         
         # Create arrays for indexes
         self.index = {}
@@ -81,8 +83,9 @@ class hash_store_dict(object):
             for sl in slices[nm]:
                 self.index[nm].append({})
 
-        # Create indexes
-        for (ky, hval) in self.feat.iteritems():
+        # Create indexes -- postings are lists of item ids (see self.key_dict), appended in id order
+        for (i, ky) in enumerate(self.key_dict.keys()):
+            hval = self.feat[ky]
             for nm in hval.iterkeys():
                 hval_nm = hval[nm]
                 if (hval_nm is None):
@@ -97,12 +100,201 @@ class hash_store_dict(object):
                     else:
                         tp = tuple(hval_nm[sl[0]:sl[1]])
                     if (tp not in self.index[nm][i1]):
-                        self.index[nm][i1][tp] = set([])
-                    self.index[nm][i1][tp].add(ky)
+                        self.index[nm][i1][tp] = []
+                    self.index[nm][i1][tp].append(i)
                     i1 += 1
         self.slices = slices
+        self.index_kind = 'dict'
+        self.index_key_dict = self.key_dict
+        self.index_keys = self.key_dict.keys()
+        self.item_ids = np.arange(len(self.key_dict), dtype=np.int32)
         self.index_created = True
 
+    def __band_slices(self, num_fns_per_band, slices):
+        # Loop over one item and pre-calculate bands
+        if (slices is None):
+            slices = {}
+        else:
+            slices = dict(slices)
+        if (num_fns_per_band is None) and (len(self.feat_names-set(slices.keys())) > 0):
+            raise ValueError('create_indexes: num_fns_per_band or slices is required for every feature')
+        done = False
+        for (ky, hval) in self.feat.iteritems():
+            for nm in self.feat_names:
+                if (nm in slices):
+                    done = True
+                    continue
+                i1 = 0
+                slices[nm] = []
+                if (hval[nm] is None):
+                    continue
+                while (i1+num_fns_per_band)<=len(hval[nm]):
+                    slices[nm].append((i1, i1+num_fns_per_band))
+                    i1 += num_fns_per_band
+                done = True
+            if (done):
+                break
+        return slices
+
+    def create_sorted_indexes(self, num_fns_per_band=None, slices=None, num_threads=4, compress=False, key_dict=None):
+        """create_sorted_indexes(num_fns_per_band, slices=None, num_threads=4, compress=False, key_dict=None) : bulk version of create_indexes
+        Each band index is a sorted array of the unique band keys, offsets into a postings array, and the 
+        postings array of item ids sorted by band key.  Keys are built as one array per band (uint64 if the 
+        band fits in 8 bytes, otherwise fixed width bytes) and sorted with argsort; bands are built in 
+        'num_threads' threads.  retrieve works the same as after create_indexes.
+        compress : if True, the postings are delta + varint coded (see postings.py) and offsets are byte offsets
+        key_dict : (optional) key dictionary for the item ids, e.g., the key_dict of a feat_store_array so ids are
+                   its rows.  It is not modified; every key of this store must be in it.  Default is this
+                   store's own self.key_dict.  Kept as self.index_key_dict; the ids of the items in this
+                   store are self.item_ids
+        """
+        slices = self.__band_slices(num_fns_per_band, slices)
+        if (key_dict is None):
+            key_dict = self.key_dict
+        item_keys = self.feat.keys()
+        item_ids = key_dict.lookup_many(item_keys)
+        if (len(item_ids) > 0) and (item_ids.min() < 0):
+            raise ValueError('create_sorted_indexes: {} keys of the hash store are not in key_dict'.format((item_ids < 0).sum()))
+        self.index_key_dict = key_dict
+        order = np.argsort(item_ids, kind='mergesort')
+        item_keys = [item_keys[i] for i in order]
+        self.item_ids = item_ids[order]
+        self.sorted_index = {}
+        pool = ThreadPool(max(1, num_threads))
+        for nm in self.feat_names:
+            (codes, rows) = self.__code_matrix(nm, item_keys)
+            ids = self.item_ids[rows] if (rows is not None) else None
+            if (codes is None):
+                self.sorted_index[nm] = [(np.zeros(0, dtype=np.uint64), np.zeros(1, dtype=np.int64), 
+                                          np.zeros(0, dtype=np.int32)) for sl in slices[nm]]
+                continue
+            def build_band(sl):
+                band_keys = _band_keys(codes, sl)
+                order = np.argsort(band_keys, kind='mergesort')
+                band_keys = band_keys[order]
+                if (len(band_keys) > 0):
+                    starts = np.concatenate(([0], np.nonzero(band_keys[1:]!=band_keys[:-1])[0]+1))
+                else:
+                    starts = np.zeros(0, dtype=np.int64)
+                offsets = np.concatenate((starts, [len(band_keys)])).astype(np.int64)
+                if compress:
+                    (data, byte_offsets) = postings.encode_groups(ids[order], offsets)
+                    return (band_keys[starts], byte_offsets, data)
+                return (band_keys[starts], offsets, ids[order])
+            self.sorted_index[nm] = pool.map(build_band, slices[nm])
+        pool.close()
+        pool.join()
+        self.slices = slices
+        self.index_kind = 'sorted'
+        self.index_compressed = compress
+        self.index_created = True
+
+    def __code_matrix(self, nm, keys):
+        # Hash codes of feature nm for the items 'keys' as one array: bytes of bitarray codes or integer codes
+        ids = [i for (i, ky) in enumerate(keys) if (self.feat[ky][nm] is not None)]
+        if (len(ids)==0):
+            return (None, None)
+        return (_code_array([self.feat[keys[i]][nm] for i in ids]), np.array(ids, dtype=np.int32))
+
+    def retrieve_ids(self, feat_nm, ht_list):
+        """retrieve_ids(feat_nm, ht_list) -> list with a sorted array of item ids (see self.index_key_dict) for each 
+        band with a match; works after create_indexes or create_sorted_indexes
+        """
+        if (ht_list is None):
+            return []
+        if (not self.index_created):
+            raise Exception('index not created')
+        if (self.index_kind=='dict'):
+            return [np.array(lst, dtype=np.int32) for lst in _dict_band_lookup(self.index[feat_nm], self.slices[feat_nm], ht_list)]
+        result = []
+        chunks = []
+        is_bitarray = isinstance(ht_list[0], bitarray)
+        for (sl, (band_keys, offsets, ids)) in zip(self.slices[feat_nm], self.sorted_index[feat_nm]):
+            if (len(band_keys)==0):
+                continue
+            ky = _query_band_key(ht_list, sl, is_bitarray, band_keys.dtype)
+            i = np.searchsorted(band_keys, ky)
+            if (i < len(band_keys)) and (band_keys[i]==ky):
+                if self.index_compressed:
+                    chunks.append(ids[offsets[i]:offsets[i+1]])
+                else:
+                    result.append(ids[offsets[i]:offsets[i+1]])
+        if self.index_compressed:
+            result = postings.decode_many(chunks)
+        return result
+
+    def tune_slices(self, threshold, recall=0.9, collision_fns=None, sample_size=2000, seed=0, verbose=False):
+        """tune_slices(threshold, recall=0.9, collision_fns=None, sample_size=2000, seed=0, verbose=False)
+        Choose bands for create_indexes(slices=...) for each feature.  Pairs with similarity 'threshold' 
+        should be retrieved with probability at least 'recall', at the least expected number of candidates.
+
+        For b bands of r hash functions each, a pair whose hash functions collide with probability p is 
+        retrieved with probability 1-(1-p^r)^b (the LSH S-curve).  The expected number of candidates per 
+        query is estimated from the bucket sizes of each band on a sample of the items.  All r*b <= number
+        of hash functions are searched; if no choice reaches 'recall', the one with the highest recall is used.
+
+        threshold : similarity at which recall is measured, in the units of the collision functions -- cosine 
+                    for bitarray codes (rp_acos etc.)
+        collision_fns : dictionary of feature name to a function p(threshold) giving the collision probability
+                        of one hash function, e.g., the collision_prob method of the feature's lsh_vec or
+                        lsh_str_ngram_minhash object.  Only bitarray codes have a default,
+                        (1-acos(threshold)/pi)^num_bits; integer and b-bit codes (min-hash, pstable_l2,
+                        crosspolytope) have different curves, so a function is required for them.
+        output : dictionary of feature name to a list of bands (start, stop)
+        """
+        if (collision_fns is None):
+            collision_fns = {}
+        prng = random.Random(seed)
+        all_keys = self.feat.keys()
+        if (len(all_keys) > sample_size):
+            sample = prng.sample(all_keys, sample_size)
+        else:
+            sample = all_keys
+        num_items = len(all_keys)
+        slices = {}
+        self.tuning = {}
+        for nm in self.feat_names:
+            codes = [self.feat[ky][nm] for ky in sample if (self.feat[ky][nm] is not None)]
+            if (len(codes) < 2):
+                continue
+            num_fns = len(codes[0])
+            is_bitarray = isinstance(codes[0][0], bitarray)
+            if (nm in collision_fns):
+                p = collision_fns[nm](threshold)
+            elif is_bitarray:
+                p = (1.0-math.acos(max(-1.0, min(1.0, threshold)))/math.pi)**len(codes[0][0])
+            else:
+                raise ValueError('tune_slices: no default collision probability for the codes of feature {}; '
+                                 'pass collision_fns, e.g., the collision_prob method of its LSH object'.format(nm))
+            if is_bitarray:
+                codes = [[barr.tobytes() for barr in c] for c in codes]
+
+            # Search bands of r functions, b bands
+            best = None
+            num_pairs = 1.0*len(codes)*(len(codes)-1)
+            for r in xrange(1, num_fns+1):
+                q_miss = 1.0
+                for b in xrange(1, num_fns/r+1):
+                    # Fraction of sampled pairs that collide in band b-1
+                    counts = {}
+                    for c in codes:
+                        tp = tuple(c[(b-1)*r:b*r])
+                        counts[tp] = counts.get(tp, 0)+1
+                    q = sum([n*(n-1) for n in counts.itervalues()])/num_pairs
+                    q_miss *= (1.0-q)
+                    cand = (num_items-1)*(1.0-q_miss)
+                    rec = 1.0-(1.0-p**r)**b
+                    score = (rec < recall, -rec if (rec < recall) else cand)
+                    if (best is None) or (score < best[0]):
+                        best = (score, r, b, rec, cand)
+            (score, r, b, rec, cand) = best
+            slices[nm] = [(i*r, (i+1)*r) for i in xrange(0, b)]
+            self.tuning[nm] = {'num_fns_per_band':r, 'num_bands':b, 'recall':rec, 'candidates':cand, 'p':p}
+            if verbose:
+                print 'tune_slices: {} -- {} bands of {} functions, recall at {} is {:.4f}, expected candidates {:.1f}'.format(nm, 
+                                                                                                b, r, threshold, rec, cand)
+        return slices
+
     def create_nested_indexes(self, slice_sizes):
         """create_nested_indexes(self, slice_sizes) 
         Created a nested set of inverted indices based on different slice sizes.
@@ -144,8 +336,9 @@ class hash_store_dict(object):
                 self.nested_index[nm].append({})
                 self.children[nm].append({})
 
-        # Create indexes
-        for (ky, hval) in self.feat.iteritems():
+        # Create indexes -- postings are lists of item ids (see self.key_dict), appended in id order
+        for (i, ky) in enumerate(self.key_dict.keys()):
+            hval = self.feat[ky]
             for nm in hval.iterkeys():
                 hval_nm = hval[nm]
                 if (hval_nm is None):
@@ -160,8 +353,8 @@ class hash_store_dict(object):
                     else:
                         tp = tuple(hval_nm[sl[0]:sl[1]])
                     if (tp not in self.nested_index[nm][i1]):
-                        self.nested_index[nm][i1][tp] = set([])
-                    self.nested_index[nm][i1][tp].add(ky)
+                        self.nested_index[nm][i1][tp] = []
+                    self.nested_index[nm][i1][tp].append(i)
                     if i1>=1:
                         sl_prev = slices[nm][i1-1]
                         if is_bitarray:
@@ -208,26 +401,76 @@ class hash_store_dict(object):
             raise StopIteration()
 
     def retrieve(self, feat_nm, ht_list):
+        """retrieve(feat_nm, ht_list) -> list with a set of keys for each band with a match
+        Each call builds new key sets from the id postings.  Callers that combine the bands should use
+        retrieve_ids and map only the combined ids to keys (see self.index_key_dict).
+        """
         if (ht_list is None):
             result = []
             return
         if (not self.index_created):
             raise Exception('index not created')
-        result = []
-        idx = self.index[feat_nm]
-        is_bitarray = False
-        if isinstance(ht_list[0], bitarray):
-            is_bitarray = True
-        i1 = 0
-        for sl in self.slices[feat_nm]:
-            if is_bitarray:
-                h_sl = tuple([barr.tobytes() for barr in ht_list[sl[0]:sl[1]]])
-            else:
-                h_sl = tuple(ht_list[sl[0]:sl[1]])
-            if (h_sl in idx[i1]):
-                result.append(idx[i1][h_sl])
-            i1 += 1
-        return result
+        if (self.index_kind=='dict'):
+            keys = self.index_keys
+            return [set([keys[i] for i in lst]) for lst in _dict_band_lookup(self.index[feat_nm], self.slices[feat_nm], ht_list)]
+        # Ids come from the index, so index key_array directly rather than range check them in to_keys
+        key_array = self.index_key_dict.key_array
+        return [set(key_array[ids].tolist()) for ids in self.retrieve_ids(feat_nm, ht_list)]
+
+    def retrieve_fused(self, ht, weights=None, rule='or'):
+        """retrieve_fused(ht, weights=None, rule='or') -> (keys, scores)
+        Retrieve on several features at once and score each candidate by its band votes across features.
+        ht is a dictionary of feature name to hash list, e.g., hs[key].  weights is a dictionary of feature
+        name to weight; the default weighs all features equally.  The score of a candidate is
+        sum_f weights[f]*(bands of f that collide)/(bands of f), divided by the sum of the weights.
+        rule is the blocking rule a candidate must pass:
+        - 'or': a band of any feature collides
+        - 'and': a band of every feature collides
+        - a list of lists of feature names, e.g. [['userName'], ['fullName', 'location']] -- an OR of ANDs;
+          the candidate must collide on all features of at least one inner list
+        Works with both create_indexes and create_sorted_indexes.
+        """
+        if (weights is None):
+            weights = dict([(nm, 1.0) for nm in self.feat_names])
+        for nm in weights:
+            if (nm not in self.feat_names):
+                raise ValueError('retrieve_fused: unknown feature {}'.format(nm))
+        if (rule=='or'):
+            clauses = [[nm] for nm in weights]
+        elif (rule=='and'):
+            clauses = [list(weights)]
+        else:
+            clauses = rule
+            for nm in [nm for cl in clauses for nm in cl]:
+                if (nm not in weights):
+                    raise ValueError('retrieve_fused: rule feature {} has no weight'.format(nm))
+
+        # Band votes per feature as (sorted ids, counts)
+        votes = {}
+        for nm in weights:
+            ht_list = ht.get(nm)
+            if (ht_list is None):
+                continue
+            votes[nm] = postings.vote_counts(self.retrieve_ids(nm, ht_list))
+
+        cand = postings.union([ids for (ids, counts) in votes.itervalues()])
+        score = np.zeros(len(cand))
+        hit = {}
+        for (nm, (ids, counts)) in votes.iteritems():
+            pos = np.searchsorted(cand, ids)
+            score[pos] += weights[nm]*counts/float(len(self.slices[nm]))
+            hit[nm] = np.zeros(len(cand), dtype=bool)
+            hit[nm][pos] = True
+        ok = np.zeros(len(cand), dtype=bool)
+        for cl in clauses:
+            ok_cl = np.ones(len(cand), dtype=bool)
+            for nm in cl:
+                ok_cl &= hit[nm] if (nm in hit) else False
+            ok |= ok_cl
+        total = float(sum(weights.itervalues()))
+        if (total > 0):
+            score /= total
+        return (self.index_key_dict.to_keys(cand[ok]), score[ok])
 
     def retrieve_children(self, feat_nm, ht_list, level):
         if (ht_list is None):
@@ -272,6 +515,116 @@ class hash_store_dict(object):
         else:
             h_sl = tuple(ht_list[sl[0]:sl[1]])
         if (h_sl in idx):
-            result = idx[h_sl]
+            result = set(self.key_dict.to_keys(idx[h_sl]))
 
         return result
+
+    def retrieve_adaptive(self, feat_nm, ht_list, budget):
+        """retrieve_adaptive(feat_nm, ht_list, budget) -> (keys, level)
+        Coarse to fine search over the nested indexes (see create_nested_indexes).  Walks the prefix levels
+        from the shortest prefix and stops at the first level whose candidate set has at most 'budget' keys,
+        so dense regions use long prefixes and sparse regions short ones.  If the query's prefix is not in a
+        level, the candidates are the sets of its sibling prefixes (children of the parent prefix, or all
+        prefixes at level 0), added from the most similar to the query until the next one would take the
+        total over budget; if even the most similar sibling has more than 'budget' keys, its whole set is
+        returned.  Likewise, if the longest prefix has more than 'budget' keys, its whole set is returned.
+        level is the level used, -1 if there are no candidates.
+        """
+        if (ht_list is None):
+            return (set([]), -1)
+        if (not self.nested_index_created):
+            raise Exception('nested index not created')
+        is_bitarray = isinstance(ht_list[0], bitarray)
+        if is_bitarray:
+            codes = [barr.tobytes() for barr in ht_list]
+        else:
+            codes = list(ht_list)
+        levels = self.nested_slices[feat_nm]
+        idx = self.nested_index[feat_nm]
+        prev_tp = None
+        result = []
+        for (level, sl) in enumerate(levels):
+            tp = tuple(codes[sl[0]:sl[1]])
+            if (tp not in idx[level]):
+                return self.__sibling_candidates(feat_nm, level, prev_tp, tp, is_bitarray, budget)
+            result = idx[level][tp]
+            if (len(result) <= budget):
+                return (set(self.key_dict.to_keys(result)), level)
+            prev_tp = tp
+        return (set(self.key_dict.to_keys(result)), len(levels)-1)
+
+    def __sibling_candidates(self, feat_nm, level, parent_tp, tp, is_bitarray, budget):
+        # Candidates from the prefixes that share the parent prefix of tp, most similar to tp first
+        if (level==0):
+            siblings = self.nested_index[feat_nm][0].keys()
+        else:
+            siblings = list(self.children[feat_nm][level-1].get(parent_tp, []))
+        if is_bitarray:
+            # Bits that differ
+            dist = [sum([bin(int(a.encode('hex'), 16) ^ int(b.encode('hex'), 16)).count('1') for (a, b) in zip(tp, sib)])
+                    for sib in siblings]
+        else:
+            # Hash values that differ
+            dist = [sum([a!=b for (a, b) in zip(tp, sib)]) for sib in siblings]
+        # Each item has one prefix per level, so the sibling postings are disjoint
+        idx = self.nested_index[feat_nm][level]
+        order = np.argsort(dist, kind='mergesort')
+        if (len(order)==0):
+            return (set([]), -1)
+        chosen = []
+        num = 0
+        for i in order:
+            ids = idx[siblings[i]]
+            if (num+len(ids) > budget):
+                break
+            chosen.append(ids)
+            num += len(ids)
+        if (len(chosen)==0):
+            # The closest sibling alone is over budget -- return its whole set rather than no candidates
+            chosen = [idx[siblings[order[0]]]]
+        return (set(self.key_dict.to_keys([i for ids in chosen for i in ids])), level)
+
+def _dict_band_lookup(index, slices, ht_list):
+    # Id lists of the bands of ht_list that are in a dict index
+    result = []
+    is_bitarray = isinstance(ht_list[0], bitarray)
+    for (idx, sl) in zip(index, slices):
+        if is_bitarray:
+            h_sl = tuple([barr.tobytes() for barr in ht_list[sl[0]:sl[1]]])
+        else:
+            h_sl = tuple(ht_list[sl[0]:sl[1]])
+        if (h_sl in idx):
+            result.append(idx[h_sl])
+    return result
+
+def _code_array(code_list):
+    # Codes as one array: (items, functions, bytes) uint8 for bitarray codes, (items, functions) uint64 otherwise
+    if isinstance(code_list[0][0], bitarray):
+        A = np.frombuffer(''.join([''.join([barr.tobytes() for barr in c]) for c in code_list]), dtype=np.uint8)
+        return A.reshape(len(code_list), len(code_list[0]), -1)
+    return np.array(code_list, dtype=np.uint64)
+
+def _band_keys(codes, sl):
+    # Band keys for functions sl[0]:sl[1]: the code itself for one integer code, uint64 if the band fits in 
+    # 8 bytes, otherwise fixed width bytes
+    if (codes.ndim==2) and (sl[1]-sl[0]==1):
+        return codes[:, sl[0]]
+    band = np.ascontiguousarray(codes[:, sl[0]:sl[1]]).view(np.uint8).reshape(codes.shape[0], -1)
+    width = band.shape[1]
+    if (width <= 8):
+        padded = np.zeros((band.shape[0], 8), dtype=np.uint8)
+        padded[:, 8-width:] = band
+        return padded.view('>u8')[:, 0].astype(np.uint64)
+    return band.view('S{}'.format(width))[:, 0]
+
+def _query_band_key(ht_list, sl, is_bitarray, key_dtype):
+    # Band key of one code, the same as _band_keys, without building arrays
+    if is_bitarray:
+        band = ''.join([barr.tobytes() for barr in ht_list[sl[0]:sl[1]]])
+    elif (sl[1]-sl[0]==1):
+        return np.uint64(int(ht_list[sl[0]]))
+    else:
+        band = np.array(ht_list[sl[0]:sl[1]], dtype=np.uint64).tobytes()
+    if (len(band) <= 8):
+        return np.uint64(int(band.encode('hex'), 16))
+    return np.array(band, dtype=key_dtype)[()]
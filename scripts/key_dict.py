@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""
+Key dictionary -- interns arbitrary keys to dense integer ids
+"""
+
+import numpy as np
+
+class key_dict(object):
+    """
+    Maps keys (strings such as '@user' or '2_2', or any hashable) to dense int32 ids 0, 1, 2, ...
+    in order of first appearance, and ids back to keys.  Share one key_dict between stores (e.g.,
+    feat_store_array.key_dict and hash_store_dict.create_sorted_indexes) so that internal structures
+    can use ids and only map back to keys for output.
+
+    Typical usage:
+    >>> kd = key_dict()
+    >>> ids = kd.intern_many(['@a', '@b', '@a'])    # array([0, 1, 0], dtype=int32)
+    >>> kd.to_keys(ids)                              # ['@a', '@b', '@a']
+    """
+
+    INIT_CAPACITY = 1024
+    MAX_IDS = 2**31-1
+
+    def __init__(self, keys=None):
+        """
+        keys : (optional) keys to intern, in order
+        """
+        self.ids = {}
+        self.key_array = np.empty(key_dict.INIT_CAPACITY, dtype=object)
+        self.num = 0
+        if (keys is not None):
+            self.intern_many(keys)
+
+    def intern(self, key):
+        """kd.intern(key) -> id of key, adding it if it is new"""
+        i = self.ids.get(key)
+        if (i is None):
+            i = self.num
+            if (i >= len(self.key_array)):
+                self.__grow(i+1)
+            self.key_array[i] = key
+            self.ids[key] = i
+            self.num += 1
+        return i
+
+    def intern_many(self, keys):
+        """kd.intern_many(keys) -> int32 array of the ids of keys, adding new keys"""
+        keys = list(keys)
+        self.__grow(self.num+len(keys))
+        intern = self.intern
+        return np.array([intern(ky) for ky in keys], dtype=np.int32)
+
+    def lookup(self, key):
+        """kd.lookup(key) -> id of key; raises KeyError if the key is not in the dictionary"""
+        return self.ids[key]
+
+    def lookup_many(self, keys, missing=-1):
+        """kd.lookup_many(keys, missing=-1) -> int32 array of the ids of keys; 'missing' for unknown keys"""
+        get = self.ids.get
+        return np.array([get(ky, missing) for ky in keys], dtype=np.int32)
+
+    def key_at(self, i):
+        """kd.key_at(i) -> key with id i"""
+        if (i < 0) or (i >= self.num):
+            raise IndexError('key_dict: id {} out of range'.format(i))
+        return self.key_array[i]
+
+    def to_keys(self, ids):
+        """kd.to_keys(ids) -> list of the keys for an array of ids"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if (len(ids) > 0) and ((ids.min() < 0) or (ids.max() >= self.num)):
+            raise IndexError('key_dict: id out of range')
+        return self.key_array[ids].tolist()
+
+    def keys(self):
+        """kd.keys() -> list of keys in id order"""
+        return self.key_array[0:self.num].tolist()
+
+    def __contains__(self, key):
+        return (key in self.ids)
+
+    def __len__(self):
+        return self.num
+
+    def __grow(self, num):
+        if (num > key_dict.MAX_IDS):
+            raise ValueError('key_dict: more than {} keys'.format(key_dict.MAX_IDS))
+        if (num <= len(self.key_array)):
+            return
+        capacity = len(self.key_array)
+        while (capacity < num):
+            capacity *= 2
+        new = np.empty(capacity, dtype=object)
+        new[0:self.num] = self.key_array[0:self.num]
+        self.key_array = new
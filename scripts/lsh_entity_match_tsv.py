@@ -6,12 +6,15 @@
 # BC, 6/30/15
 
 import argparse
-import codecs
 from feat_store_dict import feat_store_dict
 from hash_store_dict import hash_store_dict
 from lsh_str import lsh_str_ngram_minhash
+import match_output
+import postings
+from match_output import match_writer
 import gzip
 import re
+import string_sim
 import sys
 
 from match_tools import create_hash_from_fs
@@ -23,67 +26,127 @@ if __name__ == '__main__':
     parser.add_argument("--profile1", type=str, help="Profile 1 file (tsv.gz format)", required=True)
     parser.add_argument("--profile2", type=str, help="Profile 2 file (tsv.gz format)", required=True)
     parser.add_argument("--output", type=str, help="Output file with matches and scores", required=True)
+    parser.add_argument("--output_format", type=str, help="'tsv', 'tsv.gz' or 'bin' (binary columns, see match_output); default from the --output extension", required=False, default=None, choices=match_output.FORMATS)
+    parser.add_argument("--threshold", type=float, help="Jaccard similarity threshold -- tune the index bands for it (optional)", required=False, default=None)
+    parser.add_argument("--recall", type=float, help="recall at --threshold for tuning the index bands", required=False, default=0.9)
+    parser.add_argument("--score", type=str, help="score of a pair: 'votes' (fraction of colliding bands) or 'jaccard' (min-hash estimate)", required=False, default='votes', choices=['votes', 'jaccard'])
+    parser.add_argument("--score_threshold", type=float, help="with --score jaccard, drop pairs with an estimate below this (optional)", required=False, default=None)
+    parser.add_argument("--fused", type=str, help="score pairs once over several features with weights, e.g. 'userName:0.4,fullName:0.6'; writes one row per pair with feature 'fused' (optional)", required=False, default=None)
+    parser.add_argument("--rule", type=str, help="blocking rule for --fused: 'or', 'and', or an OR of ANDs such as 'userName|fullName&location'", required=False, default='or')
+    parser.add_argument("--verify", type=str, help="verify candidate pairs with an exact similarity and write only pairs above --verify_threshold: 'jaccard' (character n-grams) or 'edit' (normalized edit distance); the score is then the exact similarity (optional)", required=False, default=None, choices=string_sim.MEASURES)
+    parser.add_argument("--verify_threshold", type=float, help="similarity threshold for --verify", required=False, default=0.5)
+    parser.add_argument("--verify_n", type=int, help="n-gram size for --verify jaccard", required=False, default=3)
+    parser.add_argument("--num_workers", type=int, help="Number of processes for text normalization and verification", required=False, default=1)
 
     args = parser.parse_args()
+    if (args.score_threshold is not None) and (args.score!='jaccard'):
+        parser.error('--score_threshold requires --score jaccard')
+    if (args.fused is not None):
+        if (args.score!='votes') or (args.verify is not None):
+            parser.error('--fused uses band votes; it cannot be combined with --score jaccard or --verify')
+        fused_weights = dict([(x.split(':')[0], float(x.split(':')[1]) if (':' in x) else 1.0) for x in args.fused.split(',')])
+        if (args.rule in ['or', 'and']):
+            fused_rule = args.rule
+        else:
+            fused_rule = [cl.split('&') for cl in args.rule.split('|')]
     p1_fn = args.profile1
     p2_fn = args.profile2
     out_fn = args.output
+    num_workers = args.num_workers
 
     config_feat = '[{"name":"userName","type":"str"},{"name":"fullName","type":"str"}]'
     config_lsh_str_user = '{"seed":32, "n":4, "num_functions":10, "num_bits":32, "verbose":false, "lower_case":true, "normalize":false}'
-    config_lsh_str_full = '{"seed":32, "n":5, "num_functions":20, "num_bits":32, "verbose":false, "lower_case":true, "normalize":true}'
+    # fullName is lower cased and normalized when read in (in parallel) rather than in lsh_str
+    config_lsh_str_full = '{"seed":32, "n":5, "num_functions":20, "num_bits":32, "verbose":false, "lower_case":false, "normalize":false}'
+    normalize_fields = ['fullName']
     key_col = 'userName'
 
     # Read in profiles
     print 'Reading in TSV files ...'
     limit = None
-    fs1 = read_features_from_tsv (p1_fn, config_feat, key_col, feat_store_dict, limit)
-    fs2 = read_features_from_tsv (p2_fn, config_feat, key_col, feat_store_dict, limit)
+    fs1 = read_features_from_tsv (p1_fn, config_feat, key_col, feat_store_dict, limit, normalize_fields, 'lower_ascii', num_workers)
+    fs2 = read_features_from_tsv (p2_fn, config_feat, key_col, feat_store_dict, limit, normalize_fields, 'lower_ascii', num_workers)
     print 'Done!\n'
 
     # Create hashes
     print 'Creating LSH tables ...'
     lsh_classes = {'userName':lsh_str_ngram_minhash,'fullName':lsh_str_ngram_minhash}
     lsh_configs = {'userName':config_lsh_str_user,'fullName':config_lsh_str_full}
+    lsh_obj = {}
+    for nm in fs1.names():
+        lsh_obj[nm] = lsh_classes[nm](lsh_configs[nm])
     hs1 = create_hash_from_fs (fs1, lsh_classes, lsh_configs, hash_store_dict, config_feat)
     hs2 = create_hash_from_fs (fs2, lsh_classes, lsh_configs, hash_store_dict, config_feat)
     print 'Done!!!\n'
 
     # Create indexes
     print 'Creating indexes for tables ...'
-    hs1.create_indexes(2)
-    hs2.create_indexes(2)
+    if (args.threshold is not None):
+        collision_fns = dict([(nm, lsh_obj[nm].collision_prob) for nm in fs1.names()])
+        slices = hs2.tune_slices(args.threshold, args.recall, collision_fns, verbose=True)
+        hs1.create_indexes(slices=slices)
+        hs2.create_indexes(slices=slices)
+    else:
+        hs1.create_indexes(2)
+        hs2.create_indexes(2)
     print 'Done!\n'
 
-    # Do retrievals based on features
-    print 'Now performing retrievals ...'
-    output_file = codecs.open(out_fn, 'w', encoding='utf-8')
-    num = 0
-    output_file.write("key1\tkey2\tfeature\tscore")
-    output_file.write("\n")
-    for (ky, ht) in hs1:
-        if (ky is None) or (ht is None):
-            continue
-        # fs1_val = fs1[ky]
+    # Signature matrices of profile 2 for Jaccard scoring; rows are the key ids of hs2.key_dict
+    if (args.score=='jaccard'):
+        sig_matrix = {}
+        sig_valid = {}
         for nm in fs1.names():
-            res_list = hs2.retrieve(nm, ht[nm])
-            if (res_list is None) or (len(res_list)==0):
+            (sig_matrix[nm], sig_valid[nm]) = lsh_obj[nm].signature_matrix([hs2[ky2][nm] for ky2 in hs2.key_dict.keys()])
+
+    # Candidate pairs from retrievals based on features: (key, feature, candidate keys, scores)
+    def candidates():
+        num = 0
+        for (ky, ht) in hs1:
+            if (ky is None) or (ht is None):
+                continue
+            num += 1
+            if (num%10000)==0:
+                print ' {}K'.format(num/1000),
+                sys.stdout.flush()
+            if (args.fused is not None):
+                (cand, scores) = hs2.retrieve_fused(ht, fused_weights, fused_rule)
+                if (len(cand) > 0):
+                    yield (ky, 'fused', cand, scores.tolist())
                 continue
-            tot = 0
-            full_set = {}
-            for rs in res_list:
-                for ky2 in rs:
-                    if (ky2 not in full_set):
-                        full_set[ky2] = 0
-                    full_set[ky2] += 1
-                tot += 1
-            for ky2 in full_set.keys():
-                output_file.write(u'{}\t{}'.format(ky, ky2))
-                score = float(full_set[ky2])/tot
-                output_file.write('\t{}\t{}\n'.format(nm, score))
-        num += 1 
-        if (num%10000)==0:
-            print ' {}K'.format(num/1000),
-            sys.stdout.flush()
-    output_file.close()
+            for nm in fs1.names():
+                # Bands as id arrays of hs2.key_dict; only the candidates written are mapped back to keys
+                res_list = hs2.retrieve_ids(nm, ht[nm])
+                if (len(res_list)==0):
+                    continue
+                if (args.score=='jaccard'):
+                    cand = postings.union(res_list)
+                    cand = cand[sig_valid[nm][cand]]
+                    scores = lsh_obj[nm].jaccard_many(ht[nm], sig_matrix[nm][cand])
+                    if (args.score_threshold is not None):
+                        keep = (scores >= args.score_threshold)
+                        cand = cand[keep]
+                        scores = scores[keep]
+                    yield (ky, nm, hs2.key_dict.to_keys(cand), scores.tolist())
+                    continue
+                (cand, counts) = postings.vote_counts(res_list)
+                yield (ky, nm, hs2.key_dict.to_keys(cand), (counts/float(len(res_list))).tolist())
+
+    # Exact verification -- strings are compared lower cased, as in lsh_str
+    def verified(cand_iter):
+        groups = (((ky, nm, cand), fs1[ky][nm].lower(), [fs2[ky2][nm].lower() for ky2 in cand])
+                  for (ky, nm, cand, scores) in cand_iter)
+        for ((ky, nm, cand), idx, scores) in string_sim.verify_groups(groups, args.verify, args.verify_threshold, args.verify_n,
+                                                                      num_workers):
+            yield (ky, nm, [cand[i] for i in idx], scores)
+
+    print 'Now performing retrievals ...'
+    pairs = candidates()
+    if (args.verify is not None):
+        print 'Verifying candidates with {} similarity >= {} ...'.format(args.verify, args.verify_threshold)
+        pairs = verified(pairs)
+    writer = match_writer(out_fn, args.output_format)
+    for (ky, nm, cand, scores) in pairs:
+        writer.add_many(ky, cand, nm, scores)
+    writer.close()
+    print '{} pairs written'.format(writer.num_pairs)
     print 'Done!\n'
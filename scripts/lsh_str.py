@@ -9,6 +9,7 @@ from bitarray import bitarray
 import json
 import numpy as np
 import random
+from shingles import shingler
 import text_tools as tt
 
 class lsh_str_ngram_minhash (object):
@@ -20,6 +21,19 @@ class lsh_str_ngram_minhash (object):
     >>> config = '{"seed":25, "n":5, "num_functions":10, "num_bits":32, "verbose":false}'
     >>> ls = lsh_str_ngram_minhash(config)
     >>> y = ls.encode('hello')
+
+    Optional config fields:
+    - "n" may also be a list of n-gram sizes, optionally including "token", e.g. [3, 4, "token"]
+    - "rolling_hash": if true (always true when "n" is a list), shingles are integer ids from a rolling 
+                      hash (see shingles.shingler) computed in one pass instead of substrings
+    - "method": "minhash" (default) -- num_functions independent hashes of every n-gram
+                "oph" -- one permutation hashing: each n-gram is hashed once into one of num_functions bins 
+                         and empty bins are filled by optimal densification (Shrivastava, 2017)
+                "weighted" -- weighted min-hash (Ioffe's improved consistent weighted sampling) with token 
+                              counts as weights; use with "n":"token"
+    - "token_weights": (weighted only) dictionary of per-token weight multipliers, default 1.0
+    - "b_bits": b-bit minwise hashing (Li and Konig) -- keep only the low b bits of each hash.  The output
+                is then a numpy array of the smallest unsigned type that holds b bits
     """
 
     NUM_BITS = 63  # Number of max bits to use -- should be <= the number of bits in an int; typically values are 31 or 63 to avoid <0 numbers
@@ -47,16 +61,46 @@ class lsh_str_ngram_minhash (object):
         else:
             self.normalize = False
         if (self.normalize):
-            self.utf8_rewrite_hash = tt.create_utf8_rewrite_hash()
+            self.text_norm = tt.text_normalizer()
 
         if ('verbose' in self.config):
             self.verbose = self.config['verbose']
         else:
             self.verbose = False
+        if ('method' in self.config):
+            self.method = self.config['method']
+        else:
+            self.method = 'minhash'
+        if ('b_bits' in self.config):
+            self.b_bits = self.config['b_bits']
+        else:
+            self.b_bits = None
+        if ('token_weights' in self.config):
+            self.token_weights = self.config['token_weights']
+        else:
+            self.token_weights = {}
+
+        if (type(self.n) is list) or (('rolling_hash' in self.config) and self.config['rolling_hash']):
+            self.shingler = shingler(self.n, self.seed)
+        else:
+            self.shingler = None
 
         # Checks
         if (self.num_bits > lsh_str_ngram_minhash.NUM_BITS):
             raise Exception('Number of bits must be <= {}'.format(lsh_str_ngram_minhash.NUM_BITS))
+        if (self.method not in ['minhash', 'oph', 'weighted']):
+            raise Exception('Unknown min-hash method: {}'.format(self.method))
+        if (self.method=='weighted') and (self.n!='token') and ((type(self.n) is not list) or ('token' not in self.n)):
+            raise Exception('Weighted min-hash requires token features ("n":"token")')
+        if (self.b_bits is not None):
+            if (self.b_bits <= 0) or (self.b_bits > self.num_bits):
+                raise Exception('b_bits must be between 1 and num_bits')
+            if (self.b_bits <= 8):
+                self.b_dtype = np.uint8
+            elif (self.b_bits <= 16):
+                self.b_dtype = np.uint16
+            else:
+                self.b_dtype = np.uint32 if (self.b_bits <= 32) else np.uint64
         
         # Generate parameters for minhash
         # (unsigned) (a*x+b) >> (w-M) ; a is a random int, b is a random integer, both are < 2^w
@@ -71,6 +115,14 @@ class lsh_str_ngram_minhash (object):
             self.a.append(a1)
             self.b.append(b1)
 
+        # Parameters for one permutation hashing: bin hash and densification probe hash
+        # These are drawn after the min-hash parameters so 'minhash' signatures are unchanged
+        if (self.method=='oph'):
+            self.oph_a = int(self.prng.randint(0,2**lsh_str_ngram_minhash.NUM_BITS-1))
+            self.oph_b = int(self.prng.randint(0,2**lsh_str_ngram_minhash.NUM_BITS-1))
+            self.dens_a = int(self.prng.randint(0,2**lsh_str_ngram_minhash.NUM_BITS-1))
+            self.dens_b = int(self.prng.randint(0,2**lsh_str_ngram_minhash.NUM_BITS-1))
+
         # Verbose output
         if (self.verbose):
             print 'Initializing lsh_str:'
@@ -88,13 +140,25 @@ class lsh_str_ngram_minhash (object):
         if (self.lower):
             s = s.lower()
         if (self.normalize):
-            s = tt.convertUTF8_to_ascii(s, self.utf8_rewrite_hash)
+            s = self.text_norm.convert_ascii(s)
 
-        if (self.n=='token'):
+        if (self.shingler is not None):
+            ng = self.shingler.ids(s)
+            if (self.verbose):
+                ng = list(ng)
+        elif (self.n=='token'):
             ng = self.__get_char_tokens(s)
         else:
             ng = self.__get_char_ngrams(s)
-        output, output_str = self.__min_hash(ng)
+        if (self.method=='oph'):
+            output, output_str = self.__one_perm_hash(ng)
+        elif (self.method=='weighted'):
+            output, output_str = self.__weighted_min_hash(ng)
+        else:
+            output, output_str = self.__min_hash(ng)
+        if (self.b_bits is not None) and (output is not None):
+            output = np.array(output, dtype=np.uint64) & np.uint64(2**self.b_bits-1)
+            output = output.astype(self.b_dtype)
         if (self.verbose):
             print 'ngrams are: {}'.format(ng)
             print 'output is: {}'.format(output)
@@ -102,6 +166,61 @@ class lsh_str_ngram_minhash (object):
             print
         return output
 
+    def jaccard (self, sig1, sig2):
+        """
+        jaccard(sig1, sig2) -> estimated Jaccard similarity of the n-gram sets of two strings from their signatures
+        """
+        if (sig1 is None) or (sig2 is None):
+            return 0.0
+        return float(self.jaccard_many(sig1, np.asarray(sig2, dtype=np.uint64).reshape(1, -1))[0])
+
+    def jaccard_many (self, query_sig, sig_matrix):
+        """
+        jaccard_many(query_sig, sig_matrix) -> float array of the estimated Jaccard similarities of query_sig
+                                               and each row of sig_matrix
+
+        sig_matrix is an (N, num_functions) array of signatures, e.g., from signature_matrix.  The estimate
+        is the fraction of equal hashes.  With b_bits, unrelated hashes are equal with probability about
+        2^-b, so the estimate is corrected to (J-2^-b)/(1-2^-b) and clipped to [0, 1].
+        """
+        sig_matrix = np.asarray(sig_matrix)
+        if (query_sig is None):
+            return np.zeros(sig_matrix.shape[0])
+        q = np.asarray(query_sig, dtype=np.uint64)
+        if (sig_matrix.ndim != 2) or (sig_matrix.shape[1] != len(q)):
+            raise ValueError('jaccard_many: sig_matrix must have shape (N, {})'.format(len(q)))
+        jac = (sig_matrix==q.astype(sig_matrix.dtype)).mean(axis=1)
+        if (self.b_bits is not None):
+            r = 2.0**(-self.b_bits)
+            jac = np.clip((jac-r)/(1.0-r), 0.0, 1.0)
+        return jac
+
+    def collision_prob (self, threshold):
+        """
+        collision_prob(threshold) -> probability that one hash function collides for two strings with Jaccard
+                                     similarity threshold; hashes kept to b bits (b_bits, or num_bits) also
+                                     collide by chance with probability 2^-b.  Use as a collision_fns entry
+                                     of hash_store_dict.tune_slices.
+        """
+        b = self.b_bits if (self.b_bits is not None) else self.num_bits
+        r = 2.0**(-b)
+        return threshold+(1.0-threshold)*r
+
+    def signature_matrix (self, sigs):
+        """
+        signature_matrix(sigs) -> (M, valid)
+
+        Stacks a list of signatures from encode into an (N, num_functions) uint64 array M for jaccard_many.
+        Strings with no n-grams have signature None; their rows are all zero and valid[i] is False.
+        """
+        M = np.zeros((len(sigs), self.num_fns), dtype=np.uint64)
+        valid = np.zeros(len(sigs), dtype=bool)
+        for (i, sig) in enumerate(sigs):
+            if (sig is not None):
+                M[i] = sig
+                valid[i] = True
+        return (M, valid)
+
     def __get_char_ngrams (self, s):
         ng = []
         for i in xrange(0,len(s)-self.n+1):
@@ -126,6 +245,80 @@ class lsh_str_ngram_minhash (object):
                     out_str[i] = ng
         return out, out_str
 
+    def __one_perm_hash (self, ngrams):
+        # Hash each n-gram once: the bin comes from one universal hash, the value from min-hash function 0
+        out = [None]*self.num_fns
+        num = 0
+        for ng in ngrams:
+            num += 1
+            hs = hash(ng) & self.full_bit_mask
+            i = (((self.oph_a*hs+self.oph_b) & self.full_bit_mask) >> 16) % self.num_fns
+            hv = int(((self.a[0]*hs+self.b[0]) >> self.shift) & self.bit_mask)
+            if (out[i] is None) or (hv < out[i]):
+                out[i] = hv
+        if (num==0):
+            return None, None
+
+        # Optimal densification -- an empty bin copies the value of the first non-empty bin in 
+        # its own probe sequence
+        empty = [i for i in xrange(0, self.num_fns) if out[i] is None]
+        filled = list(out)
+        for i in empty:
+            attempt = 1
+            while True:
+                j = (((self.dens_a*(i*4096+attempt)+self.dens_b) & self.full_bit_mask) >> 16) % self.num_fns
+                if (out[j] is not None):
+                    filled[i] = out[j]
+                    break
+                attempt += 1
+        return filled, None
+
+    def __weighted_min_hash (self, tokens):
+        # Improved consistent weighted sampling (S. Ioffe, 2010); weights are token counts times 
+        # the optional per-token multipliers
+        weights = {}
+        for tok in tokens:
+            if (tok not in weights):
+                weights[tok] = 0.0
+            weights[tok] += 1.0
+        toks = []
+        w = []
+        for (tok, wt) in weights.iteritems():
+            if (tok in self.token_weights):
+                wt *= self.token_weights[tok]
+            if (wt > 0):
+                toks.append(hash(tok) & self.full_bit_mask)
+                w.append(wt)
+        if (len(toks)==0):
+            return None, None
+
+        # Per token and function r, c ~ Gamma(2,1) and beta ~ U(0,1), all tokens at once; each is a
+        # function of (seed, token hash, function, draw) so a token always gets the same values
+        u = self.__token_uniforms(np.array(toks, dtype=np.uint64), 5)
+        r = -np.log(u[:, :, 0]*u[:, :, 1])
+        c = -np.log(u[:, :, 2]*u[:, :, 3])
+        beta = u[:, :, 4]
+        t = np.floor(np.log(np.array(w))[:, np.newaxis]/r+beta)
+        a = c/(np.exp(r*(t-beta))*np.exp(r))
+        best = np.argmin(a, axis=0)
+        out = []
+        for i in xrange(0, self.num_fns):
+            hs = hash((toks[best[i]], int(t[best[i], i]))) & self.full_bit_mask
+            out.append(int(((self.a[i]*hs+self.b[i]) >> self.shift) & self.bit_mask))
+        return out, [toks[k] for k in best]
+
+    def __token_uniforms (self, tok_hashes, num_draws):
+        # Uniform (0,1) values of shape (tokens, num_functions, num_draws) from the splitmix64 finalizer of
+        # (seed, token hash, function, draw)
+        with np.errstate(over='ignore'):
+            draw = np.arange(self.num_fns*num_draws, dtype=np.uint64).reshape(1, self.num_fns, num_draws)
+            x = (tok_hashes.reshape(-1, 1, 1)*np.uint64(0x9E3779B97F4A7C15) + draw*np.uint64(0xD1B54A32D192ED03) +
+                 np.uint64(self.seed & 0xFFFFFFFFFFFFFFFF))
+            x = (x ^ (x >> np.uint64(30)))*np.uint64(0xBF58476D1CE4E5B9)
+            x = (x ^ (x >> np.uint64(27)))*np.uint64(0x94D049BB133111EB)
+            x = x ^ (x >> np.uint64(31))
+        return ((x >> np.uint64(11)).astype(np.float64)+0.5)*(2.0**-53)
+
     def __univ_hash (self, s):
         hs = hash(s) & self.full_bit_mask
         hash_list = []
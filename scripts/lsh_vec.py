@@ -8,7 +8,9 @@ Locality sensitive hashing for vectors
 
 from bitarray import bitarray
 import json
+import math
 import numpy as np
+import os
 
 class lsh_vec(object):
     """
@@ -17,7 +19,31 @@ class lsh_vec(object):
     Note: 
     1) rp_acos is the method of Charikar using random hyperplanes.  
        Pr_{h}[h(x)=h(y)] = 1 - (1/\pi) * theta(x,y)
+    2) sparse_acos replaces the Gaussian hyperplanes by sparse random +/-1 projections (Achlioptas; 
+       Li, Hastie and Church "very sparse" projections).  Optional config field "density" is the fraction
+       of non-zeros per hyperplane; default is 1/sqrt(dim).  Use 1/3 for Achlioptas projections.
+    3) hadamard_acos uses structured projections H D3 H D2 H D1 x where H is the Walsh-Hadamard transform
+       and D1, D2, D3 are random +/-1 diagonals (the input is zero padded to a power of 2).  Encoding is 
+       O(dim log dim) per block of outputs and only the diagonals are stored.
+    4) pstable_l2 is the p-stable scheme of Datar, Immorlica, Indyk and Mirrokni (E2LSH) for Euclidean distance:
+       h(x) = floor((a.x+b)/w), a Gaussian, b uniform in [0,w).  Config field "bucket_width" is w (default 4.0).
+    5) crosspolytope is the cross-polytope LSH of Andoni, Indyk, Laarhoven, Razenshteyn and Schmidt for angular 
+       distance: h(x) is the closest signed basis vector to a pseudo-random rotation (H D3 H D2 H D1) of x.
+    6) For rp_acos, sparse_acos and hadamard_acos each hash code is a bitarray of num_bits sign bits.
+       For pstable_l2 and crosspolytope, num_bits is the number of hashes concatenated per function and 
+       each hash code is a single non-negative integer, so codes work as band keys in hash_store_dict.
+    7) Optional config fields:
+       "dim" : input dimension -- projections are generated at init rather than on the first encode
+       "matrix_file" : (rp_acos only) .npy file for the projection matrices; created if it doesn't exist 
+                       (requires "dim") and memory-mapped read-only otherwise, so all workers share one copy.
+                       The method and seed are kept in <matrix_file>.json; a file made with another seed
+                       is rejected
     """
+
+    SIGN_METHODS = ('rp_acos', 'sparse_acos', 'hadamard_acos')
+    INT_METHODS = ('pstable_l2', 'crosspolytope')
+    MAX_BLOCK_SIZE = 2**22  # Max number of floats in a temporary array for encode_batch
+
     def __init__ (self, config):
         """
         config : file in JSON format
@@ -37,11 +63,21 @@ class lsh_vec(object):
             print 'Config is: {}'.format(self.config)
 
         # Initialize depending on type of LSH
-        if (self.config['method']=='rp_acos'):
+        if (self.config['method'] in lsh_vec.SIGN_METHODS+lsh_vec.INT_METHODS):
             self.rp_matrices = None
+            self.sp_cols = None
+            self.hd_signs = None
             self.L = self.config['num_functions']
             self.k = self.config['num_bits']
             self.prng = np.random.RandomState(self.config['seed'])
+            if ('dim' in self.config):
+                self.in_dim = self.config['dim']
+            else:
+                self.in_dim = None
+            if (self.config['method']=='rp_acos') and ('matrix_file' in self.config):
+                self.rp_matrices = self.__load_rp_matrices(self.config['matrix_file'])
+            elif (self.in_dim is not None):
+                self.__init_projections(self.in_dim)
         else:
             raise Exception('Unknown LSH method requested: {}'.format(self.config['method']))
 
@@ -50,35 +86,222 @@ class lsh_vec(object):
         x : vector to encode
         output: list of hash codes, length is L (specified in config as num_functions)
         """
-        bx = None
-        if (self.config['method']=='rp_acos'):
-            bx = self.__encode_rp_acos(x)
-        return bx
+        # One row through encode_batch, so both paths compute the same matrix product
+        return self.encode_batch(np.asarray(x)[np.newaxis, :])[0]
 
-    def __encode_rp_acos (self, x):
-        if (self.rp_matrices is None):
-            # We don't really need to store this since it can be generated on the fly
-            # This is a convenience
-            self.in_dim = len(x)
-            self.rp_matrices = []
-            for j in xrange(0, self.L):
-                rp_matrix = self.prng.randn(self.k, self.in_dim)
-                for i in xrange(0,rp_matrix.shape[0]):
-                    nr = np.linalg.norm(rp_matrix[i,:], 2)
-                    rp_matrix[i,:] = (1/nr)*rp_matrix[i,:]
-                self.rp_matrices.append(rp_matrix)
+    def encode_batch (self, X):
+        """
+        X : matrix of vectors to encode, one per row
+        output: list of hash codes for each row -- same as [encode(x) for x in X]
+        """
+        X = np.asarray(X)
+        if (X.ndim != 2):
+            raise ValueError('lsh_vec: encode_batch expects a 2-D array')
+        if (self.in_dim is None):
+            self.in_dim = X.shape[1]
+            self.__init_projections(self.in_dim)
+        # Work on blocks of rows to bound the size of temporaries
+        if (self.config['method']=='crosspolytope'):
+            row_size = self.L*self.k*self.hd_dim
+        else:
+            row_size = self.L*self.k+self.in_dim
+        num_rows = max(1, lsh_vec.MAX_BLOCK_SIZE // row_size)
         bx = []
-        for i in xrange(0,self.L):
-            y = self.rp_matrices[i].dot(x)
-            yl = [(lambda z: 1 if (z>=0) else 0)(z) for z in list(y)] 
-            bx.append(bitarray(yl))
+        for i in xrange(0, X.shape[0], num_rows):
+            bx.extend(self.__encode_block(X[i:i+num_rows]))
         return bx
 
+    def __encode_block (self, X):
+        if (self.config['method']=='rp_acos'):
+            Y = np.dot(X, self.rp_matrices.reshape(self.L*self.k, self.in_dim).T)
+        elif (self.config['method']=='sparse_acos'):
+            Y = self.__project_sparse(X)
+        elif (self.config['method']=='hadamard_acos'):
+            Y = self.__project_hadamard(X).reshape(X.shape[0], -1)[:, 0:self.L*self.k]
+        elif (self.config['method']=='pstable_l2'):
+            H = np.floor((np.dot(X, self.ps_proj.T)+self.ps_offset)/self.ps_width).astype(np.int64)
+            return self.__combine(H)
+        elif (self.config['method']=='crosspolytope'):
+            Z = self.__project_hadamard(X)
+            idx = np.argmax(np.abs(Z), axis=2)
+            neg = Z.reshape(-1, self.hd_dim)[np.arange(idx.size), idx.ravel()].reshape(idx.shape) < 0
+            return self.__combine(idx+neg*self.hd_dim)
+        bits = (Y >= 0).reshape(X.shape[0], self.L, self.k)
+        return [[bitarray(yl) for yl in b] for b in bits.tolist()]
+
+    def __combine (self, H):
+        # Combine the k hashes for each function into one 63-bit integer: sum_i h_i*m_i mod 2^64 with random odd m_i
+        H = H.reshape(H.shape[0], self.L, self.k).astype(np.int64).view(np.uint64)
+        hv = (H*self.combine_mult).sum(axis=2, dtype=np.uint64) & np.uint64(0x7FFFFFFFFFFFFFFF)
+        return hv.tolist()
+
+    def __init_projections (self, in_dim):
+        if (self.config['method']=='rp_acos'):
+            self.rp_matrices = self.__create_rp_matrices(in_dim)
+        elif (self.config['method']=='sparse_acos'):
+            self.__create_sparse_projections(in_dim)
+        elif (self.config['method']=='hadamard_acos'):
+            self.__create_hadamard_projections(in_dim, None)
+        elif (self.config['method']=='pstable_l2'):
+            if ('bucket_width' in self.config):
+                self.ps_width = float(self.config['bucket_width'])
+            else:
+                self.ps_width = 4.0
+            self.ps_proj = self.prng.randn(self.L*self.k, in_dim)
+            self.ps_offset = self.prng.uniform(0, self.ps_width, size=self.L*self.k)
+        elif (self.config['method']=='crosspolytope'):
+            self.__create_hadamard_projections(in_dim, self.L*self.k)
+        if (self.config['method'] in lsh_vec.INT_METHODS):
+            self.combine_mult = (2*self.prng.randint(0, 2**62, size=self.k)+1).astype(np.uint64)
+
+    def __create_rp_matrices (self, in_dim):
+        # Draws are in the same order as one randn(k, in_dim) call per function, so the
+        # matrices are identical to the ones generated lazily on the first encode
+        rp_matrices = self.prng.randn(self.L, self.k, in_dim)
+        rp_matrices /= np.linalg.norm(rp_matrices, axis=2)[:, :, np.newaxis]
+        return rp_matrices
+
+    def __load_rp_matrices (self, fn):
+        meta = {'method':self.config['method'], 'seed':self.config['seed']}
+        if (not os.path.exists(fn)):
+            if (self.in_dim is None):
+                raise Exception('lsh_vec: "dim" must be specified in config to create {}'.format(fn))
+            rp_matrices = self.__create_rp_matrices(self.in_dim)
+            # Write to temporary files and rename so concurrent workers never see a partial file; the seed
+            # file goes first so the matrix file never appears without it
+            _write_renamed(fn + '.json', lambda f: json.dump(meta, f))
+            _write_renamed(fn, lambda f: np.save(f, rp_matrices))
+        if (not os.path.exists(fn + '.json')):
+            raise Exception('lsh_vec: matrix file {} has no {}.json with its method and seed'.format(fn, fn))
+        meta_file = open(fn + '.json', 'r')
+        file_meta = json.load(meta_file)
+        meta_file.close()
+        if (file_meta != meta):
+            raise Exception('lsh_vec: matrix file {} was made with method {} and seed {}, config has method {} and seed {}'.format(fn,
+                            file_meta.get('method'), file_meta.get('seed'), meta['method'], meta['seed']))
+        rp_matrices = np.load(fn, mmap_mode='r')
+        if (rp_matrices.ndim != 3) or (rp_matrices.shape[0:2] != (self.L, self.k)):
+            raise Exception('lsh_vec: matrix file {} has shape {}, expected ({}, {}, dim)'.format(fn, rp_matrices.shape, self.L, self.k))
+        if (self.in_dim is None):
+            self.in_dim = rp_matrices.shape[2]
+        elif (rp_matrices.shape[2] != self.in_dim):
+            raise Exception('lsh_vec: matrix file {} has dim {}, config has dim {}'.format(fn, rp_matrices.shape[2], self.in_dim))
+        return rp_matrices
+
+    def __create_sparse_projections (self, in_dim):
+        # Store the non-zeros of the (L*k) x in_dim projection as (column, sign) pairs sorted by row;
+        # the scale of each hyperplane doesn't change the sign so it is dropped
+        if ('density' in self.config):
+            density = self.config['density']
+        else:
+            density = 1.0/np.sqrt(in_dim)
+        # Sample the number of non-zeros of each row, then their positions directly -- O(non-zeros), not O(in_dim)
+        num_rows = self.L*self.k
+        row_len = np.maximum(1, self.prng.binomial(in_dim, min(1.0, density), size=num_rows))
+        pos = np.zeros(0, dtype=np.int64)
+        need = row_len
+        while (need.sum() > 0):
+            # Draw the missing positions with replacement and drop repeats within a row
+            rows = np.repeat(np.arange(num_rows), need)
+            pos = np.unique(np.concatenate((pos, rows*in_dim+self.prng.randint(0, in_dim, size=len(rows)))))
+            need = row_len-np.bincount(pos // in_dim, minlength=num_rows)
+        self.sp_cols = (pos % in_dim).astype(np.int32)
+        self.sp_signs = (2*self.prng.randint(0, 2, size=len(self.sp_cols))-1).astype(np.int8)
+        self.sp_row_start = np.r_[0, np.cumsum(row_len)[:-1]]
+
+    def __project_sparse (self, X):
+        Y = np.add.reduceat(X[:, self.sp_cols]*self.sp_signs, self.sp_row_start, axis=1)
+        return Y
+
+    def __create_hadamard_projections (self, in_dim, num_blocks):
+        # Each block is a pseudo-random rotation H D3 H D2 H D1 giving hd_dim outputs
+        self.hd_dim = 1
+        while (self.hd_dim < in_dim):
+            self.hd_dim *= 2
+        if (num_blocks is None):
+            num_blocks = -(-(self.L*self.k) // self.hd_dim)
+        self.hd_signs = (2*self.prng.randint(0, 2, size=(3, num_blocks, self.hd_dim))-1).astype(np.int8)
+
+    def __project_hadamard (self, X):
+        Z = np.zeros((X.shape[0], 1, self.hd_dim))
+        Z[:, 0, 0:X.shape[1]] = X
+        for D in self.hd_signs:
+            Z = _fwht(Z*D)
+        return Z
+
+    def collision_rate (self, x, y):
+        """
+        x, y: hash codes for two vectors 
+        output: fraction of the L functions where the hash codes are equal
+        """
+        s = 0.0
+        for i in xrange(0, self.L):
+            if (x[i]==y[i]):
+                s += 1.0
+        s *= (1.0/self.L)
+        return s
+
+    def collision_prob(self, threshold, num_pairs=2000):
+        """
+        threshold: cosine similarity (rp_acos, sparse_acos, hadamard_acos, crosspolytope) or Euclidean
+                   distance (pstable_l2) of two vectors
+        output: probability that one hash function (num_bits hashes) collides for the two vectors; use as a
+                collision_fns entry of hash_store_dict.tune_slices
+        crosspolytope has no closed form at finite dimension, so its probability is the collision rate of
+        this object's functions on num_pairs random pairs of unit vectors at cosine threshold
+        """
+        if (self.config['method'] in lsh_vec.SIGN_METHODS):
+            return (1.0-math.acos(max(-1.0, min(1.0, threshold)))/math.pi)**self.k
+        elif (self.config['method']=='pstable_l2'):
+            if (threshold <= 0.0):
+                return 1.0
+            if ('bucket_width' in self.config):
+                w = float(self.config['bucket_width'])
+            else:
+                w = 4.0
+            return _pstable_collision_prob(threshold, w)**self.k
+        if (self.in_dim is None):
+            raise Exception('lsh_vec: collision_prob for crosspolytope needs the input dimension -- set "dim" or encode first')
+        prng = np.random.RandomState(self.config['seed']+1)
+        X = prng.randn(num_pairs, self.in_dim)
+        X /= np.linalg.norm(X, axis=1)[:, np.newaxis]
+        Z = prng.randn(num_pairs, self.in_dim)
+        Z -= np.einsum('ij,ij->i', Z, X)[:, np.newaxis]*X
+        Z /= np.linalg.norm(Z, axis=1)[:, np.newaxis]
+        c = max(-1.0, min(1.0, threshold))
+        Y = c*X+math.sqrt(1.0-c*c)*Z
+        return float((np.array(self.encode_batch(X))==np.array(self.encode_batch(Y))).mean())
+
+    def approx_l2(self, x, y):
+        """
+        x, y: hash codes for two vectors (pstable_l2 only)
+        output: approximate Euclidean distance between vectors, found by inverting the collision 
+                probability p(c)^num_bits of a function at distance c
+        """
+        if (self.config['method']!='pstable_l2'):
+            raise Exception('lsh_vec: approx_l2 is only defined for pstable_l2')
+        p = self.collision_rate(x, y)**(1.0/self.k)
+        if (p >= 1.0):
+            return 0.0
+        if (p <= 0.0):
+            return float('inf')
+        # p(c) is decreasing in c; bisect on log(c)
+        lo = -20.0
+        hi = 20.0
+        for i in xrange(0, 100):
+            mid = 0.5*(lo+hi)
+            if (_pstable_collision_prob(np.exp(mid), self.ps_width) > p):
+                lo = mid
+            else:
+                hi = mid
+        return np.exp(0.5*(lo+hi))
+
     def hamming (self, x, y):
         """
         x, y: hash codes for two vectors 
         output: x, y -> average Hamming distance across L functions
         """
+        self.__check_sign_method()
         s = 0.0
         for i in xrange(0, self.L):
             s += self.k-(x[i]^y[i]).count()
@@ -91,6 +314,7 @@ class lsh_vec(object):
         output: x, y -> average normalized Hamming distance across L functions. 
                 The Hamming distance is normalized to a probability.
         """
+        self.__check_sign_method()
         s = 0.0
         for i in xrange(0, self.L):
             s += 1.0-(1.0/self.k)*((x[i]^y[i]).count())
@@ -114,3 +338,44 @@ class lsh_vec(object):
         dh = self.norm_hamming(x, y)
         d = np.cos(np.pi*(1-dh))
         return d
+
+    def __check_sign_method (self):
+        if (self.config['method'] not in lsh_vec.SIGN_METHODS):
+            raise Exception('lsh_vec: Hamming distances are only defined for {}'.format(lsh_vec.SIGN_METHODS))
+
+def _fwht (a):
+    """
+    Unnormalized fast Walsh-Hadamard transform along the last axis; length must be a power of 2
+    """
+    shp = a.shape
+    n = shp[-1]
+    h = 1
+    while (h < n):
+        a = a.reshape(-1, n // (2*h), 2, h)
+        a = np.concatenate((a[:, :, 0:1, :]+a[:, :, 1:2, :], a[:, :, 0:1, :]-a[:, :, 1:2, :]), axis=2)
+        h *= 2
+    return a.reshape(shp)
+
+def _pstable_collision_prob (c, w):
+    """
+    Probability that floor((a.x+b)/w) = floor((a.y+b)/w) for Gaussian a when |x-y| = c
+    """
+    r = w/c
+    return 1.0-2.0*0.5*(1.0+math.erf(-r/np.sqrt(2.0)))-(2.0/(np.sqrt(2.0*np.pi)*r))*(1.0-np.exp(-0.5*r*r))
+
+def _write_renamed (fn, write_fn):
+    """
+    Call write_fn(f) on a temporary file and rename it to fn; the temporary file is removed on failure
+    """
+    tmp_fn = '{}.{}.tmp'.format(fn, os.getpid())
+    try:
+        f = open(tmp_fn, 'wb')
+        try:
+            write_fn(f)
+        finally:
+            f.close()
+        os.rename(tmp_fn, fn)
+    except:
+        if os.path.exists(tmp_fn):
+            os.remove(tmp_fn)
+        raise
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+"""
+Match output -- buffered writers for (key1, key2, feature, score) pairs as TSV, gzipped TSV or
+binary columns, and a memory mapped reader for the binary format
+"""
+
+import gzip
+import itertools
+import json
+import numpy as np
+from key_dict import key_dict
+import os
+
+FORMATS = ('tsv', 'tsv.gz', 'bin')
+COLUMNS = [('key1', np.int32), ('key2', np.int32), ('feature', np.uint8), ('score', np.float32)]
+
+class match_writer(object):
+    """
+    Accumulates match pairs in memory and writes them in large blocks
+
+    Formats:
+    - "tsv": key1, key2, feature, score columns with a header line, utf-8
+    - "tsv.gz": the same, gzip compressed
+    - "bin": binary columns <fn>.key1 and <fn>.key2 (int32 key ids), <fn>.feature (uint8 feature ids) and
+             <fn>.score (float32); key ids index the key dictionary <fn>.keys (utf-8, one key per line) and
+             feature ids the "features" list in <fn>.json.  Read with match_reader.
+
+    Typical usage:
+    >>> mw = match_writer('matches.tsv.gz')
+    >>> mw.add_many('@a', ['@b', '@c'], 'userName', [0.8, 0.6])
+    >>> mw.close()
+    """
+
+    def __init__(self, fn, fmt=None, buffer_size=2**16, compresslevel=6):
+        """
+        fn : output file name; the prefix of the column files for "bin"
+        fmt : one of FORMATS; default is "tsv.gz" if fn ends with .gz, otherwise "tsv"
+        buffer_size : number of pairs held in memory before a write
+        compresslevel : gzip compression level for "tsv.gz"
+        """
+        if (fmt is None):
+            fmt = 'tsv.gz' if fn.endswith('.gz') else 'tsv'
+        if (fmt not in FORMATS):
+            raise ValueError('match_writer: unknown format {}'.format(fmt))
+        self.fn = fn
+        self.fmt = fmt
+        self.buffer_size = buffer_size
+        self.num_pairs = 0
+        self.num_buffered = 0
+        if (fmt=='bin'):
+            self.key_dict = key_dict()
+            self.features = []
+            self.feature_ids = {}
+            self.num_keys_written = 0
+            self.buf = dict([(col, []) for (col, dtype) in COLUMNS])
+            self.files = dict([(col, open('{}.{}'.format(fn, col), 'wb')) for (col, dtype) in COLUMNS])
+            self.key_file = open(fn + '.keys', 'w')
+        else:
+            self.buf = []
+            if (fmt=='tsv.gz'):
+                self.file = gzip.open(fn, 'wb', compresslevel)
+            else:
+                self.file = open(fn, 'wb')
+            self.file.write('key1\tkey2\tfeature\tscore\n')
+
+    def add(self, key1, key2, feature, score):
+        """mw.add(key1, key2, feature, score) adds one pair"""
+        self.add_many(key1, [key2], feature, [score])
+
+    def add_many(self, key1, keys2, feature, scores):
+        """mw.add_many(key1, keys2, feature, scores) adds the pairs of key1 with each of keys2 and their scores"""
+        if (len(keys2) != len(scores)):
+            raise ValueError('match_writer: keys2 and scores must have the same length')
+        if (len(keys2)==0):
+            return
+        if (self.fmt=='bin'):
+            if (feature not in self.feature_ids):
+                if (len(self.features) > np.iinfo(np.uint8).max):
+                    raise ValueError('match_writer: too many features')
+                self.feature_ids[feature] = len(self.features)
+                self.features.append(feature)
+            ids2 = self.key_dict.intern_many(keys2)
+            self.buf['key1'].append(np.full(len(ids2), self.key_dict.intern(key1), dtype=np.int32))
+            self.buf['key2'].append(ids2)
+            self.buf['feature'].append(np.full(len(ids2), self.feature_ids[feature], dtype=np.uint8))
+            self.buf['score'].append(np.asarray(scores, dtype=np.float32))
+        else:
+            prefix = u'{}\t'.format(key1)
+            suffix = u'\t{}\t'.format(feature)
+            self.buf.extend([u'{}{}{}{}\n'.format(prefix, ky2, suffix, score) for (ky2, score) in zip(keys2, scores)])
+        self.num_pairs += len(keys2)
+        self.num_buffered += len(keys2)
+        if (self.num_buffered >= self.buffer_size):
+            self.flush()
+
+    def flush(self):
+        """mw.flush() writes the buffered pairs"""
+        if (self.fmt=='bin'):
+            for (col, dtype) in COLUMNS:
+                if (len(self.buf[col]) > 0):
+                    self.files[col].write(np.concatenate(self.buf[col]).astype(dtype).tobytes())
+                self.buf[col] = []
+                self.files[col].flush()
+            new_keys = [self.key_dict.key_at(i) for i in xrange(self.num_keys_written, len(self.key_dict))]
+            for ky in new_keys:
+                if not isinstance(ky, basestring):
+                    ky = unicode(ky)
+                if ('\n' in ky):
+                    raise ValueError('match_writer: keys cannot contain newlines')
+                self.key_file.write(ky.encode('utf-8') + '\n')
+            self.num_keys_written += len(new_keys)
+            self.key_file.flush()
+            self.__write_meta()
+        else:
+            self.file.write(u''.join(self.buf).encode('utf-8'))
+            self.buf = []
+            self.file.flush()
+        self.num_buffered = 0
+
+    def close(self):
+        """mw.close() writes the buffered pairs and closes the output"""
+        self.flush()
+        if (self.fmt=='bin'):
+            for f in self.files.itervalues():
+                f.close()
+            self.key_file.close()
+        else:
+            self.file.close()
+
+    def __write_meta(self):
+        meta_file = open(self.fn + '.json', 'w')
+        json.dump({'num_pairs':self.num_pairs, 'num_keys':self.num_keys_written, 'features':self.features,
+                   'columns':[[col, np.dtype(dtype).name] for (col, dtype) in COLUMNS]}, meta_file)
+        meta_file.close()
+
+class match_reader(object):
+    """
+    Reads match pairs written by match_writer in the "bin" format
+
+    The columns key1, key2, feature and score are memory mapped arrays; key_dict maps key ids back
+    to keys and features maps feature ids to names.
+
+    Typical usage:
+    >>> mr = match_reader('matches.bin')
+    >>> good = (mr.score >= 0.8)
+    >>> mr.key_dict.to_keys(mr.key1[good])
+    """
+
+    def __init__(self, fn):
+        """fn : file name given to match_writer"""
+        meta_file = open(fn + '.json', 'r')
+        meta = json.load(meta_file)
+        meta_file.close()
+        self.num_pairs = meta['num_pairs']
+        self.features = meta['features']
+        key_file = open(fn + '.keys', 'r')
+        self.key_dict = key_dict([ln.rstrip('\n').decode('utf-8') for ln in itertools.islice(key_file, meta['num_keys'])])
+        key_file.close()
+        for (col, dtype) in COLUMNS:
+            col_fn = '{}.{}'.format(fn, col)
+            if (os.path.getsize(col_fn) < self.num_pairs*np.dtype(dtype).itemsize):
+                raise ValueError('match_reader: {} is truncated'.format(col_fn))
+            if (self.num_pairs==0):
+                setattr(self, col, np.zeros(0, dtype=dtype))
+            else:
+                setattr(self, col, np.memmap(col_fn, dtype=dtype, mode='r', shape=(self.num_pairs,)))
+
+    def __len__(self):
+        return self.num_pairs
+
+    def __iter__(self):
+        """iterates over (key1, key2, feature, score) tuples"""
+        block = 2**16
+        for st in xrange(0, self.num_pairs, block):
+            end = min(st+block, self.num_pairs)
+            keys1 = self.key_dict.to_keys(self.key1[st:end])
+            keys2 = self.key_dict.to_keys(self.key2[st:end])
+            feats = [self.features[i] for i in self.feature[st:end].tolist()]
+            for tp in zip(keys1, keys2, feats, self.score[st:end].tolist()):
+                yield tp
@@ -10,19 +10,29 @@ Tools for loading features and hashing data
 # BC 7/4/15
 
 import codecs
+from disk_index import disk_index_builder
+from distutils.spawn import find_executable
 from feat_store_dict import feat_store_dict
 import glob
 import gzip
+import itertools
 from hash_store_dict import hash_store_dict
+import json
 import numpy as np
 import os
+import pool_tools
+import postings
+import Queue
 import random
 import re
+import subprocess
 import sys
+import text_tools as tt
+import threading
 
-def create_canopy(hs, feat_nm, seed, sthresh, verbose=False):
+def create_canopy(hs, feat_nm, seed, sthresh, verbose=False, as_ids=False):
     """
-    create_canopy(hs, feat_nm, seed, sthresh, verbose=False)
+    create_canopy(hs, feat_nm, seed, sthresh, verbose=False, as_ids=False)
     
     hs = hash store
     feat_nm = feature to create canopy for
@@ -30,45 +40,55 @@ def create_canopy(hs, feat_nm, seed, sthresh, verbose=False):
     sthresh = similarity threshold, between 0 and 1 -- anything above the threshold will be 
               removed from further selection when creating the canopy
     verbose = True/False chatty info on stdout
+    as_ids = return each canopy set as a sorted array of ids from hs.index_key_dict
     """
     if (sthresh<0) or (sthresh>1):
         raise ValueError('create_canopy: similarity threshold should be between 0 and 1')
-    ky_set = set(hs.keys())
+    return _create_canopy_ids(hs, feat_nm, seed, sthresh, verbose, as_ids)
+
+def _create_canopy_ids(hs, feat_nm, seed, sthresh, verbose=False, as_ids=False):
+    # create_canopy on item ids and the posting arrays of retrieve_ids (create_indexes or create_sorted_indexes),
+    # so keys are only looked up for the seeds and the output.  Remaining items are kept in an array (swap with
+    # the last on removal) and a mask, so drawing a seed is O(1).
+    kd = hs.index_key_dict
+    remaining = np.zeros(len(kd), dtype=bool)
+    remaining[hs.item_ids] = True
+    rem_list = np.array(hs.item_ids, dtype=np.int64)
+    rem_pos = np.zeros(len(kd), dtype=np.int64)
+    rem_pos[rem_list] = np.arange(len(rem_list))
+    num_rem = len(rem_list)
     prng = random.Random(seed)
     canopy = []
 
-    while len(ky_set)>0:
-        # Get initial seed for current canopy set
-        canopy_set = set([])
-        ky_rnd = prng.sample(ky_set, 1)[0]  # sample random element from set
-        canopy_set.add(ky_rnd)
-        hs_sig = hs[ky_rnd][feat_nm]
-        result = hs.retrieve(feat_nm, hs_sig)
-        result = [(r & ky_set) for r in result]
-        if verbose:
-            print 'seed: {}'.format(ky_rnd)
-            print 'result: {}'.format(result)
-        result_hash = {}
-        num_sets = 0
-        for r in result:
-            num_sets += 1
-            for v in r:
-                if v not in result_hash:
-                    result_hash[v] = 0
-                result_hash[v] += 1
-        num_sets *= 1.0
-        for ky in result_hash.iterkeys():
-            result_hash[ky] /= num_sets
-        for ky in result_hash.iterkeys():
-            canopy_set.add(ky)
-            if (result_hash[ky]>sthresh) and (ky in ky_set):
-                ky_set.remove(ky)
+    while num_rem>0:
+        # Get initial seed for current canopy set and count votes of the remaining items
+        i_rnd = rem_list[prng.randint(0, num_rem-1)]
+        hs_sig = hs[kd.key_at(i_rnd)][feat_nm]
+        result = hs.retrieve_ids(feat_nm, hs_sig)
+        num_sets = 1.0*len(result)
+        (ids, counts) = postings.vote_counts([r[remaining[r]] for r in result])
+        canopy_ids = np.union1d(ids, [i_rnd])
         if verbose:
-            print 'hs_keys is: {}'.format(hs_sig)
-            print 'result_hash is: {}'.format(result_hash)
-            print 'canopy set: {}'.format(canopy_set)
-        # Append canopy set to canopy
-        canopy.append(canopy_set)
+            print 'seed: {}'.format(kd.key_at(i_rnd))
+            print 'canopy set: {}'.format(kd.to_keys(canopy_ids))
+
+        # Remove items above the threshold (and the seed) from further selection
+        if (num_sets > 0):
+            rm = set(ids[counts/num_sets > sthresh].tolist())
+        else:
+            rm = set([])
+        rm.add(i_rnd)
+        for i in rm:
+            j = rem_pos[i]
+            last = rem_list[num_rem-1]
+            rem_list[j] = last
+            rem_pos[last] = j
+            num_rem -= 1
+        remaining[list(rm)] = False
+        if as_ids:
+            canopy.append(canopy_ids)
+        else:
+            canopy.append(set(kd.to_keys(canopy_ids)))
     return canopy
 
 def create_hash_from_fs (fs, lsh_classes, lsh_configs, hash_store_class, hash_store_config):
@@ -106,18 +126,107 @@ def create_hash_from_fs (fs, lsh_classes, lsh_configs, hash_store_class, hash_st
         print
     return hs
 
-def compute_sparse_distances(canopy, feat_store, fname, dist_fn):
+def create_hash_from_vec_matrix (X, keys, lsh_class, lsh_config, hash_store_class, hash_store_config, feat_nm='vector', normalize=True, chunk_size=10000):
+    """
+    create_hash_from_vec_matrix (X, keys, lsh_class, lsh_config, hash_store_class, hash_store_config, feat_nm='vector', normalize=True, chunk_size=10000)
+
+    Hash the rows of a matrix (e.g., from open_vec_matrix) in chunks with lsh_class.encode_batch.
+
+    X = matrix of vectors, one per row; may be memory mapped
+    keys = list of keys, one per row of X
+    lsh_class, lsh_config = class and config for the LSH of feature 'feat_nm'
+    hash_store_class, hash_store_config = hash store class and config
+    normalize = set to True to normalize rows to unit norm before hashing
+    chunk_size = number of rows hashed at a time
+    """
+    if (len(keys) != X.shape[0]):
+        raise ValueError('create_hash_from_vec_matrix: number of keys ({}) and rows ({}) differ'.format(len(keys), X.shape[0]))
+    lsh_obj = lsh_class(lsh_config)
+    hs = hash_store_class(hash_store_config)
+    had_output = False
+    for i in xrange(0, X.shape[0], chunk_size):
+        chunk = _load_vec_chunk(X, i, i+chunk_size, X.dtype, normalize)
+        codes = lsh_obj.encode_batch(chunk)
+        for (ky, code) in zip(keys[i:i+chunk_size], codes):
+            hs.add(ky, {feat_nm:code})
+        print '{}K '.format((i+chunk.shape[0])/1000),
+        sys.stdout.flush()
+        had_output = True
+    if had_output:
+        print
+    return hs
+
+def create_disk_index_from_vec_matrix (X, keys, lsh_class, lsh_config, prefix, slices, memory_mb=256, feat_nm='vector', normalize=True, chunk_size=10000, compress=False):
+    """
+    create_disk_index_from_vec_matrix (X, keys, lsh_class, lsh_config, prefix, slices, memory_mb=256, feat_nm='vector', normalize=True, chunk_size=10000, compress=False)
+
+    Out-of-core version of create_hash_from_vec_matrix followed by create_sorted_indexes: the rows of X are
+    hashed in chunks and streamed into a disk_index_builder, so neither the codes nor the index are held in
+    memory.  Read the index with disk_index.disk_index(prefix).
+
+    keys = keys of the rows of X -- a list, or any iterable such as iter_keys(key_fn), read a chunk at a time
+    prefix = prefix of the index files
+    slices = list of bands (start, stop) for feature 'feat_nm'
+    memory_mb = memory budget of the index build; see disk_index_builder
+    compress = delta + varint code the posting lists
+    """
+    if hasattr(keys, '__len__') and (len(keys) != X.shape[0]):
+        raise ValueError('create_disk_index_from_vec_matrix: number of keys ({}) and rows ({}) differ'.format(len(keys), X.shape[0]))
+    lsh_obj = lsh_class(lsh_config)
+    key_iter = iter(keys)
+    builder = disk_index_builder(prefix, {feat_nm:slices}, memory_mb, compress=compress)
+    had_output = False
+    try:
+        for i in xrange(0, X.shape[0], chunk_size):
+            chunk = _load_vec_chunk(X, i, i+chunk_size, X.dtype, normalize)
+            chunk_keys = list(itertools.islice(key_iter, chunk.shape[0]))
+            if (len(chunk_keys) != chunk.shape[0]):
+                raise ValueError('create_disk_index_from_vec_matrix: fewer keys ({}) than rows ({})'.format(i+len(chunk_keys), X.shape[0]))
+            builder.add_batch(chunk_keys, {feat_nm:lsh_obj.encode_batch(chunk)})
+            print '{}K '.format((i+chunk.shape[0])/1000),
+            sys.stdout.flush()
+            had_output = True
+        if had_output:
+            print
+        if (next(key_iter, None) is not None):
+            raise ValueError('create_disk_index_from_vec_matrix: more keys than rows ({})'.format(X.shape[0]))
+    except:
+        builder.abort()
+        raise
+    builder.close()
+
+def compute_sparse_distances(canopy, feat_store, fname, dist_fn, key_dict=None):
     """
-    compute_sparse_distances(canopy, feat_store, fname, dist_fn)
+    compute_sparse_distances(canopy, feat_store, fname, dist_fn, key_dict=None)
 
     canopy = canopy created from create_canopy -- a list of sets of keys
     feat_store = feature store
     fname = feature name to use for computing distances
     dist_fn = distance function that can be called as dist_fn(x,y)
+    key_dict = (optional) canopy sets are arrays of ids from key_dict (create_canopy with as_ids=True); 
+               the distances are then keyed by ids and each canopy's vectors are fetched once
     """
     dmax = 1.0*len(feat_store.keys())**2
     d = {}
     num_dist = 0
+    if (key_dict is not None):
+        for cs in canopy:
+            cs = np.asarray(cs).tolist()
+            keys = key_dict.to_keys(cs)
+            if hasattr(feat_store, 'get_many'):
+                vals = feat_store.get_many(keys, fname)
+            else:
+                vals = [feat_store[ky][fname] for ky in keys]
+            for (i1, v1) in zip(cs, vals):
+                if i1 not in d:
+                    d[i1] = {}
+                d_i1 = d[i1]
+                for (i2, v2) in zip(cs, vals):
+                    if i2 not in d_i1:
+                        num_dist += 1
+                        d_i1[i2] = dist_fn(v1, v2)
+        print 'number of distances computed: {} / {} = {} %'.format(num_dist, dmax, 100.0*(num_dist/dmax))
+        return d
     for cs in canopy:
         for ky1 in cs:
             v1 = feat_store[ky1][fname]
@@ -132,6 +241,83 @@ def compute_sparse_distances(canopy, feat_store, fname, dist_fn):
     print 'number of distances computed: {} / {} = {} %'.format(num_dist, dmax, 100.0*(num_dist/dmax))
     return d
 
+def rerank_cosine(feat_store, fname, query_vec, candidates, top_k=None):
+    """
+    rerank_cosine(feat_store, fname, query_vec, candidates, top_k=None)
+
+    Exact re-ranking of retrieved candidates by cosine similarity to query_vec.
+
+    feat_store = feature store with vector feature 'fname'; vectors are fetched in one call with
+                 get_many if the store has it (e.g., feat_store_mmap)
+    candidates = keys to re-rank, e.g., from hs.retrieve
+    top_k = (optional) only return the top_k best matches
+    output: list of (key, cosine) pairs, most similar first
+    """
+    candidates = list(candidates)
+    if (len(candidates)==0):
+        return []
+    if hasattr(feat_store, 'get_many'):
+        V = np.asarray(feat_store.get_many(candidates, fname), dtype=np.float64)
+    else:
+        V = np.array([feat_store[ky][fname] for ky in candidates], dtype=np.float64)
+    q = np.asarray(query_vec, dtype=np.float64)
+    nrm = np.sqrt(np.einsum('ij,ij->i', V, V))*np.linalg.norm(q)
+    nrm[nrm==0] = 1.0
+    cos = V.dot(q)/nrm
+    order = np.argsort(-cos, kind='mergesort')
+    if (top_k is not None):
+        order = order[0:top_k]
+    return [(candidates[i], float(cos[i])) for i in order]
+
+def exact_knn_cosine(X, query_rows, k, block_size=2**24):
+    """
+    exact_knn_cosine(X, query_rows, k, block_size=2**24) -> (nbrs, sims)
+
+    Exact k nearest neighbors by cosine similarity, by blocked brute force -- ground truth for
+    evaluating LSH retrieval.
+
+    X = matrix of vectors, one per row; may be memory mapped
+    query_rows = rows of X to use as queries; a query is not its own neighbor
+    k = number of neighbors
+    block_size = max number of similarities computed at a time
+    nbrs, sims = len(query_rows) x k arrays of neighbor rows and similarities, most similar first
+    """
+    num = X.shape[0]
+    k = min(k, num-1)
+    nrm = np.empty(num)
+    rows_per_block = max(1, block_size // max(1, X.shape[1]))
+    for i in xrange(0, num, rows_per_block):
+        B = np.asarray(X[i:i+rows_per_block], dtype=np.float64)
+        nrm[i:i+rows_per_block] = np.sqrt(np.einsum('ij,ij->i', B, B))
+    nrm[nrm==0] = 1.0
+    query_rows = np.asarray(query_rows)
+    Q = np.asarray(X[query_rows], dtype=np.float64)/nrm[query_rows][:, np.newaxis]
+    nbrs = np.empty((len(query_rows), k), dtype=np.int64)
+    sims = np.empty((len(query_rows), k))
+    best_idx = np.zeros((len(query_rows), 0), dtype=np.int64)
+    best_sim = np.zeros((len(query_rows), 0))
+
+    # Keep a running top k over blocks of rows of X
+    rows_per_block = max(1, block_size // max(1, len(query_rows)))
+    for i in xrange(0, num, rows_per_block):
+        B = np.asarray(X[i:i+rows_per_block], dtype=np.float64)
+        S = Q.dot(B.T)/nrm[i:i+rows_per_block]
+        is_self = (query_rows >= i) & (query_rows < i+B.shape[0])
+        S[np.nonzero(is_self)[0], query_rows[is_self]-i] = -np.inf
+        cand_idx = np.hstack([best_idx, np.tile(np.arange(i, i+B.shape[0]), (len(query_rows), 1))])
+        cand_sim = np.hstack([best_sim, S])
+        if (cand_sim.shape[1] > k):
+            top = np.argpartition(-cand_sim, k-1, axis=1)[:, 0:k]
+            r = np.arange(len(query_rows))[:, np.newaxis]
+            (best_idx, best_sim) = (cand_idx[r, top], cand_sim[r, top])
+        else:
+            (best_idx, best_sim) = (cand_idx, cand_sim)
+    order = np.argsort(-best_sim, axis=1, kind='mergesort')
+    r = np.arange(len(query_rows))[:, np.newaxis]
+    nbrs[:] = best_idx[r, order]
+    sims[:] = best_sim[r, order]
+    return (nbrs, sims)
+
 def read_features_from_counts(count_dir, config, fs_class, limit=None):
     if (limit is None):
         limit = sys.maxint
@@ -158,9 +344,9 @@ def read_features_from_counts(count_dir, config, fs_class, limit=None):
     print
     return fs
 
-def read_vec_features_from_list (list_fn, config_feat, fs_class, config, limit=None):
+def read_vec_features_from_list (list_fn, config_feat, fs_class, config, limit=None, hs=None, lsh_obj=None):
     """
-    read_vec_features_from_list(list_fn, config_feat, fs_class, config, limit=None)
+    read_vec_features_from_list(list_fn, config_feat, fs_class, config, limit=None, hs=None, lsh_obj=None)
 
     list_fn  = List file to read from; format of each line is "<key> <vec file name>"
     config_feat   = JSON string to configure feature store; passed to fs_class
@@ -168,10 +354,15 @@ def read_vec_features_from_list (list_fn, config_feat, fs_class, config, limit=N
     config = dictionary of configuration parameters for ingest
         normalize = set to True to normalize vectors to unit norm after loading
         precision = numpy type -- either numpy.float or numpy.double
+        storage = (optional) storage type of the vectors -- 'float32', 'float16' or 'int8' (see _vec_storage)
     limit = (optional) limit to 'limit' instances loaded
+    hs, lsh_obj = (optional) hash store and LSH object -- each vector is also hashed with lsh_obj.encode and
+                  added to hs as feature 'vector'.  Hashing uses the loaded (normalized) vector, so codes do not
+                  depend on the storage type.
     """
 
     # Create feature store
+    (config_feat, cast) = _vec_storage(config_feat, fs_class, config)
     fs = fs_class(config_feat)
     
     # Setup
@@ -190,6 +381,10 @@ def read_vec_features_from_list (list_fn, config_feat, fs_class, config, limit=N
             nrm = np.linalg.norm(vec, 2)
             if (nrm > 0.0):
                 vec /= nrm
+        if (hs is not None):
+            hs.add(ky, {'vector':lsh_obj.encode(vec)})
+        if (cast is not None):
+            vec = vec.astype(cast)
         fs.add(ky, {'vector':vec})
         num += 1
         if (num % 1000)==0:
@@ -202,7 +397,125 @@ def read_vec_features_from_list (list_fn, config_feat, fs_class, config, limit=N
         print
     return fs
 
-def read_features_from_tsv(fn, config, ky_col, fs_class, limit=None):
+def open_vec_matrix (matrix_fn, precision=np.float32, dim=None):
+    """
+    open_vec_matrix(matrix_fn, precision=np.float32, dim=None)
+
+    Memory map a matrix of vectors, one per row, read-only.
+
+    matrix_fn = .npy file, or a raw binary file of 'precision' values with 'dim' columns
+    """
+    if re.search("\.npy$", matrix_fn):
+        X = np.load(matrix_fn, mmap_mode='r')
+    else:
+        if (dim is None):
+            raise ValueError('open_vec_matrix: dim is required for raw matrix file {}'.format(matrix_fn))
+        X = np.memmap(matrix_fn, dtype=precision, mode='r')
+        if (X.shape[0] % dim) != 0:
+            raise ValueError('open_vec_matrix: size of {} is not a multiple of dim={}'.format(matrix_fn, dim))
+        X = X.reshape(-1, dim)
+    if (X.ndim != 2):
+        raise ValueError('open_vec_matrix: {} is not a 2-D matrix'.format(matrix_fn))
+    return X
+
+def read_keys (key_fn, limit=None):
+    """
+    read_keys(key_fn, limit=None) -- read a list of keys, one per line
+    """
+    return list(iter_keys(key_fn, limit))
+
+def iter_keys (key_fn, limit=None):
+    """
+    iter_keys(key_fn, limit=None) -- generator of the keys in a file, one per line; see read_keys
+    """
+    key_file = open(key_fn, 'r')
+    try:
+        for (i, ln) in enumerate(key_file):
+            if (limit is not None) and (i>=limit):
+                break
+            yield ln.rstrip('\n')
+    finally:
+        key_file.close()
+
+def read_vec_features_from_matrix (matrix_fn, key_fn, config_feat, fs_class, config, limit=None):
+    """
+    read_vec_features_from_matrix(matrix_fn, key_fn, config_feat, fs_class, config, limit=None)
+
+    Bulk version of read_vec_features_from_list for vectors stored as the rows of one matrix file.
+
+    matrix_fn = .npy file or raw binary matrix file (see open_vec_matrix)
+    key_fn = file with one key per line, in the same order as the rows of the matrix
+    config_feat   = JSON string to configure feature store; passed to fs_class
+    fs_class = Class to use for feature store
+    config = dictionary of configuration parameters for ingest
+        normalize = set to True to normalize vectors to unit norm after loading
+        precision = numpy type of the raw matrix file and the stored vectors
+        dim = (raw files only) number of columns
+        chunk_size = (optional) number of rows loaded at a time, default 10000
+        storage = (optional) storage type of the vectors, as for read_vec_features_from_list
+    limit = (optional) limit to 'limit' instances loaded
+    """
+    precision = config['precision']
+    if ('dim' in config):
+        dim = config['dim']
+    else:
+        dim = None
+    if ('chunk_size' in config):
+        chunk_size = config['chunk_size']
+    else:
+        chunk_size = 10000
+    X = open_vec_matrix(matrix_fn, precision, dim)
+    keys = read_keys(key_fn, limit)
+    num_rows = X.shape[0] if (limit is None) else min(limit, X.shape[0])
+    if (len(keys) != num_rows):
+        raise ValueError('read_vec_features_from_matrix: {} has {} keys for {} rows'.format(key_fn, len(keys), num_rows))
+
+    # Add vectors in chunks -- each vector is a view of its chunk
+    (config_feat, cast) = _vec_storage(config_feat, fs_class, config)
+    fs = fs_class(config_feat)
+    num = len(keys)
+    for i in xrange(0, num, chunk_size):
+        chunk = _load_vec_chunk(X, i, min(i+chunk_size, num), precision, config['normalize'])
+        if (cast is not None):
+            chunk = chunk.astype(cast)
+        if hasattr(fs, 'add_batch'):
+            fs.add_batch(keys[i:i+chunk.shape[0]], {'vector':chunk})
+        else:
+            for j in xrange(0, chunk.shape[0]):
+                fs.add(keys[i+j], {'vector':chunk[j]})
+        print '{}K '.format((i+chunk.shape[0])/1000),
+        sys.stdout.flush()
+    print
+    return fs
+
+def _vec_storage (config_feat, fs_class, config):
+    # Storage type for vec features: stores that list VEC_DTYPES (feat_store_array, feat_store_mmap) get it as
+    # the "dtype" of their vec features, other stores get vectors cast to it.  Returns (config_feat, cast type).
+    if ('storage' not in config) or (config['storage'] is None):
+        return (config_feat, None)
+    storage = config['storage']
+    if hasattr(fs_class, 'VEC_DTYPES'):
+        if (storage not in fs_class.VEC_DTYPES):
+            raise ValueError('{} does not support {} storage'.format(fs_class.__name__, storage))
+        feats = json.loads(config_feat)
+        for x in feats:
+            if (x['type']=='vec'):
+                x['dtype'] = storage
+        return (json.dumps(feats), None)
+    if (storage not in ['float64', 'float32', 'float16']):
+        raise ValueError('{} does not support {} storage'.format(fs_class.__name__, storage))
+    return (config_feat, np.dtype(storage))
+
+def _load_vec_chunk (X, i1, i2, precision, normalize):
+    # Copy rows i1:i2 out of a (memory mapped) matrix and normalize them in place
+    chunk = np.array(X[i1:i2], dtype=precision)
+    if normalize:
+        nrm = np.sqrt(np.einsum('ij,ij->i', chunk, chunk))
+        nrm[nrm==0] = 1.0
+        chunk /= nrm[:, np.newaxis]
+    return chunk
+
+def read_features_from_tsv(fn, config, ky_col, fs_class, limit=None, normalize_fields=None, normalize_mode='ascii', num_workers=1, decompress='thread'):
     """
     read_features_from_tsv(fn, config, ky_col, fs_class)
 
@@ -211,46 +524,181 @@ def read_features_from_tsv(fn, config, ky_col, fs_class, limit=None):
     ky_col   = Name of the column to use as a key for the feature store
     fs_class = Class to use for feature store
     limit = (optional) limit to 'limit' instances loaded
+    normalize_fields = (optional) list of feature names to normalize with text_tools.normalize_stream
+    normalize_mode = mode for text_tools.normalize_stream -- 'ascii', 'lower_ascii' or 'full'
+    num_workers = number of processes used for normalization
+    decompress = gzip decompression method, see read_columns_from_tsv
+
+    Rows are streamed from the file through normalization into the feature store, so only the
+    feature store is held in memory.
     """
 
     # Create feature store
     fs = fs_class(config)
 
-    # Open file and get header
-    if re.search("\.gz$", fn):
-        ff_raw = gzip.open(fn,'r')
-    else:
-        ff_raw = open(fn, 'r')
-    feat_file = codecs.getreader('utf-8')(ff_raw)
-    hdr = feat_file.readline().rstrip("\n").split('\t')
-
-    #  Find feature indexes in header
-    name_col = {}
-    for nm in fs.names():
-        if (nm not in hdr):
-            raise Exception('Field {} not found in file {}'.format(nm, fn))
-        name_col[nm] = hdr.index(nm)
-    ky_col = hdr.index(ky_col)
-        
-    # Read in gz tsv file
-    num = 0
-    for ln in feat_file:
-        f = ln.rstrip("\n").split('\t')
-        ky = f[ky_col]
+    # Stream rows of the key and feature columns
+    feat_names = list(fs.names())
+    col_names = [ky_col] + [nm for nm in feat_names if (nm != ky_col)]
+    col_idx = dict([(nm, i) for (i, nm) in enumerate(col_names)])
+    rows = itertools.chain.from_iterable(_read_tsv_row_blocks(fn, col_names, limit, decompress=decompress))
+    if (normalize_fields is not None):
+        rows = tt.normalize_stream(rows, normalize_mode, num_workers, fields=[col_idx[nm] for nm in normalize_fields])
+
+    # Add to feature store
+    feat_idx = [(nm, col_idx[nm]) for nm in feat_names]
+    if hasattr(fs, 'add_batch'):
+        for chunk in pool_tools.chunk_iter(rows, 2**16):
+            cols = zip(*chunk)
+            fs.add_batch(list(cols[0]), dict([(nm, list(cols[i])) for (nm, i) in feat_idx]))
+        return fs
+    for row in rows:
         rec = {}
-        for (nm, col) in name_col.iteritems():
-            rec[nm] = f[col]
-        fs.add(ky, rec)
-        num += 1
-        if (num % 1000)==0:
-            print '{}K '.format(num/1000), 
-            sys.stdout.flush()
-        if (limit is not None) and (num>=limit):
-            break
-    feat_file.close()
-    print
+        for (nm, i) in feat_idx:
+            rec[nm] = row[i]
+        fs.add(row[0], rec)
 
     # Return feature store
     return fs
 
+def read_columns_from_tsv(fn, col_names, limit=None, block_size=2**24, decompress='thread', num_threads=4):
+    """
+    read_columns_from_tsv(fn, col_names, limit=None, block_size=2**24, decompress='thread', num_threads=4)
+
+    Read selected columns of a TSV file with a header line into columnar lists.  The file is read
+    and decoded in blocks of 'block_size' bytes, and each line is only split as far as the last
+    needed column.  Lines end with '\\n' only.
+
+    fn        = File to read from; '.gz' files are decompressed
+    col_names = Names of the columns to read
+    limit     = (optional) limit to 'limit' rows loaded
+    decompress = 'gzip'   -- decompress in the calling thread
+                 'thread' -- decompress in a background thread, overlapped with parsing
+                 'pigz'   -- decompress with a 'pigz' subprocess using 'num_threads' threads; falls back
+                             to 'thread' if pigz is not found
+    output: dictionary of column name -> list of unicode strings
+    """
+    col_names = sorted(set(col_names))
+    col_lists = [[] for nm in col_names]
+    for rows in _read_tsv_row_blocks(fn, col_names, limit, block_size, decompress, num_threads):
+        for (lst, vals) in zip(col_lists, zip(*rows)):
+            lst.extend(vals)
+    return dict(zip(col_names, col_lists))
 
+def _read_tsv_row_blocks(fn, col_names, limit=None, block_size=2**24, decompress='thread', num_threads=4):
+    # Generator of lists of rows, one list per block read; a row is the list of the values of col_names
+    blocks = _read_blocks(fn, block_size, decompress, num_threads)
+    hdr = None
+    rem = ''
+    num = 0
+    done = False
+    try:
+        for block in blocks:
+            buf = rem + block
+            last_nl = buf.rfind('\n')
+            if (last_nl < 0):
+                rem = buf
+                continue
+            rem = buf[last_nl+1:]
+            lines = buf[0:last_nl].decode('utf-8').split(u'\n')
+            if (hdr is None):
+                hdr = lines.pop(0).split(u'\t')
+                cols = []
+                for nm in col_names:
+                    if (nm not in hdr):
+                        raise Exception('Field {} not found in file {}'.format(nm, fn))
+                    cols.append(hdr.index(nm))
+                max_split = max(cols)+1
+            if (limit is not None) and (num+len(lines) >= limit):
+                lines = lines[0:limit-num]
+                done = True
+            rows = []
+            for ln in lines:
+                f = ln.split(u'\t', max_split)
+                rows.append([f[c] for c in cols])
+            num += len(lines)
+            print '{}K '.format(num/1000),
+            sys.stdout.flush()
+            yield rows
+            if done:
+                break
+    finally:
+        blocks.close()
+    if (not done) and (len(rem) > 0) and (hdr is not None) and ((limit is None) or (num < limit)):
+        f = rem.decode('utf-8').split(u'\t', max_split)
+        yield [[f[c] for c in cols]]
+    print
+
+def _read_blocks(fn, block_size, decompress, num_threads):
+    # Generator of raw (decompressed) blocks of a file
+    f = None
+    proc = None
+    th = None
+    if not re.search("\.gz$", fn):
+        f = open(fn, 'rb')
+        read_fn = f.read
+    elif (decompress=='pigz') and (find_executable('pigz') is not None):
+        proc = subprocess.Popen(['pigz', '-dc', '-p', str(num_threads), fn], stdout=subprocess.PIPE, bufsize=block_size)
+        f = proc.stdout
+        read_fn = f.read
+    elif (decompress in ['thread', 'pigz']):
+        # Decompress ahead in a background thread; zlib releases the GIL.  The consumer sets 'stop'
+        # when it is done, so the reader never stays blocked on a full queue.
+        q = Queue.Queue(4)
+        stop = threading.Event()
+        def put(x):
+            while not stop.is_set():
+                try:
+                    q.put(x, True, 0.1)
+                    return True
+                except Queue.Full:
+                    pass
+            return False
+        def reader():
+            try:
+                gz = gzip.open(fn, 'rb')
+                try:
+                    while True:
+                        block = gz.read(block_size)
+                        if (not put(block)) or (len(block)==0):
+                            break
+                finally:
+                    gz.close()
+            except Exception as e:
+                put(e)
+        th = threading.Thread(target=reader)
+        th.daemon = True
+        th.start()
+        def read_fn(n):
+            block = q.get()
+            if isinstance(block, Exception):
+                raise block
+            return block
+    elif (decompress=='gzip'):
+        f = gzip.open(fn, 'rb')
+        read_fn = f.read
+    else:
+        raise ValueError('Unknown decompression method: {}'.format(decompress))
+    try:
+        while True:
+            block = read_fn(block_size)
+            if (len(block)==0):
+                break
+            yield block
+        if (proc is not None):
+            f.close()
+            if (proc.wait() != 0):
+                raise IOError('pigz failed on {} with exit status {}'.format(fn, proc.returncode))
+    finally:
+        if (f is not None):
+            f.close()
+        if (proc is not None) and (proc.poll() is None):
+            proc.kill()
+            proc.wait()
+        if (th is not None):
+            stop.set()
+            try:
+                while True:
+                    q.get_nowait()
+            except Queue.Empty:
+                pass
+            th.join()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""
+Process pool helpers -- ordered map over chunks of a stream with a bounded number of chunks in flight
+"""
+
+import collections
+import itertools
+import multiprocessing
+
+def chunk_iter(items, chunk_size):
+    """chunk_iter(items, chunk_size) -> generator of lists of up to chunk_size consecutive items"""
+    it = iter(items)
+    while True:
+        chunk = list(itertools.islice(it, chunk_size))
+        if (len(chunk)==0):
+            return
+        yield chunk
+
+def imap_chunks(fn, items, chunk_size, num_workers=1, make_state=None, state_args=(), max_pending=None):
+    """
+    imap_chunks(fn, items, chunk_size, num_workers=1, make_state=None, state_args=(), max_pending=None)
+
+    Generator that applies fn(state, chunk) to chunks of chunk_size items and yields the outputs in input
+    order; fn returns a list with the outputs for its chunk.
+
+    fn, make_state = module level functions (they are sent to the workers by name)
+    make_state = builds the state passed to fn, state = make_state(*state_args); built once per worker, or
+                 once in the calling process if num_workers is 1
+    num_workers = number of processes; 1 runs fn in the calling process
+    max_pending = number of chunks sent to the pool and not yet yielded; default 2*num_workers.  Items
+                  are only read from the input as results are consumed, so memory stays bounded when the
+                  input is faster than the workers or the consumer is slower.
+    """
+    if (make_state is None):
+        make_state = _no_state
+    chunks = chunk_iter(items, chunk_size)
+    if (num_workers <= 1):
+        state = make_state(*state_args)
+        for chunk in chunks:
+            for out in fn(state, chunk):
+                yield out
+        return
+    if (max_pending is None):
+        max_pending = 2*num_workers
+    pool = multiprocessing.Pool(num_workers, _init_worker, (fn, make_state, state_args))
+    pending = collections.deque()
+    try:
+        for chunk in chunks:
+            pending.append(pool.apply_async(_run_chunk, (chunk,)))
+            if (len(pending) >= max_pending):
+                for out in pending.popleft().get():
+                    yield out
+        while (len(pending) > 0):
+            for out in pending.popleft().get():
+                yield out
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+# Per worker process: the function and its state, set by the pool initializer
+_worker_state = {}
+
+def _no_state():
+    return None
+
+def _init_worker(fn, make_state, state_args):
+    _worker_state['fn'] = fn
+    _worker_state['state'] = make_state(*state_args)
+
+def _run_chunk(chunk):
+    return _worker_state['fn'](_worker_state['state'], chunk)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+"""
+Compressed posting lists -- sorted integer ids stored as delta + varint bytes, with vectorized
+encode, decode, union, intersection and vote counting
+"""
+
+import numpy as np
+
+def encode(ids):
+    """
+    encode(ids) -> uint8 array with the sorted unique ids as delta + varint bytes
+    """
+    ids = np.unique(np.asarray(ids, dtype=np.int64))
+    (data, byte_offsets) = encode_groups(ids, np.array([0, len(ids)], dtype=np.int64))
+    return data
+
+def encode_groups(ids, offsets, prev=None):
+    """
+    encode_groups(ids, offsets, prev=None) -> (data, byte_offsets)
+
+    Encode many posting lists at once.  List j is ids[offsets[j]:offsets[j+1]] and must be sorted
+    ascending.  Each list is delta coded starting from 0 and each delta is written as a varint (7 bits
+    per byte, high bit set on all but the last byte).  List j is data[byte_offsets[j]:byte_offsets[j+1]].
+    prev : (optional) last id of a list encoded earlier that ids[0] continues; ids[0] is delta coded from
+           prev, so a long list can be encoded a block at a time and the bytes concatenated
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    deltas = np.diff(np.concatenate(([0], ids)))
+    starts = offsets[:-1][offsets[:-1] < offsets[1:]]
+    deltas[starts] = ids[starts]
+    if (prev is not None) and (len(ids) > 0):
+        deltas[0] = ids[0]-prev
+    if (len(deltas) > 0) and (deltas.min() < 0):
+        raise ValueError('postings: ids must be sorted and non-negative')
+    nb = np.ones(len(deltas), dtype=np.int64)
+    for j in xrange(1, 9):
+        nb += (deltas >= (1 << (7*j)))
+    ends = np.cumsum(nb)
+    pos = ends-nb
+    data = np.zeros(ends[-1] if (len(ends) > 0) else 0, dtype=np.uint8)
+    j = 0
+    while True:
+        m = (nb > j)
+        if not m.any():
+            break
+        byte = (deltas[m] >> (7*j)) & 0x7f
+        byte |= (nb[m] > j+1)*0x80
+        data[pos[m]+j] = byte
+        j += 1
+    byte_offsets = np.concatenate(([0], ends))[offsets]
+    return (data, byte_offsets)
+
+def decode(data):
+    """
+    decode(data) -> int64 array of the ids in one encoded posting list
+    """
+    return decode_many([data])[0]
+
+def decode_many(chunks):
+    """
+    decode_many(chunks) -> list of int64 id arrays, one for each encoded posting list in chunks
+    """
+    if (len(chunks)==0):
+        return []
+    sizes = [len(c) for c in chunks]
+    data = np.concatenate(chunks).astype(np.int64)
+    if (len(data)==0):
+        return [np.zeros(0, dtype=np.int64) for c in chunks]
+    last = (data < 0x80)
+    if last.all():
+        # One byte per delta
+        deltas = data
+        counts = sizes
+    else:
+        value_idx = np.concatenate(([0], np.cumsum(last)[:-1]))
+        value_start = np.nonzero(np.concatenate(([True], last[:-1])))[0]
+        shift = 7*(np.arange(len(data))-value_start[value_idx])
+        # Integer sums, so ids above 2^53 are exact
+        deltas = np.add.reduceat((data & 0x7f) << shift, value_start)
+        counts = np.bincount(np.repeat(np.arange(len(sizes)), sizes)[last], minlength=len(sizes))
+    # Deltas restart from 0 at the start of each list
+    ids = np.cumsum(deltas)
+    out = []
+    i = 0
+    for n in counts:
+        if (n==0):
+            out.append(np.zeros(0, dtype=np.int64))
+            continue
+        base = ids[i-1] if (i > 0) else 0
+        out.append(ids[i:i+n]-base)
+        i += n
+    return out
+
+def union(lists):
+    """union(lists) -> sorted unique ids in any of the id arrays"""
+    if (len(lists)==0):
+        return np.zeros(0, dtype=np.int64)
+    return np.unique(np.concatenate(lists))
+
+def intersect(a, b):
+    """intersect(a, b) -> sorted ids in both id arrays"""
+    return np.intersect1d(a, b)
+
+def vote_counts(lists):
+    """vote_counts(lists) -> (ids, counts): the ids in any of the id arrays and the number of arrays each is in;
+    each array should have unique ids"""
+    if (len(lists)==0):
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+    return np.unique(np.concatenate(lists), return_counts=True)
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+
+#
+# Benchmarks for the encode, index, retrieve and cluster hot paths
+#
+# Each (case, size) runs in its own process on fixed-seed synthetic data and reports
+# throughput, latency percentiles and peak memory as JSON, tagged with the git commit.
+# Use --baseline with the JSON from an earlier commit to flag regressions.
+#
+
+import argparse
+import datetime
+import json
+import numpy as np
+import os
+import platform
+import resource
+import subprocess
+import sys
+import timeit
+from canopy import canopy_gac
+from feat_store_dict import feat_store_dict
+from hash_store_dict import hash_store_dict
+from lsh_str import lsh_str_ngram_minhash
+from lsh_vec import lsh_vec
+from match_tools import create_canopy, create_hash_from_fs, compute_sparse_distances
+import synth_data
+
+# Benchmark configuration -- changing these makes results incomparable with earlier runs
+dim = 100
+cluster_size = 20
+num_queries = 1000
+config_vec = {"method":"rp_acos", "seed":25, "num_functions":6, "num_bits":16, "verbose":False}
+config_str = '{"seed":32, "n":4, "num_functions":10, "num_bits":32, "verbose":false, "lower_case":true}'
+config_feat = '[{"type": "vec", "name": "vector"}]'
+num_fns_per_band = 1
+canopy_thresh = 0.5
+gac_thresh = 0.3
+
+def _vectors(size, seed):
+    return synth_data.random_unit_vectors(size, dim, seed, num_clusters=max(1, size/cluster_size))
+
+def _vec_fs(size, seed):
+    X = _vectors(size, seed)
+    fs = feat_store_dict(config_feat)
+    for i in xrange(0, size):
+        fs.add(i, {'vector':X[i]})
+    return fs
+
+def _vec_hs(size, seed, index=True):
+    fs = _vec_fs(size, seed)
+    hs = create_hash_from_fs(fs, {'vector':lsh_vec}, {'vector':config_vec}, hash_store_dict, config_feat)
+    if index:
+        hs.create_indexes(num_fns_per_band)
+    return (fs, hs)
+
+def _cos_dist(x, y):
+    return 1.0-float(np.dot(x, y))
+
+# Each setup function returns (num_items, run) -- run() does the timed work once and returns
+# per-item latencies, or None when only the total time is meaningful
+
+def setup_lsh_vec_encode(size, seed):
+    X = _vectors(size, seed)
+    lsh = lsh_vec(config_vec)
+    lsh.encode(X[0])
+    def run():
+        return _time_calls(lsh.encode, X)
+    return (size, run)
+
+def setup_lsh_str_encode(size, seed):
+    (names, ids) = synth_data.synthetic_names(size, seed=seed)
+    lsh = lsh_str_ngram_minhash(config_str)
+    def run():
+        return _time_calls(lsh.encode, names)
+    return (size, run)
+
+def setup_create_hash_from_fs(size, seed):
+    fs = _vec_fs(size, seed)
+    def run():
+        create_hash_from_fs(fs, {'vector':lsh_vec}, {'vector':config_vec}, hash_store_dict, config_feat)
+    return (size, run)
+
+def setup_create_indexes(size, seed):
+    (fs, hs) = _vec_hs(size, seed, index=False)
+    def run():
+        hs.create_indexes(num_fns_per_band)
+    return (size, run)
+
+def setup_retrieve(size, seed):
+    (fs, hs) = _vec_hs(size, seed)
+    keys = hs.keys()[0:num_queries]
+    sigs = [hs[ky]['vector'] for ky in keys]
+    def run():
+        return _time_calls(lambda sig: hs.retrieve('vector', sig), sigs)
+    return (len(sigs), run)
+
+def setup_create_canopy(size, seed):
+    (fs, hs) = _vec_hs(size, seed)
+    def run():
+        create_canopy(hs, 'vector', seed, canopy_thresh)
+    return (size, run)
+
+def setup_compute_sparse_distances(size, seed):
+    (fs, hs) = _vec_hs(size, seed)
+    canopy = create_canopy(hs, 'vector', seed, canopy_thresh)
+    def run():
+        compute_sparse_distances(canopy, fs, 'vector', _cos_dist)
+    return (size, run)
+
+def setup_canopy_gac(size, seed):
+    (fs, hs) = _vec_hs(size, seed)
+    canopy = create_canopy(hs, 'vector', seed, canopy_thresh)
+    d = compute_sparse_distances(canopy, fs, 'vector', _cos_dist)
+    def run():
+        canopy_gac(d, canopy, gac_thresh, 'average')
+    return (size, run)
+
+CASES = [('lsh_vec.encode', setup_lsh_vec_encode),
+         ('lsh_str.encode', setup_lsh_str_encode),
+         ('create_hash_from_fs', setup_create_hash_from_fs),
+         ('create_indexes', setup_create_indexes),
+         ('retrieve', setup_retrieve),
+         ('create_canopy', setup_create_canopy),
+         ('compute_sparse_distances', setup_compute_sparse_distances),
+         ('canopy_gac', setup_canopy_gac)]
+
+def _time_calls(fn, items):
+    timer = timeit.default_timer
+    lat = []
+    for x in items:
+        st = timer()
+        fn(x)
+        lat.append(timer()-st)
+    return lat
+
+def _peak_rss_mb():
+    # ru_maxrss is in KB on Linux and bytes on OS X
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if (sys.platform=='darwin'):
+        rss /= 1024
+    return rss/1024.0
+
+def run_case(case, size, repeat, seed):
+    """
+    run_case(case, size, repeat, seed) -> dictionary of measurements for one benchmark case
+
+    Setup is not timed.  The total time is the best of 'repeat' runs; latency percentiles are over all
+    calls of all runs for per-item cases and over the runs otherwise.
+    """
+    setup = dict(CASES)[case]
+    devnull = open(os.devnull, 'w')
+    stdout = sys.stdout
+    sys.stdout = devnull  # progress output of the library functions
+    try:
+        (num_items, run) = setup(size, seed)
+        setup_rss = _peak_rss_mb()
+        times = []
+        lat = []
+        for i in xrange(0, repeat):
+            st = timeit.default_timer()
+            r = run()
+            times.append(timeit.default_timer()-st)
+            if (r is not None):
+                lat.extend(r)
+    finally:
+        sys.stdout = stdout
+        devnull.close()
+    if (len(lat)==0):
+        lat = times
+    seconds = min(times)
+    pct = np.percentile(np.array(lat)*1000.0, [50, 90, 99])
+    return {'case':case, 'size':size, 'num_items':num_items, 'repeat':repeat, 'seconds':seconds,
+            'throughput':num_items/seconds if (seconds > 0) else None,
+            'latency_ms':{'p50':pct[0], 'p90':pct[1], 'p99':pct[2]},
+            'setup_peak_rss_mb':setup_rss, 'peak_rss_mb':_peak_rss_mb()}
+
+def git_info():
+    """git_info() -> (commit, dirty) of the repository, or (None, None) outside of git"""
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=cwd).strip()
+        status = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=cwd)
+        return (commit, len(status.strip()) > 0)
+    except (OSError, subprocess.CalledProcessError):
+        return (None, None)
+
+def compare(results, baseline, regress_ratio):
+    """compare(results, baseline, regress_ratio) -> number of cases slower than baseline by more than regress_ratio"""
+    base = dict([((r['case'], r['size']), r) for r in baseline['results']])
+    num_regress = 0
+    print >> sys.stderr, 'Comparison with baseline commit {}:'.format(baseline.get('commit'))
+    for r in results:
+        if ((r['case'], r['size']) not in base):
+            continue
+        b = base[(r['case'], r['size'])]
+        ratio = r['seconds']/b['seconds'] if (b['seconds'] > 0) else float('inf')
+        flag = ''
+        if (ratio > regress_ratio):
+            flag = 'REGRESSION'
+            num_regress += 1
+        print >> sys.stderr, '  {:28s} {:>8d} : {:10.4f} s -> {:10.4f} s ({:.2f}x time) {}'.format(r['case'], r['size'],
+                                                                                             b['seconds'], r['seconds'], ratio, flag)
+    return num_regress
+
+# Main driver: command line interface
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths on synthetic data.")
+    parser.add_argument("--sizes", type=str, help="comma separated data sizes", required=False, default='1000,10000')
+    parser.add_argument("--cases", type=str, help="comma separated cases (default all): {}".format(','.join([c for (c, s) in CASES])), required=False, default=None)
+    parser.add_argument("--repeat", type=int, help="number of timed runs per case", required=False, default=3)
+    parser.add_argument("--seed", type=int, help="seed for the synthetic data", required=False, default=0)
+    parser.add_argument("--outfile", type=str, help="JSON output file (default stdout)", required=False, default=None)
+    parser.add_argument("--baseline", type=str, help="JSON output of an earlier run to compare against (optional)", required=False, default=None)
+    parser.add_argument("--regress_ratio", type=float, help="time ratio vs baseline flagged as a regression", required=False, default=1.2)
+    parser.add_argument("--in_process", action='store_true', help="run all cases in this process; peak memory is then cumulative")
+    parser.add_argument("--worker", type=str, nargs=2, help=argparse.SUPPRESS, required=False, default=None)
+    args = parser.parse_args()
+
+    if (args.worker is not None):
+        # Child process for one case
+        print json.dumps(run_case(args.worker[0], int(args.worker[1]), args.repeat, args.seed))
+        sys.exit(0)
+
+    sizes = [int(x) for x in args.sizes.split(',')]
+    if (args.cases is None):
+        cases = [c for (c, s) in CASES]
+    else:
+        cases = args.cases.split(',')
+        for c in cases:
+            if (c not in dict(CASES)):
+                parser.error('unknown case: {}'.format(c))
+
+    results = []
+    for c in cases:
+        for size in sizes:
+            print >> sys.stderr, 'Running {} with size {} ...'.format(c, size)
+            if args.in_process:
+                r = run_case(c, size, args.repeat, args.seed)
+            else:
+                out = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--worker', c, str(size),
+                                               '--repeat', str(args.repeat), '--seed', str(args.seed)])
+                r = json.loads(out.strip().split('\n')[-1])
+            print >> sys.stderr, '  {:.4f} s, {:.1f} items/s, p50 {:.3f} ms, p99 {:.3f} ms, peak {:.1f} MB'.format(r['seconds'],
+                                   r['throughput'] or 0.0, r['latency_ms']['p50'], r['latency_ms']['p99'], r['peak_rss_mb'])
+            results.append(r)
+
+    (commit, dirty) = git_info()
+    report = {'commit':commit, 'dirty':dirty, 'time':datetime.datetime.utcnow().isoformat(),
+              'python':platform.python_version(), 'numpy':np.__version__, 'machine':platform.platform(),
+              'seed':args.seed, 'repeat':args.repeat, 'results':results}
+    if (args.outfile is not None):
+        outfile = open(args.outfile, 'w')
+        json.dump(report, outfile, indent=2, sort_keys=True)
+        outfile.close()
+    else:
+        print json.dumps(report, indent=2, sort_keys=True)
+
+    if (args.baseline is not None):
+        baseline_file = open(args.baseline, 'r')
+        baseline = json.load(baseline_file)
+        baseline_file.close()
+        if (compare(results, baseline, args.regress_ratio) > 0):
+            sys.exit(1)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+#
+# Recall versus cost of LSH configurations for vectors
+#
+# Exact k-NN ground truth is computed by blocked brute force for a sample of queries.  Each
+# configuration (num_functions, num_bits, num_fns_per_band) is then indexed with create_indexes
+# and queried with retrieve.  Reports recall@k, mean candidate set size, index memory and
+# query latency, and marks the Pareto optimal configurations.
+#
+
+import argparse
+import json
+import numpy as np
+import postings
+import random
+import sys
+import timeit
+from hash_store_dict import hash_store_dict
+from lsh_vec import lsh_vec
+from match_tools import create_hash_from_vec_matrix, exact_knn_cosine, open_vec_matrix
+import synth_data
+
+def index_memory(hs, feat_nm):
+    """index_memory(hs, feat_nm) -> approximate bytes used by the index of feature feat_nm"""
+    num_bytes = 0
+    for idx in hs.index[feat_nm]:
+        num_bytes += sys.getsizeof(idx)
+        for (tp, ids) in idx.iteritems():
+            num_bytes += sys.getsizeof(tp) + sum([sys.getsizeof(x) for x in tp]) + sys.getsizeof(ids) + sum([sys.getsizeof(i) for i in ids])
+    return num_bytes
+
+def eval_config(hs, feat_nm, num_fns_per_band, query_keys, truth):
+    """
+    eval_config(hs, feat_nm, num_fns_per_band, query_keys, truth) -> dictionary of measurements
+
+    truth = list of sets of the true k nearest neighbors of each query
+    """
+    st = timeit.default_timer()
+    hs.create_indexes(num_fns_per_band)
+    index_time = timeit.default_timer()-st
+    lat = []
+    recall = []
+    num_cand = []
+    for (ky, t) in zip(query_keys, truth):
+        sig = hs[ky][feat_nm]
+        st = timeit.default_timer()
+        cand = set(hs.index_key_dict.to_keys(postings.union(hs.retrieve_ids(feat_nm, sig))))
+        lat.append(timeit.default_timer()-st)
+        cand.discard(ky)
+        recall.append(len(cand & t)/float(len(t)))
+        num_cand.append(len(cand))
+    pct = np.percentile(np.array(lat)*1000.0, [50, 99])
+    return {'recall':float(np.mean(recall)), 'mean_candidates':float(np.mean(num_cand)),
+            'index_mb':index_memory(hs, feat_nm)/2.0**20, 'index_seconds':index_time,
+            'latency_ms':{'p50':pct[0], 'p99':pct[1]}}
+
+def pareto(results):
+    """pareto(results) -> marks results with 'pareto' True if no other result has higher recall and fewer candidates"""
+    best_recall = -1.0
+    for r in sorted(results, key=lambda r: (r['mean_candidates'], -r['recall'])):
+        r['pareto'] = (r['recall'] > best_recall)
+        best_recall = max(best_recall, r['recall'])
+    return results
+
+def _int_list(s):
+    return [int(x) for x in s.split(',')]
+
+# Main driver: command line interface
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Recall versus cost of LSH configurations.")
+    parser.add_argument("--matrix", type=str, help=".npy or raw matrix of vectors (default: synthetic clustered vectors)", required=False, default=None)
+    parser.add_argument("--dim", type=int, help="dimension -- for raw --matrix files and synthetic data", required=False, default=100)
+    parser.add_argument("--num_vecs", type=int, help="number of synthetic vectors", required=False, default=20000)
+    parser.add_argument("--num_queries", type=int, help="number of sampled queries", required=False, default=200)
+    parser.add_argument("--k", type=int, help="number of true neighbors for recall@k", required=False, default=10)
+    parser.add_argument("--num_functions", type=str, help="comma separated values to sweep", required=False, default='6,10,20')
+    parser.add_argument("--num_bits", type=str, help="comma separated values to sweep", required=False, default='8,12,16')
+    parser.add_argument("--num_fns_per_band", type=str, help="comma separated values to sweep", required=False, default='1,2')
+    parser.add_argument("--method", type=str, help="lsh_vec method", required=False, default='rp_acos')
+    parser.add_argument("--target_recall", type=float, help="pick the cheapest configuration with at least this recall", required=False, default=0.9)
+    parser.add_argument("--seed", type=int, help="seed for data, queries and hashes", required=False, default=0)
+    parser.add_argument("--outfile", type=str, help="JSON output file (optional)", required=False, default=None)
+    args = parser.parse_args()
+
+    # Data and ground truth
+    if (args.matrix is not None):
+        X = open_vec_matrix(args.matrix, np.float32, args.dim)
+    else:
+        X = synth_data.random_unit_vectors(args.num_vecs, args.dim, args.seed, num_clusters=max(1, args.num_vecs/20), dtype=np.float32)
+    keys = range(0, X.shape[0])
+    prng = random.Random(args.seed)
+    query_keys = prng.sample(keys, min(args.num_queries, len(keys)))
+    print 'Exact {}-NN for {} queries over {} vectors ...'.format(args.k, len(query_keys), X.shape[0])
+    st = timeit.default_timer()
+    (nbrs, sims) = exact_knn_cosine(X, query_keys, args.k)
+    print 'done in {:.2f} s'.format(timeit.default_timer()-st)
+    truth = [set(r) for r in nbrs.tolist()]
+
+    # Sweep
+    results = []
+    for num_fns in _int_list(args.num_functions):
+        for num_bits in _int_list(args.num_bits):
+            config = {"method":args.method, "seed":args.seed, "num_functions":num_fns, "num_bits":num_bits, "verbose":False}
+            st = timeit.default_timer()
+            hs = create_hash_from_vec_matrix(X, keys, lsh_vec, config, hash_store_dict, '[{"name": "vector"}]')
+            encode_time = timeit.default_timer()-st
+            for band in _int_list(args.num_fns_per_band):
+                if (band > num_fns):
+                    continue
+                r = eval_config(hs, 'vector', band, query_keys, truth)
+                r.update({'num_functions':num_fns, 'num_bits':num_bits, 'num_fns_per_band':band, 'encode_seconds':encode_time})
+                results.append(r)
+    pareto(results)
+
+    # Pareto table
+    print
+    print '{:>6s} {:>5s} {:>5s} {:>10s} {:>12s} {:>10s} {:>10s} {:>7s}'.format('L', 'bits', 'band', 'recall@{}'.format(args.k),
+                                                                           'candidates', 'index MB', 'p50 ms', 'pareto')
+    for r in sorted(results, key=lambda r: r['mean_candidates']):
+        print '{:6d} {:5d} {:5d} {:10.4f} {:12.1f} {:10.2f} {:10.4f} {:>7s}'.format(r['num_functions'], r['num_bits'],
+                                        r['num_fns_per_band'], r['recall'], r['mean_candidates'], r['index_mb'],
+                                        r['latency_ms']['p50'], '*' if r['pareto'] else '')
+    ok = [r for r in results if (r['recall'] >= args.target_recall)]
+    pick = None
+    if (len(ok) > 0):
+        pick = min(ok, key=lambda r: (r['mean_candidates'], r['index_mb']))
+        print '\nCheapest configuration with recall@{} >= {}: num_functions={}, num_bits={}, num_fns_per_band={}'.format(args.k,
+                                       args.target_recall, pick['num_functions'], pick['num_bits'], pick['num_fns_per_band'])
+    else:
+        print '\nNo configuration reaches recall@{} >= {}'.format(args.k, args.target_recall)
+
+    if (args.outfile is not None):
+        outfile = open(args.outfile, 'w')
+        json.dump({'num_vecs':X.shape[0], 'num_queries':len(query_keys), 'k':args.k, 'target_recall':args.target_recall,
+                   'pick':pick, 'results':results}, outfile, indent=2, sort_keys=True)
+        outfile.close()
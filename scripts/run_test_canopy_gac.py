@@ -7,7 +7,7 @@
 # Written by BC, 6/2015
 
 import numpy as np
-from canopy import canopy_gac
+from canopy import canopy_gac, pair_components, threshold_components
 
 # Define points
 x = [[0.0,0.0],[0.0,1.0],[1.0,0.0],[1.0,1.0],[2.0,2.0],[2.5,2.5]]
@@ -38,3 +38,31 @@ for c in clust1:
     print '{}'.format(c)
 print
 
+# Single linkage as connected components (union-find)
+print 'Connected components with a threshold of {}:'.format(thresh)
+clust2 = threshold_components(d, thresh)
+print 'Clusters are:'
+for c in clust2:
+    print '{}'.format(c)
+print
+
+# With one canopy holding every key, canopy_gac with single linkage is the same as the connected components
+prng = np.random.RandomState(72)
+pts = prng.rand(60, 2)
+d_rand = {}
+for i in xrange(0, len(pts)):
+    d_rand[i] = {}
+    for j in xrange(0, len(pts)):
+        d_rand[i][j] = np.linalg.norm(pts[i]-pts[j])
+for thresh in [0.05, 0.1, 0.2]:
+    clust_gac = canopy_gac(d_rand, [set(d_rand)], thresh, 'single')
+    clust_uf = threshold_components(d_rand, thresh)
+    print 'Threshold {}: {} clusters, same as canopy_gac single linkage with one canopy: {}'.format(thresh, len(clust_uf),
+          sorted(map(sorted, clust_gac))==sorted(map(sorted, clust_uf)))
+print
+
+# Connected components of a stream of pairs, with a singleton key that is in no pair
+pairs = [('@a', '@b'), ('@c', '@d'), ('@b', '@e'), ('@e', '@a'), ('@f', '@f')]
+print 'Pairs are: {}'.format(pairs)
+print 'Components are: {}'.format(sorted(map(sorted, pair_components(pairs, keys=['@z']))))
+print 'Components of no pairs: {}'.format(pair_components([]))
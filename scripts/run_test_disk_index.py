@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+#
+# Build disk indexes with a tiny memory budget and check them against create_sorted_indexes
+#
+
+import glob
+import numpy as np
+import os
+import shutil
+import tempfile
+from disk_index import disk_index, disk_index_builder
+from hash_store_dict import hash_store_dict
+from lsh_vec import lsh_vec
+from match_tools import create_disk_index_from_vec_matrix, create_hash_from_vec_matrix
+import synth_data
+
+# Some config constants
+num_eg = 6000
+dim = 32
+num_queries = 300
+memory_mb = 0.05
+
+X = synth_data.random_unit_vectors(num_eg, dim, 72, num_clusters=200)
+keys = [u'caf\xe9', u'\u4e2d\u6587'] + ['@user{}'.format(i) for i in xrange(2, num_eg)]
+
+# 16 bit codes give many short posting lists; 2 bit codes give a few lists much longer than a merge block
+configs = [{"method":"rp_acos", "seed":25, "num_functions":6, "num_bits":16, "verbose":False},
+           {"method":"rp_acos", "seed":25, "num_functions":4, "num_bits":2, "verbose":False}]
+
+tmp_dir = tempfile.mkdtemp()
+try:
+    for config in configs:
+        slices = [(0, 1), (1, 3), (3, 4)]
+        hs = create_hash_from_vec_matrix(X, keys, lsh_vec, config, hash_store_dict, '[{"name":"vector"}]')
+        for compress in [False, True]:
+            prefix = os.path.join(tmp_dir, 'vec{}.{}'.format(config['num_bits'], int(compress)))
+            create_disk_index_from_vec_matrix(X, iter(keys), lsh_vec, config, prefix, slices, memory_mb, compress=compress)
+            di = disk_index(prefix)
+            hs.create_sorted_indexes(slices={'vector':slices}, compress=compress)
+            num_bad = 0
+            max_len = 0
+            for k in keys[0:num_queries]:
+                ids_disk = di.retrieve_ids('vector', hs[k]['vector'])
+                ids_mem = hs.retrieve_ids('vector', hs[k]['vector'])
+                if (len(ids_disk) != len(ids_mem)) or any([not np.array_equal(a, b) for (a, b) in zip(ids_disk, ids_mem)]):
+                    num_bad += 1
+                if (di.retrieve('vector', hs[k]['vector']) != hs.retrieve('vector', hs[k]['vector'])):
+                    num_bad += 1
+                max_len = max([max_len]+[len(ids) for ids in ids_mem])
+            print '{} bits, compress={}: {} band keys, longest posting list {}, queries with different output: {}'.format(config['num_bits'],
+                  compress, [len(band[0]) for band in di.sorted_index['vector']], max_len, num_bad)
+    print 'Temporary directories left: {}'.format(len(glob.glob(os.path.join(tmp_dir, 'disk_index_*'))))
+    print
+
+    # Keys are read from disk as needed
+    print 'Keys 0, 1 and 2 of the disk index: {}'.format([di.item_keys.key_at(i) for i in xrange(0, 3)])
+    print 'Keys of ids [5, 0]: {}, number of keys {}'.format(di.item_keys.to_keys([5, 0]), len(di.item_keys))
+    try:
+        di.item_keys.key_at(num_eg)
+    except IndexError as e:
+        print 'Caught exception: {}'.format(e)
+
+    # Failed builds remove their temporary files
+    try:
+        create_disk_index_from_vec_matrix(X, iter(keys[0:num_eg-1]), lsh_vec, configs[0], os.path.join(tmp_dir, 'short'), slices, memory_mb)
+    except ValueError as e:
+        print 'Caught exception: {}'.format(e)
+    ib = disk_index_builder(os.path.join(tmp_dir, 'bad'), {'vector':slices}, memory_mb)
+    try:
+        ib.add_batch(['a', 'b\nc'], {'vector':[None, None]})
+    except ValueError as e:
+        print 'Caught exception: {}'.format(e)
+        ib.abort()
+    print 'Temporary directories left after errors: {}'.format(len(glob.glob(os.path.join(tmp_dir, 'disk_index_*'))))
+finally:
+    shutil.rmtree(tmp_dir)
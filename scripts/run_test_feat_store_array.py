@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+
+#
+# Run some checks on feat_store_array -- batches, quantized vectors and rejected batches
+#
+
+import numpy as np
+from feat_store_array import feat_store_array
+
+config = '[{"name":"vec","type":"vec","dim":3,"dtype":"float32"},{"name":"s","type":"str"},{"name":"n","type":"int"}]'
+prng = np.random.RandomState(72)
+X = prng.randn(5, 3).astype(np.float32)
+
+# Add a batch, a batch with a repeated key and single records
+fs = feat_store_array(config)
+fs.add_batch(['a', 'b', 'c'], {'vec':X[0:3], 's':['x', 'y', 'z'], 'n':[1, 2, 3]})
+fs.add_batch(['d', 'a'], {'vec':X[3:5], 's':['w', 'v']})
+fs.add('e', {'s':'u'})
+print 'Keys are: {}'.format(fs.keys())
+print 'Record a: {}'.format(fs['a'])
+print 'Vectors match: {}'.format(np.array_equal(fs.get_many(['a', 'b', 'c', 'd'], 'vec'), X[[4, 1, 2, 3]]))
+print 'str column: {}'.format(fs.get_many(fs.keys(), 's'))
+print
+
+# Rejected batches leave the store unchanged
+def snapshot(fs):
+    return (fs.keys(), [(ky, sorted([(nm, np.asarray(v).tolist()) for (nm, v) in rec.iteritems()])) for (ky, rec) in fs])
+before = snapshot(fs)
+for (bad_keys, bad_values) in [(['f', 'g'], {'vec':np.zeros((2, 4))}),
+                               (['f', 'g', 'h'], {'vec':np.zeros((1, 3)), 's':['x']}),
+                               (['f', 'g'], {'vec':np.zeros((2, 3)), 's':['x']}),
+                               (['f', 'g'], {'vec':np.zeros(3), 's':['x', 'y']}),
+                               (['f', 'a'], {'vec':np.zeros((2, 3)), 'n':[1]}),
+                               (['f'], {'name':['x']})]:
+    try:
+        fs.add_batch(bad_keys, bad_values)
+    except ValueError as e:
+        print 'Caught exception: {}'.format(e)
+print 'Store unchanged after rejected batches: {}'.format(snapshot(fs)==before)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+#
+# Run some checks on feat_store_mmap -- persistence, non-ascii keys and recovery after a crash
+#
+
+import numpy as np
+import os
+import shutil
+import tempfile
+from feat_store_mmap import feat_store_mmap
+
+tmp_dir = tempfile.mkdtemp()
+try:
+    path = os.path.join(tmp_dir, 'vectors.f32')
+    config = '[{{"name":"vector","type":"vec","path":"{}","dim":4,"dtype":"int8"}}]'.format(path)
+    prng = np.random.RandomState(72)
+    X = prng.randn(10, 4).astype(np.float32)
+    keys = [u'caf\xe9', 'na\xc3\xafve', u'\u4e2d\u6587'] + ['k{}'.format(i) for i in xrange(3, 10)]
+
+    # Add in two batches and reopen
+    fs = feat_store_mmap(config)
+    fs.add_batch(keys[0:6], {'vector':X[0:6]})
+    fs.add_batch([], {'vector':X[0:0]})
+    for i in xrange(6, 10):
+        fs.add(keys[i], {'vector':X[i]})
+    fs.close()
+    fs = feat_store_mmap(config)
+    print 'Reopened store: {} rows, keys {}'.format(fs.num_rows(), fs.keys()[0:3])
+    print "Byte string and unicode keys find the same row: {} {}".format(fs.row('na\xc3\xafve'), fs.row(u'na\xefve'))
+    err = np.abs(fs.get_rows('vector', 0, 10)-X).max()
+    print 'Max int8 error of the stored vectors: {:.4f}'.format(err)
+
+    # A rejected batch writes nothing
+    sizes = [os.path.getsize(fn) for fn in [path, path+'.scale', path+'.keys']]
+    for (bad_keys, bad_X) in [(['x', u'caf\xe9'], X[0:2]), (['x', 'x'], X[0:2]), (['x', 'y\n'], X[0:2]), (['x', 'y'], X[0:2, 0:3])]:
+        try:
+            fs.add_batch(bad_keys, {'vector':bad_X})
+        except ValueError as e:
+            print 'Caught exception: {}'.format(e)
+    fs.close()
+    print 'File sizes unchanged after rejected batches: {}'.format(sizes==[os.path.getsize(fn) for fn in [path, path+'.scale', path+'.keys']])
+    print
+
+    # Simulate a crash while appending: a partial row, and a whole row and scale without a key
+    f = open(path, 'ab')
+    f.write(np.zeros(6, dtype=np.int8).tobytes())
+    f.close()
+    f = open(path+'.scale', 'ab')
+    f.write(np.ones(1, dtype=np.float32).tobytes())
+    f.close()
+    print 'After the crash: vectors {} bytes, scales {} bytes, for {} keys'.format(os.path.getsize(path), os.path.getsize(path+'.scale'), 10)
+    fs = feat_store_mmap(config)
+    print 'After reopening: vectors {} bytes, scales {} bytes, {} rows'.format(os.path.getsize(path), os.path.getsize(path+'.scale'), fs.num_rows())
+    fs.add('k10', {'vector':X[0]})
+    fs.close()
+    fs = feat_store_mmap(config)
+    print 'Appending after recovery: {} rows, last row matches: {}'.format(fs.num_rows(), np.abs(fs['k10']['vector']-X[0]).max() < 0.05)
+    fs.close()
+    print
+
+    # Missing rows for written keys can't be recovered
+    f = open(path, 'r+b')
+    f.truncate(4*4)
+    f.close()
+    try:
+        feat_store_mmap(config)
+    except ValueError as e:
+        print 'Caught exception: {}'.format(e)
+finally:
+    shutil.rmtree(tmp_dir)
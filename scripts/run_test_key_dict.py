@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+#
+# Run some checks on key_dict -- interning, lookups and mapping ids back to keys
+#
+
+import numpy as np
+from key_dict import key_dict
+
+# Intern some keys, including non-ascii and repeated ones
+keys = ['@a', u'caf\xe9', '@b', u'\u4e2d\u6587', '@a', 72, ('2', 2)]
+kd = key_dict()
+ids = kd.intern_many(keys)
+print 'Keys are: {}'.format(keys)
+print 'Ids are: {} ({})'.format(ids.tolist(), ids.dtype)
+print 'Number of keys: {}'.format(len(kd))
+print 'Keys back from ids: {}'.format(kd.to_keys(ids))
+print 'Round trip is the same: {}'.format(kd.to_keys(ids)==keys)
+print 'Interning an existing key: {} -> {}; a new key: {} -> {}'.format(repr(u'caf\xe9'), kd.intern(u'caf\xe9'), '@c', kd.intern('@c'))
+print
+
+# Lookups never add keys
+print 'lookup_many with unknown keys: {}'.format(kd.lookup_many(['@b', '@zz', 72, u'caf\xe9'], missing=-1).tolist())
+print 'Number of keys after lookups: {}'.format(len(kd))
+print "'@zz' in kd: {}, '@a' in kd: {}".format('@zz' in kd, '@a' in kd)
+try:
+    kd.lookup('@zz')
+except KeyError as e:
+    print 'Caught exception for lookup of an unknown key: {}'.format(repr(e))
+for bad in [[len(kd)], [-1]]:
+    try:
+        kd.to_keys(bad)
+    except IndexError as e:
+        print 'Caught exception for to_keys({}): {}'.format(bad, e)
+try:
+    kd.key_at(len(kd))
+except IndexError as e:
+    print 'Caught exception for key_at({}): {}'.format(len(kd), e)
+print
+
+# Empty inputs
+kd_empty = key_dict()
+print 'Empty dictionary: {} keys, intern_many([]) = {}, to_keys([]) = {}, lookup_many([]) = {}'.format(len(kd_empty),
+      kd_empty.intern_many([]).tolist(), kd_empty.to_keys([]), kd_empty.lookup_many([]).tolist())
+print
+
+# Many keys -- the key array grows past its initial capacity
+num = 5*key_dict.INIT_CAPACITY+3
+big_keys = ['k{}'.format(i) for i in xrange(0, num)]
+kd_big = key_dict(big_keys)
+prng = np.random.RandomState(72)
+sample = prng.randint(0, num, size=1000)
+print 'Large dictionary: {} keys, ids in order: {}, lookups correct: {}'.format(len(kd_big),
+      kd_big.intern_many(big_keys).tolist()==range(0, num),
+      kd_big.to_keys(kd_big.lookup_many([big_keys[i] for i in sample])) == [big_keys[i] for i in sample])
+print 'keys() is the keys in id order: {}'.format(kd_big.keys()==big_keys)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+#
+# Write random match pairs in each match_output format and check that they read back the same
+#
+
+import codecs
+import gzip
+import numpy as np
+import os
+import shutil
+import tempfile
+from match_output import match_writer, match_reader
+
+# Some config constants
+num_queries = 3000
+max_cand = 20
+seed = 72
+
+# Random pairs with non-ascii keys, integer keys and queries without candidates
+prng = np.random.RandomState(seed)
+key_pool = [u'@user{}'.format(i) for i in xrange(0, 500)] + [u'caf\xe9', u'\u4e2d\u6587', u'na\xefve', 12345]
+features = ['userName', 'fullName']
+groups = []
+for i in xrange(0, num_queries):
+    num = prng.randint(0, max_cand+1)
+    cand = [key_pool[j] for j in prng.randint(0, len(key_pool), size=num)]
+    scores = prng.rand(num).astype(np.float32).tolist()
+    groups.append((key_pool[prng.randint(0, len(key_pool))], cand, features[i % 2], scores))
+pairs = [(unicode(ky1), unicode(ky2), nm, sc) for (ky1, cand, nm, scores) in groups for (ky2, sc) in zip(cand, scores)]
+print 'Number of pairs: {}'.format(len(pairs))
+
+def read_tsv(fn, fmt):
+    if (fmt=='tsv.gz'):
+        f = codecs.getreader('utf-8')(gzip.open(fn, 'rb'))
+    else:
+        f = codecs.open(fn, 'r', 'utf-8')
+    lines = f.read().split(u'\n')
+    f.close()
+    hdr = lines.pop(0)
+    out = []
+    for ln in lines:
+        if (ln==u''):
+            continue
+        (ky1, ky2, nm, sc) = ln.split(u'\t')
+        out.append((ky1, ky2, nm, np.float32(sc)))
+    return (hdr, out)
+
+tmp_dir = tempfile.mkdtemp()
+try:
+    for fmt in ['tsv', 'tsv.gz', 'bin']:
+        fn = os.path.join(tmp_dir, 'matches.' + fmt)
+        # A small buffer, so there are many flushes
+        mw = match_writer(fn, fmt, buffer_size=1000)
+        for (ky1, cand, nm, scores) in groups:
+            mw.add_many(ky1, cand, nm, scores)
+        mw.add_many(u'@nobody', [], 'userName', [])
+        mw.close()
+        if (fmt=='bin'):
+            mr = match_reader(fn)
+            out = [(unicode(ky1), unicode(ky2), nm, np.float32(sc)) for (ky1, ky2, nm, sc) in mr]
+            print 'bin: {} pairs, {} keys, features {}, score column {}'.format(len(mr), len(mr.key_dict), mr.features, mr.score.dtype)
+        else:
+            (hdr, out) = read_tsv(fn, fmt)
+            print '{}: header {}'.format(fmt, repr(hdr))
+        ref = [(ky1, ky2, nm, np.float32(sc)) for (ky1, ky2, nm, sc) in pairs]
+        print '{}: {} pairs read back, same as written: {}, writer count {}'.format(fmt, len(out), out==ref, mw.num_pairs)
+    print
+
+    # Edge cases -- an empty output, and keys that can't be written
+    fn = os.path.join(tmp_dir, 'empty.bin')
+    mw = match_writer(fn, 'bin')
+    mw.close()
+    mr = match_reader(fn)
+    print 'Empty bin output: {} pairs, {} keys, {} rows iterated'.format(len(mr), len(mr.key_dict), len(list(mr)))
+    mw = match_writer(os.path.join(tmp_dir, 'bad.bin'), 'bin')
+    mw.add('@a', u'@b\nc', 'userName', 0.5)
+    try:
+        mw.close()
+    except ValueError as e:
+        print 'Caught exception: {}'.format(e)
+    try:
+        match_writer(os.path.join(tmp_dir, 'x.txt'), 'csv')
+    except ValueError as e:
+        print 'Caught exception: {}'.format(e)
+    try:
+        match_writer(os.path.join(tmp_dir, 'x.tsv')).add_many('@a', ['@b'], 'userName', [])
+    except ValueError as e:
+        print 'Caught exception: {}'.format(e)
+finally:
+    shutil.rmtree(tmp_dir)
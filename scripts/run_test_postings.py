@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+#
+# Check the compressed posting lists in postings against plain numpy set operations
+#
+
+import numpy as np
+import postings
+
+# Some config constants
+num_lists = 2000
+max_len = 50
+seed = 72
+
+# Varint boundaries and large ids, one list each
+print 'Encode / decode of single ids at varint boundaries ...'
+num_bad = 0
+for x in [0, 1, 127, 128, 16383, 16384, 2**21, 2**31-1, 2**31, 2**40, 2**53+1, 2**62+12345, 2**63-1]:
+    data = postings.encode([x])
+    out = postings.decode(data)
+    if (out.tolist() != [x]):
+        num_bad += 1
+        print 'Different output for {}: {}'.format(x, out.tolist())
+print 'Number of ids with different output: {}'.format(num_bad)
+print
+
+# Random lists, including empty ones, with ids over a wide range of sizes
+prng = np.random.RandomState(seed)
+lists = []
+for i in xrange(0, num_lists):
+    num = prng.randint(0, max_len+1)
+    scale = 2**prng.randint(1, 62)
+    lists.append(np.unique(prng.randint(0, scale, size=num).astype(np.int64)))
+lists.append(np.zeros(0, dtype=np.int64))
+
+# One list at a time, and many lists at once with encode_groups / decode_many
+print 'Encode / decode of {} random lists ...'.format(len(lists))
+num_bad = 0
+for ids in lists:
+    if not np.array_equal(postings.decode(postings.encode(ids)), ids):
+        num_bad += 1
+print 'encode / decode -- number of lists with different output: {}'.format(num_bad)
+offsets = np.cumsum([0]+[len(ids) for ids in lists])
+(data, byte_offsets) = postings.encode_groups(np.concatenate(lists), offsets)
+chunks = [data[byte_offsets[j]:byte_offsets[j+1]] for j in xrange(0, len(lists))]
+out = postings.decode_many(chunks)
+num_bad = sum([not np.array_equal(a, b) for (a, b) in zip(out, lists)])
+print 'encode_groups / decode_many -- number of lists with different output: {}'.format(num_bad)
+print 'Compressed size: {} bytes for {} ids'.format(len(data), offsets[-1])
+print 'decode_many of no lists: {}, of empty lists: {}'.format(postings.decode_many([]), postings.decode_many([data[0:0], data[0:0]]))
+try:
+    postings.encode_groups(np.array([5, 3]), np.array([0, 2]))
+except ValueError as e:
+    print 'Caught exception for unsorted ids: {}'.format(e)
+print
+
+# Union, intersection and vote counts against Python sets
+print 'Union, intersection and vote counts ...'
+num_bad = 0
+for i in xrange(0, 500):
+    group = [lists[j] for j in prng.randint(0, len(lists), size=prng.randint(0, 5))]
+    ref = set()
+    counts = {}
+    for ids in group:
+        ref |= set(ids.tolist())
+        for x in ids.tolist():
+            counts[x] = counts.get(x, 0)+1
+    if (postings.union(group).tolist() != sorted(ref)):
+        num_bad += 1
+    (ids, cnt) = postings.vote_counts(group)
+    if (dict(zip(ids.tolist(), cnt.tolist())) != counts):
+        num_bad += 1
+    if (len(group) >= 2):
+        if (postings.intersect(group[0], group[1]).tolist() != sorted(set(group[0].tolist()) & set(group[1].tolist()))):
+            num_bad += 1
+a = np.array([1, 5, 2**40], dtype=np.int64)
+b = np.array([5, 2**40, 2**41], dtype=np.int64)
+if (postings.intersect(a, b).tolist() != [5, 2**40]) or (postings.vote_counts([a, b])[1].tolist() != [1, 2, 2, 1]):
+    num_bad += 1
+print 'Number of set operations with different output: {}'.format(num_bad)
+print 'union / vote_counts of no lists: {} {}'.format(postings.union([]), postings.vote_counts([]))
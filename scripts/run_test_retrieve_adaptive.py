@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+
+#
+# Run some checks on hash_store_dict.retrieve_adaptive -- budgets, sibling prefixes and dense regions
+#
+
+from hash_store_dict import hash_store_dict
+
+# Prefixes of length 3 at level 0 and 4 at level 1:
+#   (7,1,1) -- 4 keys, (7,2,3) -- 50 keys split over two children, (3,3,3) -- 5 keys
+hs = hash_store_dict('[{"name":"f"}]')
+for j in xrange(0, 4):
+    hs.add('b{}'.format(j), {'f':[7, 1, 1, 0]})
+for j in xrange(0, 50):
+    hs.add('a{}'.format(j), {'f':[7, 2, 3, j % 2]})
+for j in xrange(0, 5):
+    hs.add('c{}'.format(j), {'f':[3, 3, 3, 0]})
+hs.create_nested_indexes([3, 4])
+
+def show(query, budget, desc):
+    (keys, level) = hs.retrieve_adaptive('f', query, budget)
+    print '{}: query {}, budget {} -> {} keys at level {}, prefixes {}'.format(desc, query, budget, len(keys), level,
+          sorted(set([ky[0] for ky in keys])))
+
+# A query in the index stops at the first level within budget
+show([7, 1, 1, 0], 10, 'Prefix found')
+show([7, 2, 3, 1], 10, 'Longest prefix over budget')
+
+# Missing level 0 prefix: siblings by similarity, (7,1,1) then (7,2,3) then (3,3,3)
+show([7, 1, 2, 0], 60, 'Siblings within budget')
+show([7, 1, 2, 0], 9, 'Stop at the first sibling over budget')
+show([7, 1, 2, 0], 3, 'Every sibling over budget')
+
+# Missing level 1 prefix in a dense region -- both children are over budget
+show([7, 2, 3, 5], 10, 'Every child over budget')
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+#
+# Compare text_tools.normalize with the precompiled text_normalizer -- output and lines per second
+#
+
+import random
+import time
+import text_tools as tt
+
+# Some config constants
+num_lines = 20000
+seed = 72
+
+# Generate tweet-like lines with markup, punctuation, repeats and non-ascii characters
+prng = random.Random(seed)
+rewrite_hash = tt.create_utf8_rewrite_hash()
+pieces = [u'RT', u'@user_1', u'#tag', u'http://t.co/abc', u'www.example.com', u'<b>', u'&quot;', u'&mdash;',
+          u'[ID:123]', u'(PDF)', u'hahaha', u'jajaja', u'soooo', u'--', u'...', u'?!?', u'**', u'__x__', u"'quote'",
+          u'a,b', u'x: y', u'(word)', u'|', u'\\', u'a/ b', u'caf\xe9', u'na\xefve', u'\u201cq\u201d', u'\u2029',
+          u'\u4e2d', u'\x7f', u'  ', u'\t', u'hello', u'world', u'the', u'end.', u'!!??', u'?!', u'!', u'..?',
+          u'~"', u'"~x', u'~', u'"', u'Ha', u'rs', u'RT', u'(', u')', u'*.', u'-', u'/', u':', u';', u',']
+lines = []
+for i in xrange(0, num_lines):
+    lines.append(u' '.join([prng.choice(pieces) for j in xrange(0, prng.randint(0, 25))]))
+lines.append(u'caf\xe9'.encode('utf-8'))  # byte string
+
+# Check that the outputs are identical
+tn = tt.text_normalizer(rewrite_hash)
+num_diff = 0
+for ln in lines:
+    if (tt.normalize(ln, rewrite_hash) != tn.normalize(ln)) or \
+       (tt.convertUTF8_to_ascii(ln, rewrite_hash) != tn.convert_ascii(ln)):
+        num_diff += 1
+        if (num_diff <= 10):
+            print 'Different output for: {}'.format(repr(ln))
+print 'Number of lines with different output: {} / {}'.format(num_diff, len(lines))
+
+# Throughput
+st = time.time()
+for ln in lines:
+    tt.normalize(ln, rewrite_hash)
+en = time.time()
+print 'text_tools.normalize : {:.0f} lines per second'.format(len(lines)/(en-st))
+st = time.time()
+for ln in lines:
+    tn.normalize(ln)
+en = time.time()
+print 'text_normalizer.normalize : {:.0f} lines per second'.format(len(lines)/(en-st))
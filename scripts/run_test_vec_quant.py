@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+#
+# Re-ranking accuracy of float16 and int8 vector storage against float32
+#
+
+import json
+import numpy as np
+import time
+from feat_store_array import feat_store_array
+import vec_quant
+
+# Some config constants
+num_vecs = 20000
+num_clusters = 200
+dim = 100
+num_queries = 100
+top_k = 10
+seed = 72
+
+# Clustered unit vectors, so the top k have close cosines
+prng = np.random.RandomState(seed)
+centers = prng.randn(num_clusters, dim)
+X = centers[prng.randint(0, num_clusters, num_vecs)] + 0.5*prng.randn(num_vecs, dim)
+X /= np.linalg.norm(X, axis=1)[:, np.newaxis]
+X = X.astype(np.float32)
+queries = prng.randint(0, num_vecs, num_queries)
+
+# Store the vectors in each storage type
+keys = range(0, num_vecs)
+stores = {}
+for storage in ['float32', 'float16', 'int8']:
+    fs = feat_store_array(json.dumps([{"type": "vec", "name": "vector", "dtype": storage}]))
+    fs.add_batch(keys, {'vector':X})
+    stores[storage] = fs
+
+# Float32 baseline
+cos_base = X.dot(X[queries].T)
+top_base = np.argsort(-cos_base, axis=0)[0:top_k]
+
+for storage in ['float32', 'float16', 'int8']:
+    fs = stores[storage]
+    st = time.time()
+    if (storage=='int8'):
+        (Q, scale) = fs.get_quantized('vector', 0, num_vecs)
+        cos = np.array([vec_quant.dot_many(Q, scale, X[i]) for i in queries]).T
+        num_bytes = Q.nbytes + scale.nbytes
+    else:
+        V = fs.get_rows('vector', 0, num_vecs)
+        cos = np.array([V.dot(X[i]) for i in queries], dtype=np.float32).T
+        num_bytes = V.nbytes
+    en = time.time()
+    top = np.argsort(-cos, axis=0)[0:top_k]
+    recall = np.mean([len(set(top[:, j]) & set(top_base[:, j])) for j in xrange(0, num_queries)])/float(top_k)
+    err = np.abs(cos-cos_base)
+    print '{} : {} bytes per vector, cosine error mean {:.2e} max {:.2e}, recall@{} vs float32 {:.4f}, {:.1f} ms per query'.format(
+        storage, num_bytes/num_vecs, err.mean(), err.max(), top_k, recall, 1000.0*(en-st)/num_queries)
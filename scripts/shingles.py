@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+"""
+Shingling engine for strings -- integer shingle ids from a rolling hash
+"""
+
+import collections
+import random
+
+class shingler(object):
+    """
+    Produces integer ids for character n-grams of several sizes and for whitespace tokens in
+    one pass over a string.  No substrings are created; each id is a Rabin-Karp polynomial
+    hash of the shingle (mod 2^61-1) xor a per-size salt, so shingles of different sizes
+    (and tokens) map to different ids.
+
+    Typical usage:
+    >>> sh = shingler([3, 4, 'token'], seed=25)
+    >>> for sid in sh.ids(u'hello world'):
+    ...     print sid
+    """
+
+    MOD = 2**61-1
+    BASE = 1000003
+
+    def __init__ (self, sizes, seed=0):
+        """
+        sizes : list of n-gram sizes; the entry 'token' adds whitespace delimited tokens
+        seed  : seed for the per-size salts
+        """
+        if (type(sizes) is not list):
+            sizes = [sizes]
+        self.tokens = ('token' in sizes)
+        self.sizes = sorted([n for n in sizes if (n!='token')])
+        for n in self.sizes:
+            if (type(n) is not int) or (n <= 0):
+                raise ValueError('shingler: n-gram sizes must be positive integers or "token"')
+        prng = random.Random(seed)
+        self.salt = {}
+        self.base_pow = {}
+        for n in self.sizes:
+            self.salt[n] = prng.randint(0, shingler.MOD)
+            self.base_pow[n] = pow(shingler.BASE, n, shingler.MOD)
+        self.token_salt = prng.randint(0, shingler.MOD)
+        if (len(self.sizes) > 0):
+            self.max_n = self.sizes[-1]
+        else:
+            self.max_n = 0
+
+    def ids (self, s):
+        """
+        s : string to shingle
+        output: generator of integer shingle ids, each < 2^61
+        """
+        M = shingler.MOD
+        B = shingler.BASE
+        sizes = self.sizes
+        salt = self.salt
+        base_pow = self.base_pow
+
+        # prefix holds the rolling prefix hashes P[i-max_n] ... P[i]
+        prefix = collections.deque([0], maxlen=self.max_n+1)
+        h = 0
+        i = 0
+        tok_h = 0
+        tok_len = 0
+        for ch in s:
+            h = (h*B+ord(ch)) % M
+            prefix.append(h)
+            i += 1
+            for n in sizes:
+                if (i < n):
+                    break
+                yield ((h-prefix[-1-n]*base_pow[n]) % M) ^ salt[n]
+            if self.tokens:
+                if ch.isspace():
+                    if (tok_len > 0):
+                        yield tok_h ^ self.token_salt
+                        tok_h = 0
+                        tok_len = 0
+                else:
+                    tok_h = (tok_h*B+ord(ch)) % M
+                    tok_len += 1
+        if self.tokens and (tok_len > 0):
+            yield tok_h ^ self.token_salt
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+"""
+Exact string similarity -- character n-gram Jaccard and normalized edit distance, with batched
+verification of candidate pairs across a pool of processes
+"""
+
+import pool_tools
+
+MEASURES = ['jaccard', 'edit']
+
+def ngram_set(s, n):
+    """ngram_set(s, n) -> set of the character n-grams of s; a string shorter than n is its own n-gram"""
+    if (len(s) < n):
+        return set([s]) if (len(s) > 0) else set()
+    return set([s[i:i+n] for i in xrange(0, len(s)-n+1)])
+
+def jaccard(a, b):
+    """jaccard(a, b) -> Jaccard similarity of two sets; 0.0 if both are empty"""
+    if (len(a)==0) and (len(b)==0):
+        return 0.0
+    inter = len(a & b)
+    return float(inter)/(len(a)+len(b)-inter)
+
+def ngram_jaccard(s1, s2, n=3):
+    """ngram_jaccard(s1, s2, n=3) -> Jaccard similarity of the character n-gram sets of s1 and s2"""
+    return jaccard(ngram_set(s1, n), ngram_set(s2, n))
+
+def edit_distance(s1, s2, max_dist=None):
+    """
+    edit_distance(s1, s2, max_dist=None) -> Levenshtein distance between s1 and s2
+
+    With max_dist, returns max_dist+1 as soon as the distance is known to be larger.
+    """
+    if (len(s1) < len(s2)):
+        (s1, s2) = (s2, s1)
+    if (max_dist is not None) and (len(s1)-len(s2) > max_dist):
+        return max_dist+1
+    prev = range(0, len(s2)+1)
+    for (i, c1) in enumerate(s1):
+        cur = [i+1]
+        for (j, c2) in enumerate(s2):
+            cur.append(min(prev[j+1]+1, cur[j]+1, prev[j]+(c1!=c2)))
+        if (max_dist is not None) and (min(cur) > max_dist):
+            return max_dist+1
+        prev = cur
+    return prev[-1]
+
+def edit_similarity(s1, s2, threshold=None):
+    """
+    edit_similarity(s1, s2, threshold=None) -> 1 - edit_distance/max(len(s1), len(s2)); 0.0 if both are empty
+
+    With threshold, a similarity below threshold may be returned as any value below threshold.
+    """
+    m = max(len(s1), len(s2))
+    if (m==0):
+        return 0.0
+    max_dist = None
+    if (threshold is not None):
+        max_dist = int((1.0-threshold)*m+1e-9)
+    return 1.0-float(edit_distance(s1, s2, max_dist))/m
+
+def verify_groups(groups, measure='jaccard', threshold=0.5, n=3, num_workers=1, chunk_size=100):
+    """
+    verify_groups(groups, measure='jaccard', threshold=0.5, n=3, num_workers=1, chunk_size=100)
+
+    Generator that checks candidate pairs with an exact similarity and yields (tag, idx, scores) for each
+    group in input order.  idx are the indexes of the candidates with similarity >= threshold and scores
+    their similarities.
+
+    groups = iterable of (tag, query, candidates) -- tag is passed through, query is a string and
+             candidates a list of strings; the query's n-grams are computed once per group
+    measure = 'jaccard' -- character n-gram Jaccard
+              'edit' -- normalized edit similarity, see edit_similarity
+    num_workers = number of processes; 1 verifies in the calling process
+    chunk_size = number of groups sent to a worker at a time; at most 2*num_workers chunks are in flight
+                 (see pool_tools.imap_chunks), so groups are read from the input as results are consumed
+    """
+    if (measure not in MEASURES):
+        raise ValueError('verify_groups: unknown measure {}'.format(measure))
+    return pool_tools.imap_chunks(_verify_chunk, groups, chunk_size, num_workers, _verify_state, (measure, threshold, n))
+
+def _verify_state(measure, threshold, n):
+    return (measure, threshold, n)
+
+def _verify_chunk(state, chunk):
+    (measure, threshold, n) = state
+    out = []
+    for (tag, query, candidates) in chunk:
+        idx = []
+        scores = []
+        if (measure=='jaccard'):
+            q = ngram_set(query, n)
+            for (i, s) in enumerate(candidates):
+                sim = jaccard(q, ngram_set(s, n))
+                if (sim >= threshold):
+                    idx.append(i)
+                    scores.append(sim)
+        else:
+            for (i, s) in enumerate(candidates):
+                sim = edit_similarity(query, s, threshold)
+                if (sim >= threshold):
+                    idx.append(i)
+                    scores.append(sim)
+        out.append((tag, idx, scores))
+    return out
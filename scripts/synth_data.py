@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+"""
+Synthetic data generators for tests and benchmarks
+"""
+
+import numpy as np
+import random
+
+_FIRST = [u'james', u'mary', u'john', u'patricia', u'robert', u'jennifer', u'michael', u'linda', u'william',
+          u'elizabeth', u'david', u'barbara', u'richard', u'susan', u'joseph', u'jessica', u'thomas', u'sarah',
+          u'charles', u'karen', u'maria', u'jose', u'wei', u'li', u'ahmed', u'fatima', u'olga', u'ivan']
+_SYLLABLES = [u'an', u'ber', u'ca', u'den', u'el', u'fo', u'gar', u'ha', u'in', u'jo', u'ka', u'lo', u'mi',
+              u'nor', u'o', u'per', u'qui', u'ro', u'son', u'ta', u'u', u'vi', u'wa', u'xi', u'ya', u'zo']
+_LETTERS = u'abcdefghijklmnopqrstuvwxyz'
+
+def random_unit_vectors(num, dim, seed=0, num_clusters=None, spread=0.5, dtype=np.float64):
+    """
+    random_unit_vectors(num, dim, seed=0, num_clusters=None, spread=0.5, dtype=np.float64)
+
+    num x dim array of random unit vectors, one per row.  If num_clusters is given, vectors are
+    Gaussian perturbations (standard deviation 'spread' per coordinate) of num_clusters random
+    centers, so each vector has near neighbors.
+    """
+    prng = np.random.RandomState(seed)
+    if (num_clusters is None):
+        X = prng.randn(num, dim)
+    else:
+        centers = prng.randn(num_clusters, dim)
+        X = centers[prng.randint(0, num_clusters, num)] + spread*prng.randn(num, dim)
+    nrm = np.linalg.norm(X, axis=1)
+    nrm[nrm==0] = 1.0
+    X /= nrm[:, np.newaxis]
+    return X.astype(dtype)
+
+def synthetic_names(num, dup_rate=0.2, seed=0, max_edits=2):
+    """
+    synthetic_names(num, dup_rate=0.2, seed=0, max_edits=2) -> (names, ids)
+
+    List of 'num' synthetic person names.  A fraction dup_rate of them are noisy duplicates of an
+    earlier name: up to max_edits character insertions, deletions, substitutions or transpositions,
+    and sometimes swapped first and last names.  ids[i] is the entity id of names[i], so names with
+    the same id are true matches.
+    """
+    prng = random.Random(seed)
+    names = []
+    ids = []
+    num_entities = 0
+    for i in xrange(0, num):
+        if (i > 0) and (prng.random() < dup_rate):
+            j = prng.randint(0, i-1)
+            names.append(_perturb_name(names[j], prng, max_edits))
+            ids.append(ids[j])
+        else:
+            last = u''.join([prng.choice(_SYLLABLES) for k in xrange(0, prng.randint(2, 4))])
+            names.append(prng.choice(_FIRST) + u' ' + last)
+            ids.append(num_entities)
+            num_entities += 1
+    return (names, ids)
+
+def _perturb_name(s, prng, max_edits):
+    if (prng.random() < 0.1) and (u' ' in s):
+        f = s.split(u' ', 1)
+        s = f[1] + u' ' + f[0]
+    s = list(s)
+    for k in xrange(0, prng.randint(1, max(1, max_edits))):
+        i = prng.randint(0, len(s)-1)
+        op = prng.randint(0, 3)
+        if (op==0):
+            s.insert(i, prng.choice(_LETTERS))
+        elif (op==1) and (len(s) > 1):
+            del s[i]
+        elif (op==2):
+            s[i] = prng.choice(_LETTERS)
+        elif (i+1 < len(s)):
+            (s[i], s[i+1]) = (s[i+1], s[i])
+    return u''.join(s)
@@ -10,6 +10,7 @@
 import argparse
 import sys
 import codecs
+import pool_tools
 import re
 from datetime import datetime
 
@@ -574,3 +575,192 @@ def remove_nonsentential_punctuation (ln):
 
     return ln
 
+def _compile_groups (groups):
+    return [(literals, [(re.compile(p), r) for (p, r) in subs]) for (literals, subs) in groups]
+
+def _dispatch (table):
+    # re.sub replacement that looks up the matched text
+    return lambda m: table[m.group(0)]
+
+def _first_char (m):
+    return m.group(0)[0]
+
+class text_normalizer(object):
+    """
+    Precompiled version of normalize() and convertUTF8_to_ascii() with identical output.
+
+    All patterns are compiled once.  The UTF-8 rewrite is a single translate() call and the
+    strip-and-collapse space cleanup is one substitution plus strip().  The substitutions of each
+    step are grouped by the literal they need to match (the '-' rules, the quote rules, ...) and a
+    group is skipped unless its literal is in the line, so a line only pays for the rules that can
+    fire.  Within a group, rules are merged into one alternation with a replacement dispatched on
+    the match only where the result can't change.
+
+    Typical usage:
+    >>> tn = text_normalizer()
+    >>> ln = tn.normalize(u'RT @user: caf\xe9 &quot;ol\xe9&quot; http://t.co/x')
+    """
+
+    def __init__ (self, rewrite_hash=None):
+        """x.__init__(rewrite_hash) -- rewrite_hash defaults to create_utf8_rewrite_hash()"""
+        if (rewrite_hash is None):
+            rewrite_hash = create_utf8_rewrite_hash()
+
+        # Translation tables: unicode chars >= 0x7f go through rewrite_hash, anything left is a space
+        # For byte strings every byte >= 0x7f is a space (byte keys never match the unicode keys)
+        self.utf8_table = dict([(ord(ky), unicode(val)) for (ky, val) in rewrite_hash.iteritems() if (ord(ky) >= 0x7f)])
+        self.non_ascii = re.compile(u'[^\x00-\x7e]')
+        self.byte_table = ''.join([chr(i) if (i < 0x7f) else ' ' for i in xrange(0, 256)])
+
+        # Clean up of spaces
+        self.ws = re.compile('\s+')
+        self.ws_last_char = re.compile('\s+.$')
+
+        # Each step is a list of (literals, substitutions); the substitutions run in order if any
+        # of the literals is in the line (None: always)
+
+        # remove_repeats
+        self.repeats = _compile_groups([
+            (None, [(r"(.)\1{2,}", r"\1\1\1")]),
+            (('ja', 'Ja'), [(r"(ja|Ja)(ja|Ja)+(j)?", r"jaja")]),
+            (('rs', 'Rs'), [(r"(rs|Rs)(Rs|rs)+(r)?", r"rsrs")]),
+            (('ha', 'Ha'), [(r"(ha|Ha)(Ha|ha)+(h)?", r"haha")])])
+
+        # remove_twitter_meta
+        self.twitter_meta = _compile_groups([
+            (('@',), [(r'\@[a-zA-Z0-9_]+', ' ')]),
+            (('RT',), [('\sRT\s', ' '), ('^RT\s', ' ')])])
+
+        # remove_nonsentential_punctuation
+        # '~' and '"' are single characters, and runs of '?' and '!' collapse to their first
+        # character whichever of the two rules sees them first
+        self.nonsentential = _compile_groups([
+            (('-',), [('^\-+', ''), ('\-\-+', ''), ('\s\-+', '')]),
+            (('~', '"'), [('[\~\"]', _dispatch({'~':' ', '"':''}))]),
+            (("'",), [("^\'+", ''), ("\'+$", ''), ("\'+\s+", ' '), ("\s+\'+", ' ')]),
+            (('`',), [("\s+\`+", ' '), ("^\`+", ' ')]),
+            ((':',), [("\:\s", " "), ("\:$", "")]),
+            ((';',), [('\;\s', ' '), ('\;$', '')]),
+            (('_',), [('\_+\s', ' '), ('^\_+', ''), ('_+$', ''), ('\_\_+', ' ')]),
+            ((',',), [('\,+([\#A-Za-z])', ' \g<1>'), ('\,+$', ' '), ('\,\.\s', ' '), ('\,\s', ' ')]),
+            (('*',), [('\s\*+', ' '), ('\*+\s', ' '), ('\*\.', ' '), ('\s\*+\s', ' '), ('^\*+', ''), ('\*+$', '')]),
+            (('?', '!', '..'), [('[\?\!][\?\!]+|\.\.+', _first_char)]),
+            (('/',), [('\s\/', ' '), ('\/\s', ' ')]),
+            (('|', '\\'), [(r'[\|\\]', ' ')]),
+            (('(',), [('\(([@\#A-Za-z0-9])', '\g<1>')]),
+            ((')',), [('([@\#A-Za-z0-9])\)', '\g<1> ')])])
+
+        # remove_markup
+        self.markup = _compile_groups([
+            (('<',), [('\<\S+\>', ' ')]),
+            (('http',), [('https?:\/\/?\s*\S+\s', ' '), ('https?:\/\/?\s*\S+$', ''), ('\(https?:\\\\\S+\)', ' ')]),
+            (('www.',), [('\(?www\.\S+\)?', ' ')]),
+            (('[ID:', '[id:'), [('\[ID:[^\]]+\]', ' '), ('\[id:[^\]]+\]', ' ')]),
+            (('(PDF)',), [('\(PDF\)', ' ')]),
+            (('&',), [(r'&mdash;|\&quot\;|\&\#39\;', ' ')])])
+
+    def __clean_spaces (self, ln):
+        # Same as removing leading and trailing whitespace and then collapsing runs to ' '
+        return self.ws.sub(' ', ln).strip(' ')
+
+    def __apply (self, groups, ln):
+        for (literals, subs) in groups:
+            if (literals is not None):
+                for lit in literals:
+                    if (lit in ln):
+                        break
+                else:
+                    continue
+            for (p, r) in subs:
+                ln = p.sub(r, ln)
+        return ln
+
+    def convert_ascii (self, ln):
+        """x.convert_ascii(ln) <==> convertUTF8_to_ascii(ln, rewrite_hash)"""
+        if isinstance(ln, unicode):
+            out = self.non_ascii.sub(u' ', ln.translate(self.utf8_table))
+        else:
+            out = ln.translate(self.byte_table)
+        out = self.__clean_spaces(out)
+        out = self.ws_last_char.sub('.', out)
+        return out
+
+    def remove_repeats (self, ln):
+        """x.remove_repeats(ln) <==> remove_repeats(ln)"""
+        return self.__apply(self.repeats, ln)
+
+    def remove_twitter_meta (self, ln):
+        """x.remove_twitter_meta(ln) <==> remove_twitter_meta(ln)"""
+        return self.__clean_spaces(self.__apply(self.twitter_meta, ln))
+
+    def remove_nonsentential_punctuation (self, ln):
+        """x.remove_nonsentential_punctuation(ln) <==> remove_nonsentential_punctuation(ln)"""
+        return self.__clean_spaces(self.__apply(self.nonsentential, ln))
+
+    def remove_markup (self, ln):
+        """x.remove_markup(ln) <==> remove_markup(ln)"""
+        return self.__clean_spaces(self.__apply(self.markup, ln))
+
+    def normalize (self, ln):
+        """x.normalize(ln) <==> normalize(ln, rewrite_hash)"""
+        ln = self.convert_ascii(ln)
+        ln = self.remove_twitter_meta(ln)
+        ln = self.remove_nonsentential_punctuation(ln)
+        ln = self.remove_markup(ln)
+        ln = self.remove_repeats(ln)
+        ln = self.ws.sub(' ', ln)
+        if (ln == ' '):
+            ln = ''
+        return ln
+
+def normalize_stream (items, mode='ascii', num_workers=1, chunk_size=1000, fields=None, rewrite_hash=None):
+    """
+    normalize_stream(items, mode='ascii', num_workers=1, chunk_size=1000, fields=None, rewrite_hash=None)
+
+    Generator that normalizes a stream of lines (or rows of TSV fields) and yields the results in input order.
+    Work is done in chunks of 'chunk_size' items across a pool of 'num_workers' processes.
+
+    items = iterator of strings, or of lists of strings (e.g., split TSV rows)
+    mode = 'ascii' -- convertUTF8_to_ascii
+           'lower_ascii' -- lower case then convertUTF8_to_ascii (same as lsh_str with lower_case and normalize)
+           'full' -- normalize
+    num_workers = number of processes; 1 normalizes in the calling process
+    chunk_size = number of items sent to a worker at a time
+    fields = for rows, indexes of the fields to normalize; default is all fields
+    rewrite_hash = defaults to create_utf8_rewrite_hash()
+    """
+    if (mode not in _NORMALIZE_MODES):
+        raise ValueError('normalize_stream: unknown mode {}'.format(mode))
+    return pool_tools.imap_chunks(_normalize_chunk, items, chunk_size, num_workers, _normalize_state,
+                                  (rewrite_hash, mode, fields))
+
+_NORMALIZE_MODES = ['ascii', 'lower_ascii', 'full']
+
+def _normalize_state (rewrite_hash, mode, fields):
+    # Built once per worker (or once in the calling process)
+    return (text_normalizer(rewrite_hash), mode, fields)
+
+def _normalize_one (tn, mode, s):
+    if (mode=='ascii'):
+        return tn.convert_ascii(s)
+    elif (mode=='lower_ascii'):
+        return tn.convert_ascii(s.lower())
+    else:
+        return tn.normalize(s)
+
+def _normalize_chunk (state, chunk):
+    (tn, mode, fields) = state
+    out = []
+    for item in chunk:
+        if isinstance(item, basestring):
+            out.append(_normalize_one(tn, mode, item))
+        else:
+            item = list(item)
+            if (fields is None):
+                idx = xrange(0, len(item))
+            else:
+                idx = fields
+            for i in idx:
+                item[i] = _normalize_one(tn, mode, item[i])
+            out.append(item)
+    return out
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+"""
+Reduced precision storage for vectors -- float16 and per-vector scaled int8
+"""
+
+import numpy as np
+
+STORAGE_TYPES = ('float64', 'float32', 'float16', 'int8')
+MAX_BLOCK_SIZE = 2**22  # Max number of floats in a temporary dequantized block
+
+def quantize_int8(X):
+    """
+    quantize_int8(X) -> (Q, scale)
+
+    Per-vector scaled int8 quantization.  Each row x of X is stored as q = round(x/s) with
+    s = max|x|/127, so x ~= s*q and the relative error per coordinate is at most 1/254 of the max.
+
+    X = vector or 2-D array of vectors, one per row
+    Q = int8 array, the same shape as X
+    scale = float32 scale per vector (a scalar for a 1-D X)
+    """
+    X = np.asarray(X, dtype=np.float32)
+    amax = np.max(np.abs(X), axis=-1)
+    scale = np.asarray(amax/127.0, dtype=np.float32)
+    s = np.where(scale > 0, scale, np.float32(1.0))
+    Q = np.rint(X/s[..., np.newaxis]).astype(np.int8)
+    return (Q, scale)
+
+def dequantize(Q, scale, dtype=np.float32):
+    """
+    dequantize(Q, scale, dtype=np.float32) -> array of vectors scale*Q
+    """
+    scale = np.asarray(scale, dtype=dtype)
+    return np.asarray(Q, dtype=dtype)*scale[..., np.newaxis]
+
+def dot_many(Q, scale, y):
+    """
+    dot_many(Q, scale, y) -> vector of inner products of the int8 vectors (Q, scale) with y
+
+    Rows are dequantized on the fly a block at a time, so no full precision copy of Q is made.
+    """
+    y = np.asarray(y, dtype=np.float32)
+    num = Q.shape[0]
+    out = np.empty(num, dtype=np.float32)
+    num_rows = max(1, MAX_BLOCK_SIZE // max(1, Q.shape[1]))
+    for i in xrange(0, num, num_rows):
+        out[i:i+num_rows] = np.asarray(Q[i:i+num_rows], dtype=np.float32).dot(y)
+    return out*scale
+
+def cos_many(Q, scale, y):
+    """
+    cos_many(Q, scale, y) -> vector of cosine similarities of the int8 vectors (Q, scale) with y
+    """
+    nrm = np.empty(Q.shape[0], dtype=np.float32)
+    num_rows = max(1, MAX_BLOCK_SIZE // max(1, Q.shape[1]))
+    for i in xrange(0, Q.shape[0], num_rows):
+        B = np.asarray(Q[i:i+num_rows], dtype=np.float32)
+        nrm[i:i+num_rows] = np.sqrt(np.einsum('ij,ij->i', B, B))
+    nrm *= np.linalg.norm(np.asarray(y, dtype=np.float32))
+    nrm[nrm==0] = 1.0
+    return dot_many(Q, np.ones(Q.shape[0], dtype=np.float32), y)/nrm
+
+def cos_dist(x, y):
+    """
+    cos_dist(x, y) -> 1 - cosine similarity of x and y; accumulates in float32 so float16 vectors can be
+    passed as is -- can be used as dist_fn for compute_sparse_distances
+    """
+    x = np.asarray(x, dtype=np.float32)
+    y = np.asarray(y, dtype=np.float32)
+    nrm = np.linalg.norm(x)*np.linalg.norm(y)
+    if (nrm==0):
+        return 1.0
+    return 1.0-float(x.dot(y))/nrm